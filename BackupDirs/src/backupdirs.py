@@ -2,6 +2,12 @@
 
 import sys
 
+from backupdirscore import cli
+
+# Headless runs are served before PyQt4 is imported at all.
+if __name__ == '__main__' and cli.isHeadless(sys.argv[1:]):
+  sys.exit(cli.main(sys.argv[1:]))
+
 from PyQt4 import QtGui, QtCore
 
 from optparse import OptionParser
@@ -77,9 +83,9 @@ class BackupDirs(QtGui.QMainWindow):
     toolbar.addAction(self.start)
     toolbar.addAction(self.stop)
   
-  def startBackup(self):
+  def startBackup(self, resume = False):
     """ Starting worker child in different thread, it'll notify us if it's ready. """
-    if self.main.startBackup():
+    if self.main.startBackup(resume):
       self.start.setEnabled(False)
       self.stop.setEnabled(True)
       self.isArchiving = True
@@ -157,19 +163,25 @@ class BackupDirs(QtGui.QMainWindow):
       '- Interruptible, asynchronous backups\n' \
       '- Progress indication\n' \
       '- File suffix filtering\n' \
+      '- Include/exclude rules\n' \
       '- Multi-threaded archiving\n' \
       '- Summary generation\n' \
+      '- Catalog of all runs and file versions\n' \
+      '- Watch mode scanning only what changed\n' \
+      '- Read, write and CPU limits, adjustable while running\n' \
+      '- Files read in disk order, optionally ahead of the archiver\n' \
+      '- Phase timings and metrics as JSON and Prometheus text\n' \
       '- Command line mode', QtGui.QMessageBox.Ok) 
 
 if __name__ == '__main__':
+  # Everything else (-n, --restore, -h, ...) is handled by backupdirscore.cli above.
   parser = OptionParser()
-  parser.add_option("-n", "--no-gui", action = "store_false", dest = "gui", default = True, help = "Disable GUI")
+  parser.add_option("--resume", action = "store_true", dest = "resume", default = False,
+                    help = "Continue the last interrupted backup run from its journal")
   (options, args) = parser.parse_args()
-  if options.gui:
-    app = QtGui.QApplication(sys.argv)
-    main = BackupDirs()
-    main.show()
-    sys.exit(app.exec_())
-  else:
-    main = BackupDirs(False)
-    main.startBackup()
+  app = QtGui.QApplication(sys.argv)
+  main = BackupDirs()
+  main.show()
+  if options.resume:
+    main.startBackup(True)
+  sys.exit(app.exec_())
@@ -0,0 +1 @@
+""" Qt independent archiving core of Backup Dirs. """
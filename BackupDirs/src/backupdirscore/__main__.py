@@ -0,0 +1,6 @@
+""" `python -m backupdirscore' runs the command line front end. """
+import sys
+
+from backupdirscore import cli
+
+sys.exit(cli.main())
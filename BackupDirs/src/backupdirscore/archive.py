@@ -0,0 +1,331 @@
+""" Single pass archiving: walk, filter, tar and compress straight into the target file. """
+import copy, os, tarfile, time, zipfile, zlib
+
+import archiveindex, checksum, compress, incompressible, prefetch, progress, scan
+
+# File name suffixes of the produced archives by compression method.
+archive_suffixes = { 'gz':'.tar.gz', 'bz2':'.tar.bz2', 'zip':'.zip' }
+# Appended to the name of an archive while it is being written.
+incomplete_suffix = '.incomplete'
+
+class UnreadableFile(IOError):
+  """ A file could not be read, or not completely. The archive is still intact: a tar member whose
+      data failed part way is padded with zeros to its size, as GNU tar does, a zip member is left
+      out of the central directory. """
+
+def archiveName(mydir, targetDir, compressionMethod, part = None):
+  """ Full path of the archive file belonging to `mydir', or to its `part'th file range if the
+      directory was split into several jobs. """
+  name = os.path.basename(mydir.rstrip('/'))
+  if part is not None:
+    name = '%s.part%03d' % (name, part)
+  return os.path.join(targetDir, name + archive_suffixes[compressionMethod])
+
+def removeIncomplete(backupFolder):
+  """ Remove the partial archives a crashed run may have left behind. """
+  for fileName in os.listdir(backupFolder):
+    if fileName.endswith(incomplete_suffix):
+      os.remove(os.path.join(backupFolder, fileName))
+
+def findArchives(name, backupFolder):
+  """ Archive files of directory `name' in `backupFolder', parts in order. """
+  found = []
+  for fileName in sorted(os.listdir(backupFolder)):
+    for suffix in archive_suffixes.values():
+      if fileName.endswith(suffix):
+        base = fileName[:-len(suffix)]
+        if base == name or (base.startswith(name + '.part') and base[len(name) + 5:].isdigit()):
+          found.append(os.path.join(backupFolder, fileName))
+  return found
+
+def openArchive(fileName):
+  """ A ZipFile, or a TarFile to be read in stream mode, of an archive written by StreamArchiver. """
+  if fileName.endswith(archive_suffixes['zip']):
+    return zipfile.ZipFile(fileName)
+  for compressionMethod in compress.parallel_methods:
+    if fileName.endswith(archive_suffixes[compressionMethod]):
+      return tarfile.open(fileName, 'r|', compress.DecompressingReader(open(fileName, 'rb'), compressionMethod))
+  raise ValueError('Unknown archive type of %s' % fileName)
+
+def archiveMembers(archiveFile):
+  """ The names of the files in `archiveFile' and its ArchiveIndex, or None if it has none. Only
+      archives with neither index nor checksums are read for the names. """
+  if os.path.isfile(archiveindex.indexName(archiveFile)):
+    index = archiveindex.ArchiveIndex.load(archiveindex.indexName(archiveFile))
+    return set(index.members), index
+  if checksum.hasChecksums(archiveFile):
+    return set(checksum.loadChecksums(checksum.checksumsName(archiveFile))), None
+  f = openArchive(archiveFile)
+  try:
+    if isinstance(f, zipfile.ZipFile):
+      return set(f.namelist()), None
+    return set([info.name for info in f if info.isreg()]), None
+  finally:
+    f.close()
+
+def readBlock(fileobj, size, path):
+  """ Up to `size' bytes of `fileobj', read errors become UnreadableFile. """
+  try:
+    return fileobj.read(size)
+  except (IOError, OSError), e:
+    raise UnreadableFile('%s: %s' % (path, e))
+
+class PeekedFile:
+  """ File object wrapper giving back `head', the bytes already read from `fileobj', first. """
+  def __init__(self, head, fileobj):
+    self.head = head
+    self.fileobj = fileobj
+
+  def read(self, size = -1):
+    if not self.head:
+      return self.fileobj.read(size)
+    if size < 0:
+      data, self.head = self.head + self.fileobj.read(), ''
+    else:
+      data, self.head = self.head[:size], self.head[size:]
+    return data
+
+def tarAdd(archive, tarinfo, fileobj, path):
+  """ TarFile.addfile() of Python 2.7 keeping the archive readable if `fileobj' fails or ends
+      early: the member is padded with zeros to tarinfo.size before UnreadableFile is raised. """
+  archive._check('aw')
+  tarinfo = copy.copy(tarinfo)
+  buf = tarinfo.tobuf(archive.format, archive.encoding, archive.errors)
+  archive.fileobj.write(buf)
+  archive.offset += len(buf)
+  remaining = tarinfo.size
+  error = None
+  while remaining > 0:
+    try:
+      data = readBlock(fileobj, min(remaining, tarfile.BLOCKSIZE * 20), path)
+    except UnreadableFile, e:
+      error = e
+      break
+    if not data:
+      error = UnreadableFile('%s: file shrank by %d bytes while it was archived' % (path, remaining))
+      break
+    archive.fileobj.write(data)
+    remaining -= len(data)
+  while remaining > 0:
+    archive.fileobj.write(tarfile.NUL * min(remaining, tarfile.BLOCKSIZE * 20))
+    remaining -= min(remaining, tarfile.BLOCKSIZE * 20)
+  blocks, remainder = divmod(tarinfo.size, tarfile.BLOCKSIZE)
+  if remainder > 0:
+    archive.fileobj.write(tarfile.NUL * (tarfile.BLOCKSIZE - remainder))
+    blocks += 1
+  archive.offset += blocks * tarfile.BLOCKSIZE
+  archive.members.append(tarinfo)
+  if error:
+    raise error
+
+def zipAdd(archive, arcname, path, fileobj, compressType, cpu = None, reportCompress = None):
+  """ ZipFile.write() of Python 2.7 taking the data from `fileobj', so that it can be counted and
+      hashed on the way. A `cpu' throttle.Gate is held while a block is compressed, the seconds
+      spent compressing are passed to reportCompress(seconds). If `fileobj' fails, UnreadableFile
+      is raised and the member never gets into the central directory. """
+  try:
+    st = os.stat(path)
+  except OSError, e:
+    raise UnreadableFile('%s: %s' % (path, e))
+  zinfo = zipfile.ZipInfo(arcname, time.localtime(st.st_mtime)[0:6])
+  zinfo.external_attr = (st.st_mode & 0xFFFF) << 16L
+  zinfo.compress_type = compressType
+  zinfo.file_size = st.st_size
+  zinfo.flag_bits = 0x00
+  zinfo.header_offset = archive.fp.tell()
+  archive._writecheck(zinfo)
+  archive._didModify = True
+  zinfo.CRC = crc = 0
+  zinfo.compress_size = compressSize = 0
+  # The compressed size can be larger than the uncompressed one.
+  zip64 = archive._allowZip64 and zinfo.file_size * 1.05 > zipfile.ZIP64_LIMIT
+  archive.fp.write(zinfo.FileHeader(zip64))
+  compressor = None
+  if compressType == zipfile.ZIP_DEFLATED:
+    compressor = zlib.compressobj(zlib.Z_DEFAULT_COMPRESSION, zlib.DEFLATED, -15)
+  fileSize = 0
+  while True:
+    data = readBlock(fileobj, tarfile.BLOCKSIZE * 20, path)
+    if not data:
+      break
+    fileSize += len(data)
+    crc = zlib.crc32(data, crc) & 0xffffffff
+    if compressor:
+      if cpu:
+        cpu.acquire()
+      try:
+        started = time.time()
+        data = compressor.compress(data)
+        if reportCompress:
+          reportCompress(time.time() - started)
+      finally:
+        if cpu:
+          cpu.release()
+      compressSize += len(data)
+    archive.fp.write(data)
+  if compressor:
+    started = time.time()
+    data = compressor.flush()
+    if reportCompress:
+      reportCompress(time.time() - started)
+    compressSize += len(data)
+    archive.fp.write(data)
+    zinfo.compress_size = compressSize
+  else:
+    zinfo.compress_size = fileSize
+  zinfo.CRC = crc
+  zinfo.file_size = fileSize
+  if not zip64 and archive._allowZip64 and max(fileSize, compressSize) > zipfile.ZIP64_LIMIT:
+    raise RuntimeError('File %s grew beyond the ZIP64 limit while it was archived' % path)
+  # Back to the header, it has the CRC and the sizes now.
+  position = archive.fp.tell()
+  archive.fp.seek(zinfo.header_offset, 0)
+  archive.fp.write(zinfo.FileHeader(zip64))
+  archive.fp.seek(position, 0)
+  archive.filelist.append(zinfo)
+  archive.NameToInfo[zinfo.filename] = zinfo
+
+class StreamArchiver:
+  """ Writes the members into one compressed archive file. Member data is copied in fixed size
+      blocks, so memory usage does not depend on the file sizes. With a process `pool' gzip and
+      bzip2 archives are compressed block-wise on `workers' processes. `reportProgress' is called
+      as reportProgress(bytesRead, bytesWritten, files) while the data moves, the `cancel' token
+      is checked for every block read. The data goes to `targetFile'.incomplete first and the
+      file only gets its name when it is closed successfully. Incompressible members are not
+      compressed again: zip stores them, gzip and bzip2 archives compress their blocks at the
+      cheapest level. They are told by the first bytes the archiver reads of them anyway. Their
+      bytes are reported as reportProgress(bytesStored). The
+      SHA-256 of every member is taken from the data on its way into the archive, the sums are
+      written next to the archive when it is closed. So is the archiveindex of tar archives, whose
+      compressed data is written in independent blocks to make them seekable. A `cpu'
+      throttle.Gate caps the blocks compressed at once. Members are read from `opener'(path),
+      e.g. a prefetch.Prefetcher's open(). """
+  def __init__(self, targetFile, compressionMethod, pool = None, workers = 1, reportProgress = None,
+               cancel = None, cpu = None, opener = None):
+    if compressionMethod not in archive_suffixes:
+      raise ValueError('Unknown compression method "%s"' % compressionMethod)
+    self.targetFile = targetFile
+    self.compressionMethod = compressionMethod
+    self.reportProgress = reportProgress or (lambda bytesRead = 0, bytesWritten = 0, files = 0, bytesStored = 0,
+      readTime = 0.0, writeTime = 0.0, throttledTime = 0.0, compressTime = 0.0: None)
+    self.cancel = cancel
+    self.cpu = cpu
+    self.opener = opener or prefetch.openSequential
+    self.compressor = None
+    self.checksums = [] # (member name, SHA-256) in archive order.
+    self.index = archiveindex.ArchiveIndex()
+    self.fileobj = progress.CountingFile(open(targetFile + incomplete_suffix, 'wb'),
+      lambda n, seconds: self.reportProgress(bytesWritten = n, writeTime = seconds), True)
+    if compressionMethod == 'zip':
+      self.archive = zipfile.ZipFile(self.fileobj, 'w', zipfile.ZIP_DEFLATED, True)
+    else:
+      # Stream mode (`|') never seeks back, the compressor sees the tar stream only once.
+      self.compressor = compress.ParallelCompressor(self.fileobj, compressionMethod, pool, workers, cpu,
+        self.reportCompress)
+      self.archive = tarfile.open(targetFile, 'w|', self.compressor)
+
+  def add(self, arcname, path):
+    """ Raise UnreadableFile if `path' cannot be read, other errors leave the archive damaged. """
+    try:
+      size = os.path.getsize(path)
+      f = checksum.HashingFile(self.opener(path))
+    except (IOError, OSError), e:
+      raise UnreadableFile('%s: %s' % (path, e))
+    try:
+      fileobj = progress.CountingFile(f, self.blockRead, True)
+      # The sample is the start of the member data, not read twice.
+      sample = ''
+      if incompressible.needsSample(path, size):
+        sample = readBlock(fileobj, incompressible.sample_size, path)
+      stored = incompressible.isIncompressible(path, size, sample)
+      fileobj = PeekedFile(sample, fileobj)
+      if self.compressionMethod == 'zip':
+        zipAdd(self.archive, arcname, path, fileobj, stored and zipfile.ZIP_STORED or zipfile.ZIP_DEFLATED, self.cpu,
+          self.reportCompress)
+      else:
+        try:
+          tarinfo = self.archive.gettarinfo(path, arcname)
+        except (IOError, OSError), e:
+          raise UnreadableFile('%s: %s' % (path, e))
+        # tarfile holds back up to a record of the stream, a little of the neighbouring members
+        # may end up at the level of this one.
+        self.compressor.setStored(stored)
+        tarAdd(self.archive, tarinfo, fileobj, path)
+        # The data ends where the archive is now, less the padding to full tar blocks.
+        padded = (tarinfo.size + tarfile.BLOCKSIZE - 1) / tarfile.BLOCKSIZE * tarfile.BLOCKSIZE
+        self.index.members[arcname] = archiveindex.IndexEntry(self.archive.offset - padded, tarinfo.size,
+          tarinfo.mode, tarinfo.mtime)
+    finally:
+      f.close()
+    self.checksums.append((arcname, f.hexdigest()))
+    self.reportProgress(files = 1, bytesStored = stored and size or 0)
+
+  def blockRead(self, size, seconds):
+    if self.cancel:
+      self.cancel.check()
+    self.reportProgress(bytesRead = size, readTime = seconds)
+
+  def reportCompress(self, seconds):
+    self.reportProgress(compressTime = seconds)
+
+  def close(self):
+    self.archive.close()
+    if self.compressor:
+      self.compressor.close()
+    self.fileobj.close()
+    checksumsFile = checksum.checksumsName(self.targetFile)
+    checksum.saveChecksums(checksumsFile + incomplete_suffix, self.checksums)
+    indexFile = None
+    if self.compressor:
+      indexFile = archiveindex.indexName(self.targetFile)
+      self.index.blocks = self.compressor.blocks
+      self.index.save(indexFile + incomplete_suffix)
+    os.rename(self.targetFile + incomplete_suffix, self.targetFile)
+    os.rename(checksumsFile + incomplete_suffix, checksumsFile)
+    if indexFile:
+      os.rename(indexFile + incomplete_suffix, indexFile)
+
+  def abort(self):
+    """ Drop the archive without finishing it and remove the partial file. """
+    if self.compressor:
+      self.compressor.discard()
+    self.fileobj.close()
+    try:
+      os.remove(self.targetFile + incomplete_suffix)
+    except OSError:
+      pass
+
+def archiveDir(mydir, targetDir, compressionMethod, fileSuffix, fileSizeLimit, pool = None, workers = 1,
+               files = None, part = None, reportProgress = None, cancel = None, cpu = None, readAhead = None,
+               reportFailure = None):
+  """ Archive `mydir' into `targetDir' in a single pass. Return the archive file name and the
+      arcnames of the files added to it. `files' is the file list of a previous scan.scanDir(),
+      the directory is scanned if it is missing.
+      With a prefetch.ReadAhead the files are read ahead of the archiver. The files that cannot be
+      read are passed to reportFailure(arcname, error). """
+  targetFile = archiveName(mydir, targetDir, compressionMethod, part)
+  if files is None:
+    files = scan.scanDir(mydir, fileSuffix, fileSizeLimit).files
+  prefetcher = readAhead and readAhead.prefetcher(files)
+  archiver = StreamArchiver(targetFile, compressionMethod, pool, workers, reportProgress, cancel, cpu,
+    prefetcher and prefetcher.open)
+  added = []
+  try:
+    for arcname, path, st in files:
+      if cancel:
+        cancel.check()
+      try:
+        archiver.add(arcname, path)
+        added.append(arcname)
+      except UnreadableFile, e:
+        # Vanished or unreadable file, tar would also just warn.
+        if reportFailure:
+          reportFailure(arcname, e)
+  except:
+    archiver.abort()
+    raise
+  finally:
+    if prefetcher:
+      prefetcher.close()
+  archiver.close()
+  return targetFile, added
@@ -0,0 +1,99 @@
+""" Random access to single members of the tar archives. Gzip and bzip2 archives consist of
+    independently compressed blocks, and the index next to each archive, `ARCHIVE.index.gz', maps
+    every member to the offset of its data in the tar stream and every block to its offset in
+    the file. Restoring one file seeks to the block holding it and decompresses from there. """
+import bisect, gzip
+
+import compress
+
+index_suffix = '.index.gz'
+
+def indexName(archiveFile):
+  return archiveFile + index_suffix
+
+class IndexEntry:
+  """ A member: where its data starts in the uncompressed tar stream, its size, mode and mtime. """
+  def __init__(self, offset, size, mode, mtime):
+    self.offset = offset
+    self.size = size
+    self.mode = mode
+    self.mtime = mtime
+
+class ArchiveIndex:
+  def __init__(self):
+    self.blocks = [] # (compressed offset, uncompressed offset), in file order.
+    self.members = {} # Member name -> IndexEntry.
+
+  @staticmethod
+  def load(fileName):
+    index = ArchiveIndex()
+    f = gzip.open(fileName, 'rb')
+    try:
+      for line in f:
+        fields = line.rstrip('\n').split('\t')
+        if fields[0] == 'B':
+          index.blocks.append((int(fields[1]), int(fields[2])))
+        elif fields[0] == 'M':
+          index.members[fields[1].decode('string_escape')] = IndexEntry(*[int(x) for x in fields[2:6]])
+    finally:
+      f.close()
+    return index
+
+  def save(self, fileName):
+    f = gzip.open(fileName, 'wb')
+    try:
+      for block in self.blocks:
+        f.write('B\t%d\t%d\n' % block)
+      for name in sorted(self.members):
+        entry = self.members[name]
+        f.write('M\t%s\t%d\t%d\t%d\t%d\n' % (name.encode('string_escape'), entry.offset, entry.size,
+          entry.mode, entry.mtime))
+    finally:
+      f.close()
+
+  def blockOf(self, offset):
+    """ The (compressed, uncompressed) offsets of the block holding uncompressed `offset'. """
+    i = bisect.bisect_right([block[1] for block in self.blocks], offset) - 1
+    return self.blocks[max(i, 0)]
+
+def copyData(source, target, size, archiveFile):
+  out = open(target, 'wb')
+  try:
+    while size > 0:
+      data = source.read(min(size, 1024 * 1024))
+      if not data:
+        raise IOError('%s ends within a member' % archiveFile)
+      out.write(data)
+      size -= len(data)
+  finally:
+    out.close()
+
+def skipData(source, size):
+  while size > 0:
+    data = source.read(min(size, 1024 * 1024))
+    if not data:
+      return
+    size -= len(data)
+
+def copyMembers(archiveFile, compressionMethod, index, members, done = None):
+  """ Write the data of the `members' of `archiveFile', (IndexEntry, target file) pairs in the order
+      of their offsets, into their target files, calling done(entry, target) after each. Members
+      in the same or adjacent blocks are decompressed in one pass, for the others the reader seeks
+      to their block, so only the blocks holding members are read. """
+  f = open(archiveFile, 'rb')
+  try:
+    source = None
+    position = 0 # Uncompressed offset of `source'.
+    for entry, target in members:
+      compressedOffset, uncompressedOffset = index.blockOf(entry.offset)
+      if source is None or position > entry.offset or position < uncompressedOffset:
+        f.seek(compressedOffset)
+        source = compress.DecompressingReader(f, compressionMethod)
+        position = uncompressedOffset
+      skipData(source, entry.offset - position)
+      copyData(source, target, entry.size, archiveFile)
+      position = entry.offset + entry.size
+      if done:
+        done(entry, target)
+  finally:
+    f.close()
@@ -0,0 +1,276 @@
+""" Reproducible benchmark of the archiving pipeline. Synthetic source trees are generated from fixed
+    seeds, then every combination of compression method, worker counts and file size limit is run
+    through engine.Archiver in a fresh process, one JSON (or CSV) record per run:
+
+      python -m backupdirscore.benchmark -o before.jsonl
+      python -m backupdirscore.benchmark --trees tiny,deep --methods gz --workers 1,4 --scale 0.1
+      python -m backupdirscore.benchmark --trees tiny --read-modes sequential,prefetch --cold-cache
+"""
+import binascii, multiprocessing, os, platform, random, resource, shutil, subprocess, sys, tempfile, time
+
+from optparse import OptionParser
+
+try:
+  import json
+except ImportError:
+  json = None
+
+# Bumped whenever the generated trees change, the results are comparable only within one version.
+trees_version = 1
+# Written last into a generated tree, a tree without it is generated again.
+stamp_name = '.benchmark-tree'
+# Column order of the records, also the CSV header.
+fields = ('tree', 'method', 'archiveWorkers', 'compressionWorkers', 'fileSizeLimit', 'readMode', 'coldCache', 'repeat',
+          'files', 'bytesIn', 'bytesOut', 'bytesStored', 'wallTime', 'filesPerSecond', 'mbPerSecond', 'ratio', 'peakRssKB',
+          'peakChildRssKB', 'completed', 'python', 'platform', 'cpus', 'treesVersion')
+# Read mode -> settings: plain reading in scan order, or inode order with the files read ahead.
+read_modes = { 'sequential':{ 'readOrder':'walk', 'prefetchThreads':'0' },
+               'prefetch':{ 'readOrder':'inode', 'prefetchThreads':'2' } }
+drop_caches = '/proc/sys/vm/drop_caches'
+
+words = ['backup', 'archive', 'directory', 'the', 'of', 'and', 'file', 'compress', 'block', 'tar', 'size',
+         'limit', 'worker', 'thread', 'queue', 'status', 'progress', 'suffix', 'target', 'settings']
+
+def randomBytes(rand, size):
+  """ Incompressible, yet the same for the same seed. """
+  if size == 0:
+    return ''
+  return binascii.unhexlify('%0*x' % (size * 2, rand.getrandbits(size * 8)))
+
+def textBytes(rand, size):
+  """ Compressible text of random words. """
+  chunks = []
+  length = 0
+  while length < size:
+    line = ' '.join([rand.choice(words) for _ in range(12)]) + '\n'
+    chunks.append(line)
+    length += len(line)
+  return ''.join(chunks)[:size]
+
+def writeFile(path, data):
+  f = open(path, 'wb')
+  try:
+    f.write(data)
+  finally:
+    f.close()
+
+def makeTiny(root, rand, scale):
+  """ Many small text files spread over a few directories. """
+  for d in range(8):
+    mydir = os.path.join(root, 'dir%02d' % d)
+    os.makedirs(mydir)
+    for i in range(max(1, int(625 * scale))):
+      writeFile(os.path.join(mydir, 'file%04d.txt' % i), textBytes(rand, rand.randint(64, 4096)))
+
+def makeHuge(root, rand, scale):
+  """ A few big files, half text and half random blocks. """
+  block = 1024 * 1024
+  for d in range(3):
+    mydir = os.path.join(root, 'dir%02d' % d)
+    os.makedirs(mydir)
+    f = open(os.path.join(mydir, 'huge.bin'), 'wb')
+    try:
+      for i in range(max(1, int(32 * scale))):
+        f.write(i % 2 and randomBytes(rand, block) or textBytes(rand, block))
+    finally:
+      f.close()
+
+def makeRandom(root, rand, scale):
+  """ Incompressible files of mixed sizes. """
+  for d in range(4):
+    mydir = os.path.join(root, 'dir%02d' % d)
+    os.makedirs(mydir)
+    for i in range(max(1, int(16 * scale))):
+      writeFile(os.path.join(mydir, 'random%02d.bin' % i), randomBytes(rand, rand.randint(64, 2048) * 1024))
+
+def makeDeep(root, rand, scale):
+  """ Long chains of nested directories with a few files on every level. """
+  for d in range(8):
+    mydir = os.path.join(root, 'dir%02d' % d)
+    for level in range(max(1, int(32 * scale))):
+      mydir = os.path.join(mydir, 'level%02d' % level)
+      os.makedirs(mydir)
+      for i in range(4):
+        writeFile(os.path.join(mydir, 'file%d.txt' % i), textBytes(rand, rand.randint(256, 8192)))
+
+# Name -> (generator, seed).
+trees = { 'tiny':(makeTiny, 1), 'huge':(makeHuge, 2), 'random':(makeRandom, 3), 'deep':(makeDeep, 4) }
+
+def makeTree(workDir, name, scale):
+  """ Generate the tree unless the same one is there already. Return its path. """
+  root = os.path.join(workDir, 'trees', name)
+  stamp = '%d %s\n' % (trees_version, scale)
+  stampFile = os.path.join(root, stamp_name)
+  if os.path.isfile(stampFile) and open(stampFile).read() == stamp:
+    return root
+  if os.path.isdir(root):
+    shutil.rmtree(root)
+  os.makedirs(root)
+  generator, seed = trees[name]
+  generator(root, random.Random(seed), scale)
+  writeFile(stampFile, stamp)
+  return root
+
+def treeDirs(root):
+  """ The top level directories of a tree, they are the directory list of the run. """
+  return [os.path.join(root, d) for d in sorted(os.listdir(root)) if os.path.isdir(os.path.join(root, d))]
+
+def outputBytes(targetDir):
+  """ Size of the archives written by the run, the parts of split directories included. Their
+      checksums and indexes, and the bookkeeping of the run, do not count. """
+  import archive
+  suffixes = tuple(archive.archive_suffixes.values())
+  total = 0
+  for path, dirs, files in os.walk(targetDir):
+    for f in files:
+      if f.endswith(suffixes):
+        total += os.path.getsize(os.path.join(path, f))
+  return total
+
+def runOne(config):
+  """ Body of the child process: one archiving run, measured. """
+  import engine, settings as _settings
+  # The paths of the index files are byte strings, json gives unicode.
+  config = dict([(str(name), str(value)) for name, value in config.items()])
+  settings = _settings.defaultSettings()
+  settings.update({ 'targetDir':config['targetDir'], 'backupMode':'full', 'compressionMethod':config['method'],
+    'compressionWorkers':str(config['compressionWorkers']), 'archiveWorkers':str(config['archiveWorkers']),
+    'fileSizeLimit':str(config['fileSizeLimit']), 'fileSuffix':'*' })
+  settings.update(read_modes[config['readMode']])
+  dirs = treeDirs(config['root'])
+  started = time.time()
+  archiver = engine.Archiver(dirs, settings)
+  completed = archiver.run() and len(archiver.getCompleted()) == len(dirs)
+  wallTime = time.time() - started
+  files = sum([len(archiver.getScan(mydir).files) for mydir in dirs])
+  bytesIn = sum([archiver.getScan(mydir).bytes for mydir in dirs])
+  bytesOut = outputBytes(archiver.getTargetDir())
+  bytesStored = archiver.progress.event(True).overall.bytesStored
+  return { 'files':files, 'bytesIn':bytesIn, 'bytesOut':bytesOut, 'bytesStored':bytesStored,
+    'wallTime':round(wallTime, 3),
+    'filesPerSecond':round(files / max(wallTime, 1e-6), 1),
+    'mbPerSecond':round(bytesIn / 1048576.0 / max(wallTime, 1e-6), 2),
+    'ratio':round(bytesOut and float(bytesIn) / bytesOut or 0.0, 3),
+    'peakRssKB':resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+    'peakChildRssKB':resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss,
+    'completed':bool(completed) }
+
+def childMain(configJson):
+  # Only the result may go to stdout, whatever else the run prints.
+  out = sys.stdout
+  sys.stdout = open(os.devnull, 'w')
+  result = runOne(json.loads(configJson))
+  out.write(json.dumps(result) + '\n')
+  out.flush()
+  return 0
+
+def dropCaches():
+  """ Empty the page cache, so that the run reads from the disk. Needs root on Linux. """
+  subprocess.call(['sync'])
+  writeFile(drop_caches, '3\n')
+
+def runChild(config):
+  """ A fresh process per run, so that peak RSS belongs to that run only. """
+  script = os.path.abspath(__file__)
+  if script.endswith('.pyc') or script.endswith('.pyo'):
+    script = script[:-1]
+  child = subprocess.Popen([sys.executable, script, '--child', json.dumps(config)], stdout = subprocess.PIPE)
+  out = child.communicate()[0]
+  if child.returncode != 0:
+    raise RuntimeError('Benchmark run %s failed with exit code %d' % (config, child.returncode))
+  return json.loads(out.strip().splitlines()[-1])
+
+def splitList(value, convert = str):
+  return [convert(item) for item in value.split(',') if item]
+
+def optionParser():
+  parser = OptionParser(usage = '%prog [options]')
+  parser.add_option("--trees", dest = "trees", default = 'tiny,huge,random,deep', metavar = "LIST",
+                    help = "Synthetic trees to run on [default: %default]")
+  parser.add_option("--methods", dest = "methods", default = 'gz,bz2,zip', metavar = "LIST",
+                    help = "Compression methods [default: %default]")
+  parser.add_option("--workers", dest = "workers", default = '1,2,0', metavar = "LIST",
+                    help = "Archiving thread counts, 0 is the CPU count + 1 of the engine [default: %default]")
+  parser.add_option("--compression-workers", dest = "compressionWorkers", default = '1', metavar = "LIST",
+                    help = "Compressor process counts of gz and bz2 [default: %default]")
+  parser.add_option("--size-limits", dest = "sizeLimits", default = '1024,1000000', metavar = "LIST",
+                    help = "fileSizeLimit values in KB [default: %default]")
+  parser.add_option("--read-modes", dest = "readModes", default = 'sequential,prefetch', metavar = "LIST",
+                    help = "sequential or prefetch, see read_modes [default: %default]")
+  parser.add_option("--cold-cache", action = "store_true", dest = "coldCache", default = False,
+                    help = "Drop the page cache before every run, needs root")
+  parser.add_option("--scale", dest = "scale", type = "float", default = 1.0,
+                    help = "Multiplier of the tree sizes [default: %default]")
+  parser.add_option("--repeat", dest = "repeat", type = "int", default = 1,
+                    help = "Runs per combination [default: %default]")
+  parser.add_option("--work-dir", dest = "workDir", metavar = "DIR",
+                    help = "Where the trees are kept between invocations [default: a temporary directory]")
+  parser.add_option("-f", "--format", dest = "format", default = 'json', choices = ('json', 'csv'),
+                    help = "json (one object per line) or csv [default: %default]")
+  parser.add_option("-o", "--output", dest = "output", metavar = "FILE",
+                    help = "Write the records to FILE instead of stdout")
+  return parser
+
+def main(argv = None):
+  if argv is None:
+    argv = sys.argv[1:]
+  if json is None:
+    sys.stderr.write('Error: the benchmark needs the json module of Python 2.6 or newer\n')
+    return 2
+  if argv[:1] == ['--child']:
+    return childMain(argv[1])
+  options, args = optionParser().parse_args(argv)
+  unknown = [name for name in splitList(options.trees) if name not in trees] + \
+    [mode for mode in splitList(options.readModes) if mode not in read_modes]
+  if args or unknown:
+    sys.stderr.write('Error: unknown trees, read modes or arguments: %s\n' % ' '.join(unknown + args))
+    return 2
+  if options.coldCache and not os.access(drop_caches, os.W_OK):
+    sys.stderr.write('Error: --cold-cache needs write access to %s\n' % drop_caches)
+    return 2
+  workDir = options.workDir or tempfile.mkdtemp(prefix = 'backupdirs-benchmark-')
+  out = options.output and open(options.output, 'w') or sys.stdout
+  host = { 'python':platform.python_version(), 'platform':platform.platform(),
+           'cpus':multiprocessing.cpu_count(), 'treesVersion':trees_version }
+  if options.format == 'csv':
+    out.write(','.join(fields) + '\n')
+  try:
+    for name in splitList(options.trees):
+      sys.stderr.write('Generating %s tree...\n' % name)
+      root = makeTree(workDir, name, options.scale)
+      for method in splitList(options.methods):
+        for workers in splitList(options.workers, int):
+          for compressionWorkers in splitList(options.compressionWorkers, int):
+            for sizeLimit in splitList(options.sizeLimits, int):
+              for readMode in splitList(options.readModes):
+                for repeat in range(options.repeat):
+                  targetDir = tempfile.mkdtemp(prefix = 'target-', dir = workDir)
+                  config = { 'root':root, 'targetDir':targetDir, 'method':method, 'archiveWorkers':workers,
+                             'compressionWorkers':compressionWorkers, 'fileSizeLimit':sizeLimit, 'readMode':readMode }
+                  try:
+                    if options.coldCache:
+                      dropCaches()
+                    record = runChild(config)
+                  finally:
+                    shutil.rmtree(targetDir, True)
+                  record.update(host)
+                  record.update({ 'tree':name, 'method':method, 'archiveWorkers':workers,
+                    'compressionWorkers':compressionWorkers, 'fileSizeLimit':sizeLimit, 'readMode':readMode,
+                    'coldCache':options.coldCache, 'repeat':repeat })
+                  sys.stderr.write('%(tree)s %(method)s workers=%(archiveWorkers)d/%(compressionWorkers)d ' \
+                    'limit=%(fileSizeLimit)dK %(readMode)s: %(wallTime).2fs, %(mbPerSecond).1f MB/s, ' \
+                    'ratio %(ratio).2f\n' % record)
+                  if options.format == 'csv':
+                    out.write(','.join(['"%s"' % str(record[field]).replace('"', '""') for field in fields]) + '\n')
+                  else:
+                    out.write(json.dumps(record, sort_keys = True) + '\n')
+                  out.flush()
+  finally:
+    if out is not sys.stdout:
+      out.close()
+    if not options.workDir:
+      shutil.rmtree(workDir, True)
+  return 0
+
+if __name__ == '__main__':
+  sys.exit(main())
@@ -0,0 +1,20 @@
+""" Cooperative cancellation of a run. The engine checks the token between blocks, so a running
+    job notices it within a fraction of a second. """
+import threading
+
+class Cancelled(Exception):
+  """ Raised inside a job of a cancelled run. """
+
+class CancelToken:
+  def __init__(self):
+    self.event = threading.Event()
+
+  def cancel(self):
+    self.event.set()
+
+  def isCancelled(self):
+    return self.event.isSet()
+
+  def check(self):
+    if self.event.isSet():
+      raise Cancelled()
@@ -0,0 +1,216 @@
+""" SQLite catalog of all runs in the backup root, `catalog.sqlite' next to the backup-* folders:
+    the runs, their directories with sizes and durations, and every file version with the
+    archive holding it. A run is put in at its end in one transaction, readers see it completely
+    or not at all. Everything in it is read from the run folders, so it can be rebuilt. """
+import os, sqlite3, time
+
+import archive, dedup, incremental, journal
+
+catalog_name = 'catalog.sqlite'
+# Seconds a writer waits for the others, the GUI may be reading meanwhile.
+lock_timeout = 30
+
+schema = """
+create table if not exists runs (
+  id integer primary key,
+  folder text unique not null,
+  started real,
+  finished real,
+  backupMode text,
+  compressionMethod text,
+  complete integer
+);
+create table if not exists dirs (
+  id integer primary key,
+  run integer not null,
+  dir text,
+  name text not null,
+  indexFile text,
+  files integer,
+  bytes integer,
+  addedFiles integer,
+  addedBytes integer,
+  storedBytes integer,
+  elapsed real
+);
+create table if not exists files (
+  dir integer not null,
+  path text not null,
+  size integer,
+  mtime real,
+  mode integer,
+  added integer,
+  location text
+);
+create index if not exists dirs_run on dirs (run);
+create index if not exists dirs_name on dirs (name);
+create index if not exists files_dir on files (dir);
+create index if not exists files_path on files (path);
+"""
+
+def catalogName(backupRoot):
+  return os.path.join(backupRoot, catalog_name)
+
+def connect(backupRoot, create = True):
+  """ Without `create' a missing catalog is an IOError. """
+  if not create and not os.path.isfile(catalogName(backupRoot)):
+    raise IOError('No catalog in %s, --rebuild-catalog creates it from the backup folders' % backupRoot)
+  connection = sqlite3.connect(catalogName(backupRoot), lock_timeout)
+  connection.text_factory = str
+  connection.executescript(schema)
+  return connection
+
+def folderTime(folder):
+  """ Start time of the run from its folder name backup-YYYYmmdd_HHMMSS, None if it has another. """
+  try:
+    return time.mktime(time.strptime(os.path.basename(folder.rstrip('/'))[len('backup-'):], '%Y%m%d_%H%M%S'))
+  except ValueError:
+    return None
+
+def readElapsed(folder):
+  """ Directory -> elapsed seconds, from the README of the run. """
+  elapsed = {}
+  try:
+    f = open(os.path.join(folder, 'README'), 'r')
+  except IOError:
+    return elapsed
+  try:
+    for line in f:
+      fields = line.rstrip('\n').split('\t')
+      if len(fields) > 2 and not line.startswith('#') and ':' in fields[2]:
+        minutes, seconds = fields[2].split(':')
+        elapsed[fields[0]] = int(minutes) * 60 + int(seconds)
+  finally:
+    f.close()
+  return elapsed
+
+def previousDir(cursor, name, folder):
+  """ The catalog id of the directory `name' in the newest run before `folder', or None. """
+  row = cursor.execute('select dirs.id from dirs join runs on dirs.run = runs.id where dirs.name = ? and runs.folder < ? '
+    'order by runs.folder desc limit 1', (name, folder)).fetchone()
+  return row and row[0]
+
+def dirFiles(cursor, dirId):
+  """ Path -> (size, mtime, location) of the files of directory `dirId'. """
+  if dirId is None:
+    return {}
+  return dict([(row[0], row[1:]) for row in
+    cursor.execute('select path, size, mtime, location from files where dir = ?', (dirId,))])
+
+def insertDir(cursor, runId, mydir, name, indexFile, storedBytes, elapsed, files):
+  """ `files' are (path, size, mtime, mode, added, location). """
+  cursor.execute('insert into dirs (run, dir, name, indexFile, files, bytes, addedFiles, addedBytes, storedBytes, elapsed) '
+    'values (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)', (runId, mydir, name, indexFile, len(files), sum([f[1] for f in files]),
+    len([f for f in files if f[4]]), sum([f[1] for f in files if f[4]]), storedBytes, elapsed))
+  dirId = cursor.lastrowid
+  cursor.executemany('insert into files (dir, path, size, mtime, mode, added, location) values (?, ?, ?, ?, ?, ?, ?)',
+    [(dirId,) + f for f in files])
+
+def recordManifest(cursor, runId, folder, name, elapsed):
+  """ A directory of a full or incremental run. Its unchanged files are in the archives of the
+      run it is an increment of. """
+  folderName = os.path.basename(folder)
+  manifest = incremental.Manifest.load(os.path.join(folder, name + incremental.manifest_suffix))
+  locations = {}
+  storedBytes = 0
+  for archiveFile in archive.findArchives(name, folder):
+    storedBytes += os.path.getsize(archiveFile)
+    for path in archive.archiveMembers(archiveFile)[0]:
+      locations[path] = os.path.join(folderName, os.path.basename(archiveFile))
+  base = {}
+  if manifest.base:
+    row = cursor.execute('select dirs.id from dirs join runs on dirs.run = runs.id where dirs.name = ? and runs.folder = ?',
+      (name, manifest.base)).fetchone()
+    base = dirFiles(cursor, row and row[0])
+  files = []
+  for path in sorted(manifest.entries):
+    size, mtime, inode, mode = manifest.entries[path]
+    location = locations.get(path) or (path in base and base[path][2]) or None
+    files.append((path, size, mtime / 1000000.0, mode, int(path in locations), location))
+  insertDir(cursor, runId, manifest.dir, name, os.path.join(folderName, name + incremental.manifest_suffix), storedBytes,
+    elapsed.get(manifest.dir), files)
+
+def recordSnapshot(cursor, runId, folder, name, elapsed):
+  """ A directory of a dedup run. Its files are added if they differ from the previous run. """
+  folderName = os.path.basename(folder)
+  snapshot = dedup.Snapshot.load(os.path.join(folder, name + dedup.snapshot_suffix))
+  indexFile = os.path.join(folderName, name + dedup.snapshot_suffix)
+  previous = dirFiles(cursor, previousDir(cursor, name, folderName))
+  files = []
+  for path in sorted(snapshot.files):
+    size, mtime, inode, mode = snapshot.files[path][0]
+    mtime = mtime / 1000000.0
+    added = path not in previous or previous[path][:2] != (size, mtime)
+    files.append((path, size, mtime, mode, int(added), indexFile))
+  # The chunks are shared, they have no size of their own per directory.
+  insertDir(cursor, runId, snapshot.dir, name, indexFile, None, elapsed.get(snapshot.dir), files)
+
+def forget(cursor, folderName):
+  for (runId,) in cursor.execute('select id from runs where folder = ?', (folderName,)).fetchall():
+    cursor.execute('delete from files where dir in (select id from dirs where run = ?)', (runId,))
+    cursor.execute('delete from dirs where run = ?', (runId,))
+    cursor.execute('delete from runs where id = ?', (runId,))
+
+def recordRun(backupRoot, folder):
+  """ Put the run folder `folder' into the catalog of `backupRoot', replacing what it held about
+      it. Mirror runs have no index files, only the run is recorded. """
+  folder = folder.rstrip('/')
+  folderName = os.path.basename(folder)
+  settings = {}
+  complete = False
+  if os.path.isfile(os.path.join(folder, journal.journal_name)):
+    runJournal = journal.Journal.load(folder)
+    settings = runJournal.settings
+    complete = runJournal.finished
+  finished = None
+  if os.path.isfile(os.path.join(folder, 'README')):
+    finished = os.path.getmtime(os.path.join(folder, 'README'))
+  elapsed = readElapsed(folder)
+  connection = connect(backupRoot)
+  try:
+    with connection:
+      cursor = connection.cursor()
+      forget(cursor, folderName)
+      cursor.execute('insert into runs (folder, started, finished, backupMode, compressionMethod, complete) '
+        'values (?, ?, ?, ?, ?, ?)', (folderName, folderTime(folder), finished, settings.get('backupMode'),
+        settings.get('compressionMethod'), int(complete)))
+      runId = cursor.lastrowid
+      for fileName in sorted(os.listdir(folder)):
+        if fileName.endswith(incremental.manifest_suffix):
+          recordManifest(cursor, runId, folder, fileName[:-len(incremental.manifest_suffix)], elapsed)
+        elif fileName.endswith(dedup.snapshot_suffix):
+          recordSnapshot(cursor, runId, folder, fileName[:-len(dedup.snapshot_suffix)], elapsed)
+  finally:
+    connection.close()
+
+def rebuild(backupRoot):
+  """ Record every run folder of `backupRoot' again, oldest first. Return their names. """
+  folders = sorted([name for name in os.listdir(backupRoot)
+                    if name.startswith('backup-') and os.path.isdir(os.path.join(backupRoot, name))])
+  for name in folders:
+    recordRun(backupRoot, os.path.join(backupRoot, name))
+  return folders
+
+def runs(backupRoot):
+  """ Per run, oldest first: folder, backup mode, complete, seconds taken, directories, files,
+      bytes, files and bytes added, bytes the archives take. """
+  connection = connect(backupRoot, False)
+  try:
+    return connection.execute('select runs.folder, runs.backupMode, runs.complete, runs.finished - runs.started, '
+      'count(dirs.id), total(dirs.files), total(dirs.bytes), total(dirs.addedFiles), total(dirs.addedBytes), '
+      'total(dirs.storedBytes) from runs left join dirs on dirs.run = runs.id group by runs.id '
+      'order by runs.folder').fetchall()
+  finally:
+    connection.close()
+
+def history(backupRoot, path):
+  """ The versions of `path', NAME/RELATIVE/PATH of the backed up directory NAME, oldest first:
+      run folder, size, mtime, mode, added in that run, archive holding it. """
+  name, _, relPath = path.strip('/').partition('/')
+  connection = connect(backupRoot, False)
+  try:
+    return connection.execute('select runs.folder, files.size, files.mtime, files.mode, files.added, files.location '
+      'from files join dirs on files.dir = dirs.id join runs on dirs.run = runs.id '
+      'where files.path = ? and dirs.name = ? order by runs.folder', (relPath, name)).fetchall()
+  finally:
+    connection.close()
@@ -0,0 +1,50 @@
+""" SHA-256 of every archived file, computed while the archiver streams it. The sums of an archive
+    are kept next to it in `ARCHIVE.sha256', in the format of sha256sum except that the names are
+    string_escape'd. """
+import hashlib, os
+
+checksums_suffix = '.sha256'
+
+def checksumsName(archiveFile):
+  return archiveFile + checksums_suffix
+
+class HashingFile:
+  """ File object wrapper hashing the data read through it. """
+  def __init__(self, fileobj):
+    self.fileobj = fileobj
+    self.hash = hashlib.sha256()
+
+  def read(self, size = -1):
+    data = self.fileobj.read(size)
+    self.hash.update(data)
+    return data
+
+  def hexdigest(self):
+    return self.hash.hexdigest()
+
+  def __getattr__(self, name):
+    return getattr(self.fileobj, name)
+
+def saveChecksums(fileName, checksums):
+  """ `checksums' is a list of (archive member name, hex digest). """
+  f = open(fileName, 'w')
+  try:
+    for arcname, digest in checksums:
+      f.write('%s  %s\n' % (digest, arcname.encode('string_escape')))
+  finally:
+    f.close()
+
+def loadChecksums(fileName):
+  """ Archive member name -> hex digest. """
+  checksums = {}
+  f = open(fileName, 'r')
+  try:
+    for line in f:
+      digest, arcname = line.rstrip('\n').split('  ', 1)
+      checksums[arcname.decode('string_escape')] = digest
+  finally:
+    f.close()
+  return checksums
+
+def hasChecksums(archiveFile):
+  return os.path.isfile(checksumsName(archiveFile))
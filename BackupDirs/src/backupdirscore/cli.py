@@ -0,0 +1,264 @@
+""" Headless command line front end. Never imports PyQt4, so it starts fast and runs on servers
+    without X or Qt, e.g. from cron or systemd. """
+import signal, sys, threading, time
+
+from optparse import OptionParser
+
+import settings as _settings
+
+# Exit codes.
+exit_ok = 0
+exit_failed = 1 # Some directories could not be backed up.
+exit_usage = 2 # Bad options or settings.
+exit_cancelled = 3 # Stopped by SIGINT or SIGTERM, resumable with --resume.
+
+# The options of the GUI, see backupdirs.py.
+gui_options = ('--resume',)
+
+def optionParser():
+  parser = OptionParser(usage = '%prog [options]')
+  parser.add_option("-n", "--no-gui", action = "store_false", dest = "gui", default = False,
+                    help = "Disable GUI, always the case here")
+  parser.add_option("-c", "--config", dest = "config", default = _settings.settings_file, metavar = "FILE",
+                    help = "Settings file [default: %default]")
+  parser.add_option("-s", "--set", action = "append", dest = "overrides", default = [], metavar = "NAME=VALUE",
+                    help = "Override a setting of the settings file, may be repeated")
+  parser.add_option("-D", "--dir", action = "append", dest = "dirs", default = [], metavar = "DIR",
+                    help = "Back up DIR instead of the directory list of the settings file, may be repeated")
+  parser.add_option("--resume", action = "store_true", dest = "resume", default = False,
+                    help = "Continue the last interrupted backup run from its journal")
+  parser.add_option("-r", "--restore", dest = "restore", metavar = "BACKUP",
+                    help = "Restore all directories of a backup-* folder, applying chains of increments")
+  parser.add_option("-p", "--path", action = "append", dest = "paths", default = [], metavar = "DIR/PATH",
+                    help = "With --restore, only restore PATH of the backed up directory DIR, may be repeated")
+  parser.add_option("--verify", dest = "verify", metavar = "BACKUP",
+                    help = "Check the archives of a backup-* folder against their checksums")
+  parser.add_option("--runs", action = "store_true", dest = "runs", default = False,
+                    help = "List the runs of the catalog in the targetDir: sizes, what they added, durations")
+  parser.add_option("--history", dest = "history", metavar = "DIR/PATH",
+                    help = "List the versions of PATH of the backed up directory DIR in the catalog")
+  parser.add_option("--rebuild-catalog", action = "store_true", dest = "rebuildCatalog", default = False,
+                    help = "Record all backup-* folders of the targetDir in its catalog again")
+  parser.add_option("--watch", action = "store_true", dest = "watch", default = False,
+                    help = "Follow the directories with inotify until stopped, so that runs only scan what changed")
+  parser.add_option("--profile", action = "store_true", dest = "profile", default = False,
+                    help = "Profile the backup run with cProfile into profile.pstats of the run folder")
+  parser.add_option("-j", "--jobs", dest = "jobs", type = "int", default = 0, metavar = "N",
+                    help = "Processes for --verify and --restore [default: number of CPUs]")
+  parser.add_option("-d", "--destination", dest = "destination", default = ".", metavar = "DIR",
+                    help = "Where --restore puts the directories [default: %default]")
+  parser.add_option("-q", "--quiet", action = "store_true", dest = "quiet", default = False,
+                    help = "No progress output")
+  return parser
+
+def isHeadless(argv):
+  """ True if the arguments ask for something that needs no GUI. The GUI takes `gui_options' only,
+      any other argument is for the command line, which also rejects the unknown ones. """
+  for arg in argv:
+    if arg not in gui_options:
+      return True
+  return False
+
+def statusListener(quiet):
+  """ Directory statuses and warnings go to stderr, the reports about the run to stdout unless
+      `quiet'. """
+  def listener(mydir, status):
+    if mydir is not None:
+      sys.stderr.write('%s: %s\n' % (mydir, status))
+    elif status.startswith('Warning: '):
+      sys.stderr.write('%s\n' % status)
+    elif not quiet:
+      print status
+  return listener
+
+def isCatalogQuery(options):
+  return options.runs or options.history or options.rebuildCatalog
+
+def error(message):
+  sys.stderr.write('Error: %s\n' % message)
+
+def warning(message):
+  sys.stderr.write('Warning: %s\n' % message)
+
+def runBackup(archiver, loadSettings = None):
+  """ Run in a helper thread, so that the main thread stays responsive to signals. SIGHUP has the
+      run take the limits of loadSettings() from then on. """
+  def stop(signum, frame):
+    sys.stderr.write('Stopping...\n')
+    archiver.stopThread()
+  def reload(signum, frame):
+    try:
+      settings = loadSettings()
+    except IOError, e:
+      error('Unable to read the limits: %s' % e)
+      return
+    problems = _settings.checkSettings(settings)
+    if problems:
+      error('Limits not changed: %s' % '; '.join(problems))
+      return
+    archiver.setLimits(settings)
+    sys.stderr.write('Limits now: readLimit=%s writeLimit=%s cpuWorkers=%s\n' % (settings['readLimit'],
+      settings['writeLimit'], settings['cpuWorkers']))
+  signal.signal(signal.SIGINT, stop)
+  signal.signal(signal.SIGTERM, stop)
+  if loadSettings:
+    signal.signal(signal.SIGHUP, reload)
+  result = []
+  thread = threading.Thread(target = lambda: result.append(archiver.run()))
+  thread.daemon = True
+  thread.start()
+  while thread.isAlive():
+    thread.join(0.2)
+  return result and result[0]
+
+def verifyBackup(backupFolder, jobs, quiet):
+  import verify
+  started = time.time()
+  try:
+    results = verify.verifyBackup(backupFolder, jobs, not quiet and [verify.printVerifyProgress] or [])
+  except (IOError, OSError), e:
+    error(str(e))
+    return exit_failed
+  failed = 0
+  for name in sorted(results):
+    result = results[name]
+    print '%s\t%s\t%d members' % (result.problems and 'FAILED' or 'OK', name, result.members)
+    for problem in result.problems:
+      print '\t%s' % problem
+    if [problem for problem in result.problems if not problem.startswith('no checksums')]:
+      failed += 1
+  elapsed = max(time.time() - started, 1e-6)
+  size = sum([result.bytes for result in results.values()]) / (1024.0 * 1024)
+  print 'Verified %d archives and snapshots, %.1f MB in %.1fs, %.1f MB/s, %d failed' % (len(results), size,
+    elapsed, size / elapsed, failed)
+  if failed or not results:
+    return exit_failed
+  return exit_ok
+
+def queryCatalog(options, backupRoot):
+  import catalog, progress, sqlite3
+  mb = 1024.0 * 1024
+  try:
+    if options.rebuildCatalog:
+      folders = catalog.rebuild(backupRoot)
+      print 'Recorded %d runs in %s' % (len(folders), catalog.catalogName(backupRoot))
+    if options.runs:
+      rows = catalog.runs(backupRoot)
+      print 'Run\tMode\tState\tTime\tDirs\tFiles\tMB\tAdded files\tAdded MB\tStored MB'
+      for folder, mode, complete, seconds, dirs, files, size, addedFiles, addedSize, storedSize in rows:
+        print '%s\t%s\t%s\t%s\t%d\t%d\t%.1f\t%d\t%.1f\t%.1f' % (folder, mode or '-', complete and 'complete' or 'incomplete',
+          seconds is not None and progress.formatTime(seconds) or '-', dirs, files, size / mb, addedFiles, addedSize / mb,
+          storedSize / mb)
+    if options.history:
+      versions = catalog.history(backupRoot, options.history)
+      if not versions:
+        error('No version of %s in the catalog' % options.history)
+        return exit_failed
+      for folder, size, mtime, mode, added, location in versions:
+        print '%s\t%d\t%s\t%s\t%s' % (folder, size, time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(mtime)),
+          added and 'added' or 'unchanged', location or '-')
+  except (sqlite3.Error, IOError, OSError), e:
+    error(str(e))
+    return exit_failed
+  return exit_ok
+
+def applyOverrides(settings, overrides):
+  for override in overrides:
+    name, value = override.split('=', 1)
+    settings[name] = value
+
+def reloadSettings(options):
+  """ The settings file read again with the overrides, for changing the limits of a run. """
+  try:
+    settings = _settings.loadSettings(options.config)[1]
+  except IOError:
+    if options.config != _settings.settings_file:
+      raise
+    settings = _settings.defaultSettings()
+  applyOverrides(settings, options.overrides)
+  return settings
+
+def main(argv = None):
+  if argv is None:
+    argv = sys.argv[1:]
+  options, args = optionParser().parse_args(argv)
+  if args:
+    error('Unexpected arguments: %s' % ' '.join(args))
+    return exit_usage
+  if options.paths and not options.restore:
+    error('--path needs --restore')
+    return exit_usage
+  if options.restore:
+    import restore
+    listeners = not options.quiet and [restore.printRestoreProgress] or []
+    try:
+      if options.paths:
+        restored, missing = restore.restorePaths(options.restore, options.paths, options.destination, options.jobs,
+          listeners)
+      else:
+        restored, missing = restore.restoreBackup(options.restore, options.destination, options.jobs, listeners)
+      for path in restored:
+        print 'Restored %s' % path
+    except (IOError, OSError), e:
+      error(str(e))
+      return exit_failed
+    for path in missing:
+      warning('%s is in the manifest but in none of the archives, not restored' % path)
+    if missing:
+      return exit_failed
+    return exit_ok
+  if options.verify:
+    return verifyBackup(options.verify, options.jobs, options.quiet)
+  try:
+    dirs, settings = _settings.loadSettings(options.config)
+  except IOError, e:
+    if options.config != _settings.settings_file or not (options.dirs or isCatalogQuery(options)):
+      error('Unable to read settings from %s: %s' % (options.config, e))
+      return exit_usage
+    dirs, settings = [], _settings.defaultSettings()
+  for override in options.overrides:
+    if '=' not in override:
+      error('Overrides are NAME=VALUE, got "%s"' % override)
+      return exit_usage
+  applyOverrides(settings, options.overrides)
+  if options.dirs:
+    dirs = options.dirs
+  if isCatalogQuery(options):
+    return queryCatalog(options, settings['targetDir'])
+  problems = _settings.checkSettings(settings)
+  if not dirs:
+    problems.append('No directories to back up')
+  if not _settings.canWeStart(dirs, settings['targetDir']):
+    problems.append('The targetDir %s cannot be in the list of dirs to be archived' % settings['targetDir'])
+  if problems:
+    for problem in problems:
+      error(problem)
+    return exit_usage
+  if options.watch:
+    import watch
+    try:
+      watch.watchDirs(dirs, settings)
+    except (IOError, OSError), e:
+      error(str(e))
+      return exit_failed
+    return exit_ok
+  # Imported this late, --help and usage errors should not pay for it.
+  import engine, progress
+  archiver = engine.Archiver(dirs, settings, options.resume, options.profile)
+  archiver.addStatusListener(statusListener(options.quiet))
+  if not options.quiet:
+    archiver.addProgressListener(progress.printProgress)
+  finished = runBackup(archiver, lambda: reloadSettings(options))
+  completed = archiver.getCompleted()
+  print 'Backup %s in %s, completed %d of %d directories:' % (finished and 'finished' or 'cancelled',
+    archiver.getTargetDir(), len(completed), len(dirs))
+  for mydir in dirs:
+    print '%s\t%s' % (mydir in completed and 'completed' or 'incomplete', mydir)
+  if not finished:
+    return exit_cancelled
+  if len(completed) != len(dirs):
+    return exit_failed
+  return exit_ok
+
+if __name__ == '__main__':
+  sys.exit(main())
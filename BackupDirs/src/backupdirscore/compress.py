@@ -0,0 +1,188 @@
+""" pigz/pbzip2 style block-wise compression of a single stream, in parallel on a process pool.
+    The blocks can be decompressed on their own, which makes the archives seekable. """
+import bz2, collections, gzip, time, zlib
+from cStringIO import StringIO
+
+# Methods whose concatenated members still form one valid compressed file.
+parallel_methods = ('gz', 'bz2')
+# Uncompressed bytes per independently compressed block, bzip2 works in 900k blocks anyway.
+block_sizes = { 'gz':1024 * 1024, 'bz2':900 * 1024 }
+best_level = 9
+# The cheapest level of each method, for data that does not get smaller. gzip just stores it,
+# bzip2 has no such level.
+stored_levels = { 'gz':0, 'bz2':1 }
+
+def compressBlock(compressionMethod, data, level = best_level):
+  """ Compress one block into a complete gzip member or bzip2 stream. Runs in the pool processes. """
+  if compressionMethod == 'bz2':
+    return bz2.compress(data, level)
+  buf = StringIO()
+  member = gzip.GzipFile('', 'wb', level, buf)
+  member.write(data)
+  member.close()
+  return buf.getvalue()
+
+class ParallelCompressor:
+  """ Write-only file object. Cuts the written data into blocks, compresses them on `pool' and
+      writes the results to `fileobj' in the original order. At most two blocks per pool process
+      are in flight, so memory usage stays bounded however long the stream is. Without a pool the
+      blocks are compressed and written one by one in the calling thread. `blocks' lists the
+      (compressed offset, uncompressed offset) of every block written. A `cpu' throttle.Gate caps
+      the blocks being compressed at once: a block in flight on the pool holds a slot until it is
+      written, one compressed in the calling thread only while it is compressed. Incompressible
+      data is put into blocks of its own at the cheapest level, see setStored(). The seconds spent
+      compressing in the calling thread are passed to reportCompress(seconds); with a pool the
+      caller only waits for the results, that time is not told apart. """
+  def __init__(self, fileobj, compressionMethod, pool, workers, cpu = None, reportCompress = None):
+    if compressionMethod not in parallel_methods:
+      raise ValueError('Parallel compression is not supported for "%s"' % compressionMethod)
+    self.fileobj = fileobj
+    self.compressionMethod = compressionMethod
+    self.pool = pool
+    self.cpu = cpu
+    self.reportCompress = reportCompress
+    self.blockSize = block_sizes[compressionMethod]
+    self.maxPending = 2 * max(workers, 1)
+    self.level = best_level
+    self.pending = collections.deque() # (uncompressed offset, compressed block or AsyncResult)
+    self.buffer = []
+    self.bufferSize = 0
+    self.blocks = []
+    self.compressedOffset = 0
+    self.uncompressedOffset = 0
+
+  def write(self, data):
+    self.buffer.append(data)
+    self.bufferSize += len(data)
+    if self.bufferSize < self.blockSize:
+      return
+    data = ''.join(self.buffer)
+    offset = 0
+    while len(data) - offset >= self.blockSize:
+      self.submit(data[offset:offset + self.blockSize])
+      offset += self.blockSize
+    rest = data[offset:]
+    self.buffer = rest and [rest] or []
+    self.bufferSize = len(rest)
+
+  def setStored(self, stored):
+    """ Compress the data written from now on at the cheapest level if `stored', else at the best
+        one. The block being filled ends here, so that every block has a single level. """
+    level = stored and stored_levels[self.compressionMethod] or best_level
+    if level == self.level:
+      return
+    if self.bufferSize > 0:
+      self.submit(''.join(self.buffer))
+      self.buffer = []
+      self.bufferSize = 0
+    self.level = level
+
+  def submit(self, block):
+    if self.pool is None:
+      if self.cpu:
+        self.cpu.acquire()
+      try:
+        started = time.time()
+        result = compressBlock(self.compressionMethod, block, self.level)
+        if self.reportCompress:
+          self.reportCompress(time.time() - started)
+      finally:
+        if self.cpu:
+          self.cpu.release()
+      self.writeCompressed(self.uncompressedOffset, result)
+      self.uncompressedOffset += len(block)
+      return
+    if self.cpu:
+      self.cpu.acquire(giveBack = self.giveBack)
+    self.pending.append((self.uncompressedOffset, self.pool.apply_async(compressBlock, (self.compressionMethod, block,
+      self.level))))
+    self.uncompressedOffset += len(block)
+    while len(self.pending) > self.maxPending:
+      self.writeBlock()
+
+  def giveBack(self):
+    """ Without a free slot our own blocks in flight are written, so waiting never holds any. """
+    if not self.pending:
+      return False
+    self.writeBlock()
+    return True
+
+  def writeBlock(self):
+    """ Wait for the oldest block in flight and write it. """
+    uncompressedOffset, result = self.pending.popleft()
+    try:
+      result = result.get()
+    finally:
+      if self.cpu:
+        self.cpu.release()
+    self.writeCompressed(uncompressedOffset, result)
+
+  def writeCompressed(self, uncompressedOffset, result):
+    self.blocks.append((self.compressedOffset, uncompressedOffset))
+    self.fileobj.write(result)
+    self.compressedOffset += len(result)
+
+  def close(self):
+    """ Flush the last partial block and wait for all the results. `fileobj' is left open. """
+    if self.bufferSize > 0:
+      self.submit(''.join(self.buffer))
+    self.buffer = []
+    self.bufferSize = 0
+    while self.pending:
+      self.writeBlock()
+
+  def discard(self):
+    """ Drop the blocks in flight of an archive given up. """
+    if self.cpu:
+      for block in self.pending:
+        self.cpu.release()
+    self.pending.clear()
+
+class DecompressingReader:
+  """ Read-only file object over the concatenated gzip members or bzip2 streams of `fileobj', as
+      ParallelCompressor writes them. The bz2 module of Python 2 stops after the first stream. """
+  def __init__(self, fileobj, compressionMethod):
+    if compressionMethod not in parallel_methods:
+      raise ValueError('Unknown compression method "%s"' % compressionMethod)
+    self.fileobj = fileobj
+    self.compressionMethod = compressionMethod
+    self.decompressor = None
+    self.unused = '' # Compressed data after the end of the previous stream.
+    self.buffer = ''
+    self.eof = False
+
+  def newDecompressor(self):
+    if self.compressionMethod == 'bz2':
+      return bz2.BZ2Decompressor()
+    return zlib.decompressobj(16 + zlib.MAX_WBITS) # With the gzip header.
+
+  def fill(self):
+    if self.unused:
+      data, self.unused = self.unused, ''
+    else:
+      data = self.fileobj.read(64 * 1024)
+      if not data:
+        self.eof = True
+        return
+    if self.decompressor is None:
+      self.decompressor = self.newDecompressor()
+    try:
+      self.buffer += self.decompressor.decompress(data)
+    except EOFError:
+      # The stream ended right at the end of the previous read, this is the next one.
+      self.decompressor = self.newDecompressor()
+      self.buffer += self.decompressor.decompress(data)
+    if self.decompressor.unused_data:
+      self.unused = self.decompressor.unused_data
+      self.decompressor = None
+
+  def read(self, size = -1):
+    while not self.eof and (size < 0 or len(self.buffer) < size):
+      self.fill()
+    if size < 0:
+      size = len(self.buffer)
+    data, self.buffer = self.buffer[:size], self.buffer[size:]
+    return data
+
+  def close(self):
+    self.fileobj.close()
@@ -0,0 +1,274 @@
+""" Content defined chunking deduplication store. Files are cut into chunks at boundaries found
+    in their content, every chunk is stored once under its SHA-256 and a run only writes a
+    snapshot index listing the chunks of each file. """
+import bz2, gzip, hashlib, os, random, threading, time, zlib
+
+import archive, incompressible, incremental, prefetch, progress, scan
+
+snapshot_suffix = '.snapshot.gz'
+chunks_dir = 'chunks'
+# Chunk sizes, a boundary follows the minimum size after 64k on average as given by the 16 bit
+# boundary pattern.
+min_chunk = 16 * 1024
+max_chunk = 256 * 1024
+read_size = 1024 * 1024
+_random = random.Random(0x6765617) # Fixed seed, boundaries must not change between runs.
+_gear = [_random.getrandbits(32) for _ in range(256)]
+# Every byte value stands for one bit, the top one of its gear value, as a translate() table.
+_bits = ''.join([chr(g >> 31) for g in _gear])
+# A chunk ends after 16 bytes whose bits are this pattern. Without one up to the maximum size it
+# ends after the last match of the shorter backup pattern, so that few chunks are cut blindly.
+_pattern = ''.join([chr((0xB5C3 >> i) & 1) for i in range(16)])
+_backup = _pattern[:14]
+
+def cutPoint(data):
+  """ Length of the first chunk of the bytearray `data'. Only the window of the last 16 bytes
+      decides about a boundary, it is searched with translate() and find(), which run in C and
+      not byte by byte in Python. """
+  end = min(len(data), max_chunk)
+  if end <= min_chunk:
+    return end
+  start = min_chunk - len(_pattern)
+  bits = data[start:end].translate(_bits)
+  i = bits.find(_pattern)
+  if i >= 0:
+    return start + i + len(_pattern)
+  if end < max_chunk:
+    return end # The end of the file.
+  i = bits.rfind(_backup)
+  if i >= 0:
+    return start + i + len(_backup)
+  return end
+
+def chunkFile(f):
+  """ Generate the content defined chunks of the file object `f'. """
+  data = bytearray()
+  eof = False
+  while True:
+    while not eof and len(data) < max_chunk:
+      block = f.read(read_size)
+      if block:
+        data.extend(block)
+      else:
+        eof = True
+    if not data:
+      return
+    n = cutPoint(data)
+    yield str(data[:n])
+    del data[:n]
+
+class ChunkStore:
+  """ Chunks stored as `chunks/ab/abcdef...' under the backup root, shared by all runs and dirs.
+      The first byte of a chunk file tells the codec: `z' for zlib, `j' for bzip2, `n' for none.
+      A `cpu' throttle.Gate is held while a chunk is compressed. """
+  def __init__(self, backupRoot, compressionMethod = 'gz', cpu = None):
+    self.root = os.path.join(backupRoot, chunks_dir)
+    self.compressionMethod = compressionMethod
+    self.cpu = cpu
+    self.lock = threading.Lock()
+    self.newChunks = 0
+    self.newBytes = 0
+    self.reusedBytes = 0
+
+  def chunkName(self, digest):
+    return os.path.join(self.root, digest[:2], digest)
+
+  def put(self, data, reportProgress = None, stored = False):
+    """ Store `data' unless it is already there and return its key. `stored' data is not compressed. """
+    digest = hashlib.sha256(data).hexdigest()
+    fileName = self.chunkName(digest)
+    if os.path.exists(fileName):
+      with self.lock:
+        self.reusedBytes += len(data)
+      return digest
+    if stored:
+      packed = 'n' + data
+    else:
+      if self.cpu:
+        self.cpu.acquire()
+      try:
+        started = time.time()
+        if self.compressionMethod == 'bz2':
+          packed = 'j' + bz2.compress(data, 9)
+        else:
+          packed = 'z' + zlib.compress(data, 6)
+        if reportProgress:
+          reportProgress(compressTime = time.time() - started)
+      finally:
+        if self.cpu:
+          self.cpu.release()
+    directory = os.path.dirname(fileName)
+    if not os.path.isdir(directory):
+      try:
+        os.makedirs(directory)
+      except OSError:
+        pass # Created by another worker meanwhile.
+    # Written aside and renamed, so a chunk file is either complete or missing.
+    tmpName = '%s.%d.%d.tmp' % (fileName, os.getpid(), threading.current_thread().ident)
+    started = time.time()
+    f = open(tmpName, 'wb')
+    try:
+      f.write(packed)
+    finally:
+      f.close()
+    os.rename(tmpName, fileName)
+    if reportProgress:
+      reportProgress(bytesWritten = len(packed), writeTime = time.time() - started)
+    with self.lock:
+      self.newChunks += 1
+      self.newBytes += len(data)
+    return digest
+
+  def get(self, digest):
+    f = open(self.chunkName(digest), 'rb')
+    try:
+      packed = f.read()
+    finally:
+      f.close()
+    if packed[0] == 'n':
+      return packed[1:]
+    if packed[0] == 'j':
+      return bz2.decompress(packed[1:])
+    return zlib.decompress(packed[1:])
+
+class Snapshot:
+  """ Index of one directory in one run: manifest entry and chunk keys of every file. """
+  def __init__(self, mydir):
+    self.dir = mydir
+    self.files = {} # Relative path -> (incremental.entryOf(), [chunk keys]).
+
+  @staticmethod
+  def load(fileName):
+    snapshot = Snapshot(None)
+    f = gzip.open(fileName, 'rb')
+    try:
+      for line in f:
+        fields = line.rstrip('\n').split('\t')
+        if fields[0] == 'F':
+          chunks = fields[6] and fields[6].split(',') or []
+          snapshot.files[fields[1].decode('string_escape')] = (tuple([int(x) for x in fields[2:6]]), chunks)
+        elif fields[0] == 'dir':
+          snapshot.dir = fields[1].decode('string_escape')
+    finally:
+      f.close()
+    return snapshot
+
+  def save(self, fileName):
+    f = gzip.open(fileName, 'wb')
+    try:
+      f.write('dir\t%s\n' % self.dir.encode('string_escape'))
+      for path in sorted(self.files.keys()):
+        entry, chunks = self.files[path]
+        f.write('F\t%s\t%d\t%d\t%d\t%d\t%s\n' % ((path.encode('string_escape'),) + entry + (','.join(chunks),)))
+    finally:
+      f.close()
+
+def snapshotName(mydir, targetDir):
+  return os.path.join(targetDir, os.path.basename(mydir.rstrip('/')) + snapshot_suffix)
+
+def previousFiles(mydir, targetDir):
+  """ Files of the newest earlier snapshot of `mydir', empty if there is none. """
+  previous = incremental.findPrevious(mydir, targetDir, snapshot_suffix)
+  return previous and Snapshot.load(snapshotName(mydir, previous)).files or {}
+
+def unchangedFiles(files, old):
+  """ Split `files' into the snapshot entries that can be taken over from `old' as they are and
+      the files that have to be chunked. """
+  entries = {}
+  changed = []
+  for arcname, path, st in files:
+    if arcname in old and old[arcname][0] == incremental.entryOf(st):
+      entries[arcname] = old[arcname]
+    else:
+      changed.append((arcname, path, st))
+  return entries, changed
+
+def chunkFiles(files, old, store, reportProgress = None, cancel = None, readAhead = None, reportFailure = None):
+  """ Store the chunks of `files' and return their snapshot entries. Files whose entry is the same
+      as in `old' are not even read. The `cancel' token is checked for every chunk. With a
+      prefetch.ReadAhead the files are read ahead. The files that cannot be read get no entry and
+      are passed to reportFailure(arcname, error), failures of the store are raised. """
+  prefetcher = readAhead and readAhead.prefetcher(files)
+  try:
+    return chunkChanged(files, old, store, reportProgress, cancel, prefetcher and prefetcher.open
+      or prefetch.openSequential, reportFailure)
+  finally:
+    if prefetcher:
+      prefetcher.close()
+
+def chunkChanged(files, old, store, reportProgress, cancel, opener, reportFailure):
+  entries = {}
+  for arcname, path, st in files:
+    entry = incremental.entryOf(st)
+    if arcname in old and old[arcname][0] == entry:
+      entries[arcname] = old[arcname]
+      continue
+    try:
+      f = opener(path)
+    except (IOError, OSError), e:
+      # Vanished or unreadable file, tar would also just warn.
+      if reportFailure:
+        reportFailure(arcname, archive.UnreadableFile('%s: %s' % (path, e)))
+      continue
+    stored = None # Told by the first chunk.
+    if reportProgress:
+      f = progress.CountingFile(f, lambda n, seconds: reportProgress(bytesRead = n, readTime = seconds), True)
+    try:
+      chunks = []
+      # Only the reading is in the generator, the store's own failures are not caught here.
+      reader = chunkFile(f)
+      while True:
+        try:
+          chunk = next(reader, None)
+        except (IOError, OSError), e:
+          if reportFailure:
+            reportFailure(arcname, archive.UnreadableFile('%s: %s' % (path, e)))
+          chunks = None
+          break
+        if chunk is None:
+          break
+        if cancel:
+          cancel.check()
+        if stored is None:
+          stored = incompressible.isIncompressible(path, st.st_size, chunk)
+        chunks.append(store.put(chunk, reportProgress, stored))
+        if stored and reportProgress:
+          reportProgress(bytesStored = len(chunk))
+    finally:
+      f.close()
+    if chunks is None:
+      continue
+    entries[arcname] = (entry, chunks)
+    if reportProgress:
+      reportProgress(files = 1)
+  return entries
+
+def backupDir(mydir, targetDir, compressionMethod, fileSuffix, fileSizeLimit, store = None, files = None):
+  """ Put the chunks of `mydir' into the store next to `targetDir' and write the snapshot. """
+  if store is None:
+    store = ChunkStore(os.path.dirname(targetDir.rstrip('/')), compressionMethod)
+  if files is None:
+    files = scan.scanDir(mydir, fileSuffix, fileSizeLimit).files
+  snapshot = Snapshot(mydir)
+  snapshot.files = chunkFiles(files, previousFiles(mydir, targetDir), store)
+  fileName = snapshotName(mydir, targetDir)
+  snapshot.save(fileName)
+  return fileName
+
+def restoreEntries(store, target, files, done = None):
+  """ Rebuild the `files', (relative path, snapshot entry) pairs, below `target' from the chunks in
+      `store', with their mode and mtime. done(path, size) is called after each. The directories
+      have to exist. """
+  for path, (entry, chunks) in files:
+    fileName = os.path.join(target, path)
+    f = open(fileName, 'wb')
+    try:
+      for digest in chunks:
+        f.write(store.get(digest))
+    finally:
+      f.close()
+    os.chmod(fileName, entry[3] & 07777)
+    mtime = entry[1] / 1000000.0
+    os.utime(fileName, (mtime, mtime))
+    if done:
+      done(path, entry[0])
@@ -0,0 +1,127 @@
+""" Backing up one directory, possibly as several jobs each covering a range of its files. """
+import os, threading, time
+
+import archive, dedup, incremental, mirror, scan
+
+class DirBackup:
+  """ Plans the backup of `mydir' from its scanned `files' according to `backupMode'. The
+      planned `files' can then be processed in parts by any worker, the manifest or snapshot is
+      written when the last part is done. A cancelled or failed part aborts the whole directory.
+      With a `journal' the finished parts are recorded, and the ones recorded by an interrupted
+      run of the same folder are not done again. A `cpu' throttle.Gate caps the blocks compressed
+      at once. A part reads its files in the order of the prefetch.ReadAhead `readAhead', which
+      may also read them ahead. Files that cannot be archived are passed to
+      reportFailure(arcname, error). """
+  def __init__(self, mydir, targetDir, files, backupMode, compressionMethod, pool = None, workers = 1,
+               store = None, reportProgress = None, cancel = None, journal = None, cpu = None, readAhead = None,
+               reportFailure = None):
+    self.dir = mydir
+    self.targetDir = targetDir
+    self.backupMode = backupMode
+    self.compressionMethod = compressionMethod
+    self.pool = pool
+    self.workers = workers
+    self.store = store
+    self.reportProgress = reportProgress
+    self.cancel = cancel
+    self.journal = journal
+    self.cpu = cpu
+    self.readAhead = readAhead
+    self.reportFailure = reportFailure
+    self.partOffset = 0 # Number of the last part archived by an interrupted run.
+    self.archives = [] # Archive files of the finished parts.
+    self.aborted = False
+    self.done = False
+    self.lock = threading.Lock()
+    self.parts = 1
+    self.remaining = 1
+    if backupMode == 'dedup':
+      # Files unchanged since the previous snapshot are settled without any job.
+      self.snapshot = dedup.Snapshot(mydir)
+      self.snapshot.files, self.files = dedup.unchangedFiles(files, dedup.previousFiles(mydir, targetDir))
+    elif backupMode == 'mirror':
+      # Copies already up to date are not touched, a resumed run skips the finished ones the same way.
+      self.mirrorDir = mirror.mirrorName(mydir, targetDir)
+      self.arcnames = [arcname for arcname, path, st in files]
+      self.files = mirror.changedFiles(files, self.mirrorDir)
+    else:
+      self.manifest, self.files = incremental.planDir(mydir, targetDir, backupMode, files)
+      if journal and mydir in journal.parts:
+        ranges = journal.parts[mydir]
+        # Archived before the interruption, which files of them failed is not known.
+        archived = [f for f in self.files if [r for r in ranges if r.covers(f[0], f[2])]]
+        incremental.recordArchived(self.manifest, archived, [f[0] for f in archived])
+        self.files = [f for f in self.files if not [r for r in ranges if r.covers(f[0], f[2])]]
+        self.partOffset = max([r.number for r in ranges])
+
+  def setParts(self, parts):
+    self.parts = parts
+    self.remaining = parts
+
+  def runPart(self, part, files):
+    """ Process `files', the `part'th range of the planned files. Return True if it was the last
+        part to finish, finish() is due then. """
+    started = time.time()
+    # The parts are ranges of the walk order, the journal records them by their ends in it.
+    if files:
+      first = min(files, key = lambda f: scan.walkKey(f[0]))[0]
+      last = max(files, key = lambda f: scan.walkKey(f[0]))[0]
+    if self.readAhead:
+      files = self.readAhead.sort(files)
+    if self.backupMode == 'dedup':
+      entries = dedup.chunkFiles(files, {}, self.store, self.reportProgress, self.cancel, self.readAhead,
+        self.reportFailure)
+      with self.lock:
+        self.snapshot.files.update(entries)
+    elif self.backupMode == 'mirror':
+      mirror.copyFiles(files, self.mirrorDir, self.reportProgress, self.cancel, self.reportFailure)
+    else:
+      number = None
+      if self.parts > 1 or self.partOffset:
+        number = self.partOffset + part
+      fileName, added = archive.archiveDir(self.dir, self.targetDir, self.compressionMethod, None, None, self.pool,
+        self.workers, files, number, self.reportProgress, self.cancel, self.cpu, self.readAhead, self.reportFailure)
+      if self.journal and number and files:
+        self.journal.partDone(self.dir, number, started, first, last)
+      with self.lock:
+        incremental.recordArchived(self.manifest, files, added)
+        self.archives.append(fileName)
+        if self.aborted:
+          self.removeArchives()
+    with self.lock:
+      self.remaining -= 1
+      return self.remaining == 0 and not self.aborted
+
+  def removeArchives(self):
+    if self.journal:
+      return # Finished parts are journaled, a resumed run goes on from them.
+    for fileName in self.archives:
+      try:
+        os.remove(fileName)
+      except OSError:
+        pass
+    self.archives = []
+
+  def abort(self):
+    """ Give up the directory, no index is written. Without a journal the archives of its finished
+        parts are removed, parts still running remove theirs when they end. """
+    with self.lock:
+      self.aborted = True
+      self.removeArchives()
+
+  def finish(self):
+    """ Write the index of the directory, return its file name. A mirror has no index, it is
+        pruned to the files of the scan and its name is returned. """
+    if self.backupMode == 'mirror':
+      mirror.prune(self.mirrorDir, self.arcnames)
+      fileName = self.mirrorDir
+    elif self.backupMode == 'dedup':
+      fileName = dedup.snapshotName(self.dir, self.targetDir)
+      self.snapshot.save(fileName)
+    else:
+      fileName = incremental.manifestName(self.dir, self.targetDir)
+      self.manifest.save(fileName)
+    if self.journal:
+      self.journal.dirDone(self.dir)
+    self.done = True
+    return fileName
@@ -0,0 +1,392 @@
+""" The archiving run: scanning, planning, scheduling and the worker threads. Status changes and
+    progress events are passed to listeners, so the same engine serves the GUI and the command
+    line. """
+import cProfile, multiprocessing, os, pstats, sqlite3, threading, time
+
+from Queue import Queue
+
+import archive, cancel, catalog, compress, dedup, dirbackup, journal, metrics, prefetch, progress, rules, scan, scheduler, \
+  throttle, watch
+
+profile_name = 'profile.pstats'
+
+class Archiver:
+  def __init__(self, dirs, settings, resume = False, profile = False):
+    """ Archive the dirs according to settings. Cancelling stops the running jobs too. With `resume'
+        the last interrupted run goes on in its folder from its journal. With `profile' the run and
+        worker threads are profiled with cProfile into profile.pstats of the run folder. """
+    self.targetDir = None
+    self.nothingToResume = False
+    if resume:
+      self.targetDir = journal.findResumable(settings['targetDir'])
+      self.nothingToResume = not self.targetDir
+    if self.targetDir:
+      self.journal = journal.Journal.load(self.targetDir)
+      # The interrupted run decides how to archive, whatever the preferences say now.
+      settings = dict(settings)
+      settings.update(self.journal.settings)
+      archive.removeIncomplete(self.targetDir)
+      if os.path.isfile(os.path.join(self.targetDir, 'INCOMPLETE')):
+        os.remove(os.path.join(self.targetDir, 'INCOMPLETE'))
+    else:
+      self.targetDir = '%s/backup-%s' % (settings['targetDir'], time.strftime('%Y%m%d_%H%M%S'))
+      if not os.path.isdir(self.targetDir):
+        os.makedirs(self.targetDir)
+      self.journal = journal.Journal.create(self.targetDir, settings)
+    self.compressionMethod = settings['compressionMethod']
+    self.compressionWorkers = int(settings['compressionWorkers'])
+    self.compressionPool = None
+    # Fork the compressor processes before any worker thread is started.
+    if self.compressionWorkers > 1 and self.compressionMethod in compress.parallel_methods \
+        and settings['backupMode'] not in ('dedup', 'mirror'):
+      self.compressionPool = multiprocessing.Pool(self.compressionWorkers)
+    self.statusListeners = []
+    self.workers = int(settings.get('archiveWorkers', '0')) or multiprocessing.cpu_count() + 1
+    # Every thread profiles itself, the profiles are merged when the run ends.
+    self.profiles = None
+    if profile:
+      self.profiles = []
+    self.profiler = None
+    self.threadPool = ThreadPool(self.workers, self.setStatus, settings.get('ioPriority', 'normal'), self.profiles)
+    self.metrics = metrics.RunMetrics(self.workers)
+    self.makespan = None
+    self.progress = progress.Progress()
+    self.progressListeners = []
+    self.cancel = cancel.CancelToken()
+    # Shared by all workers, setLimits() changes it while the run is in progress.
+    self.throttle = throttle.Throttle(settings, self.cancel)
+    self.readAhead = prefetch.ReadAhead(settings.get('readOrder', 'inode'), int(settings.get('prefetchThreads', '0')),
+      int(settings.get('prefetchBudget', '0')) * 1024)
+    self.dirs = dirs
+    self.backups = {} # Directory -> dirbackup.DirBackup.
+    self.unreadable = set() # Directories with files that could not be archived.
+    self.scans = {} # Directory -> scan.DirScan, filled once at the beginning of the run.
+    self.fileSizeLimit = settings['fileSizeLimit']
+    self.backupMode = settings['backupMode']
+    # One store for all workers, it also counts the new and the reused bytes.
+    self.chunkStore = None
+    if self.backupMode == 'dedup':
+      self.chunkStore = dedup.ChunkStore(settings['targetDir'], self.compressionMethod, self.throttle.cpu)
+    self.fileSuffix = settings['fileSuffix']
+    # Compiled once, used for every path of every directory.
+    self.matcher = rules.Matcher(settings.get('rules', ''))
+    self.settings = settings
+    self.scanned = None # When the scan started.
+
+  def getTargetDir(self):
+    return self.targetDir
+
+  def addStatusListener(self, listener):
+    """ `listener'(directory, status) is called from the engine threads. The reports and warnings
+        about the whole run come with None as directory, the warnings start with `Warning: '. """
+    self.statusListeners.append(listener)
+
+  def addProgressListener(self, listener):
+    """ `listener'(progress.ProgressEvent) is called from the reporter thread. """
+    self.progressListeners.append(listener)
+
+  def setStatus(self, mydir, status):
+    for listener in self.statusListeners:
+      listener(mydir, status)
+
+  def report(self, message):
+    self.setStatus(None, message)
+
+  def warn(self, message):
+    self.setStatus(None, 'Warning: %s' % message)
+
+  def notArchived(self, mydir, error):
+    self.unreadable.add(mydir)
+    self.setStatus(mydir, 'Not archived: %s' % error)
+
+  def setLimits(self, settings):
+    """ Take the readLimit, writeLimit and cpuWorkers of `settings' from now on. Thread safe. """
+    self.throttle.setLimits(settings)
+
+  def getMakespan(self):
+    return self.makespan
+
+  def getMetrics(self):
+    return self.metrics
+
+  def getScan(self, mydir):
+    """ None for the directories finished before the run was resumed, they are not scanned. """
+    return self.scans.get(mydir)
+
+  def getCompleted(self):
+    """ Directories whose backup was finished, in the order of the list. """
+    return [mydir for mydir in self.dirs if mydir in self.journal.done
+            or (mydir in self.backups and self.backups[mydir].done)]
+
+  def getPending(self):
+    """ Directories left to back up, all of them unless the run is resumed. """
+    return [mydir for mydir in self.dirs if mydir not in self.journal.done]
+
+  def isCancelled(self):
+    return self.cancel.isCancelled()
+
+  def scanDirs(self):
+    """ The only walk of the trees in a run, everything else uses its results. With a watcher
+        running only the paths it marked are listed. """
+    self.scanned = time.time()
+    state = watch.requestFlush(os.path.dirname(self.targetDir))
+    for mydir in self.dirs:
+      if mydir not in self.getPending():
+        self.setStatus(mydir, 'Completed')
+        continue
+      plan = watch.planScan(state, mydir, self.targetDir, self.settings)
+      started = time.time()
+      if plan:
+        self.setStatus(mydir, 'Scanning changes')
+        entries, subtrees, dirs = plan
+        self.scans[mydir] = scan.scanDirty(mydir, entries, subtrees, dirs, self.fileSuffix, int(self.fileSizeLimit),
+          self.cancel, self.matcher)
+      else:
+        self.setStatus(mydir, 'Scanning')
+        self.scans[mydir] = scan.scanDir(mydir, self.fileSuffix, int(self.fileSizeLimit), self.cancel,
+          self.matcher)
+      self.metrics.scanned(mydir, time.time() - started)
+      self.setStatus(mydir, 'Scanned')
+
+  def stopThread(self):
+    """ Running jobs notice it within a block, queued ones are dropped. Thread safe. """
+    self.cancel.cancel()
+
+  def markIncomplete(self):
+    """ Leave a note in the target folder about what made it before the cancellation. """
+    completed = self.getCompleted()
+    f = open(os.path.join(self.targetDir, 'INCOMPLETE'), 'w')
+    f.write('Backup cancelled at %s\n' % time.strftime('%Y-%m-%d %H:%M:%S'))
+    for mydir in self.dirs:
+      f.write('%s\t%s\n' % (mydir in completed and 'completed' or 'incomplete', mydir))
+    f.close()
+    for mydir in self.dirs:
+      if mydir not in completed:
+        self.setStatus(mydir, 'Cancelled')
+
+  def writeSummary(self):
+    """ README of the target folder: size, elapsed time, file and skipped counts per directory. """
+    f = open(os.path.join(self.targetDir, 'README'), 'w')
+    event = self.progress.event(True)
+    elapsed = dict([(dirProgress.dir, dirProgress.elapsed(event.time)) for dirProgress in event.dirs])
+    for mydir in self.dirs:
+      # Taken from the scan of the run, the tree is not walked again.
+      dirScan = self.getScan(mydir)
+      if dirScan is None:
+        f.write('%s\t-\t-\tbefore resume\n' % mydir)
+        continue
+      f.write('%s\t%d\t%s\t%d files\t%d skipped\n' % (mydir, dirScan.totalBytes / 1024,
+        progress.formatTime(elapsed.get(mydir, 0)), len(dirScan.files), dirScan.skippedFiles()))
+    if self.makespan:
+      f.write('# %s\n' % self.makespan.report())
+    f.write('# %s\n' % self.fastPathReport())
+    f.write('# %s\n' % self.throttle.report())
+    f.write('# %s\n' % metrics.report(self.metrics.summary(self.dirs, event)))
+    f.close()
+
+  def fastPathReport(self):
+    """ How much of the data was stored without compressing it again. """
+    overall = self.progress.event(True).overall
+    mb = 1024.0 * 1024.0
+    return 'Fast path: %.1f of %.1f MB stored without compression' % (overall.bytesStored / mb,
+      overall.bytesRead / mb)
+
+  def run(self):
+    """ Do the whole run in the calling thread. Return True if it was not cancelled. """
+    self.metrics = metrics.RunMetrics(self.workers)
+    if self.nothingToResume:
+      self.report('Nothing to resume, starting a new run.')
+    if self.profiles is not None:
+      self.profiler = cProfile.Profile()
+      self.profiler.enable()
+    try:
+      self.scanDirs()
+    except cancel.Cancelled:
+      return self.finishRun()
+    for mydir in self.getPending():
+      self.backups[mydir] = dirbackup.DirBackup(mydir, self.targetDir, self.scans[mydir].files, self.backupMode,
+        self.compressionMethod, self.compressionPool, self.compressionWorkers, self.chunkStore,
+        self.throttle.wrap(self.progress.callback(mydir)), self.cancel, self.journal, self.throttle.cpu,
+        self.readAhead, lambda arcname, e, mydir = mydir: self.notArchived(mydir, e))
+      self.progress.addDir(mydir, sum([st.st_size for arcname, path, st in self.backups[mydir].files]),
+        len(self.backups[mydir].files))
+    # Largest first, with the oversized directories split into parts.
+    jobs = scheduler.schedule([(mydir, self.backups[mydir].files) for mydir in self.getPending()], self.workers)
+    self.makespan = scheduler.Makespan(jobs, self.workers)
+    for job in jobs:
+      self.backups[job.dir].setParts(job.parts)
+    reporter = progress.ProgressReporter(self.progress, self.progressListeners)
+    reporter.start()
+    for job in jobs:
+      if self.cancel.isCancelled():
+        break
+      self.threadPool.add_task({ 'job':job, 'backup':self.backups[job.dir], 'makespan':self.makespan,
+        'progress':self.progress, 'cancel':self.cancel, 'metrics':self.metrics })
+      self.setStatus(job.dir, 'Scheduled')
+    self.threadPool.wait_completion()
+    self.progress.finish()
+    reporter.stop()
+    self.report(self.makespan.report())
+    self.report(self.fastPathReport())
+    self.report(self.throttle.report())
+    self.report(metrics.report(self.metrics.summary(self.dirs, self.progress.event(True))))
+    return self.finishRun()
+
+  def finishRun(self):
+    """ Release the workers and the compressor processes, then report. """
+    self.threadPool.shutdown()
+    if self.compressionPool:
+      if self.cancel.isCancelled():
+        self.compressionPool.terminate()
+      else:
+        self.compressionPool.close()
+      self.compressionPool.join()
+    self.metrics.finish()
+    self.saveProfile()
+    if self.cancel.isCancelled():
+      self.markIncomplete()
+      self.saveMetrics(False)
+      return False
+    # A directory that failed leaves the run resumable.
+    if len(self.getCompleted()) == len(self.dirs):
+      self.journal.runFinished()
+    self.writeSummary()
+    self.saveMetrics(len(self.getCompleted()) == len(self.dirs))
+    try:
+      # Files missing from the manifest must be found by a full scan of their directory next time.
+      watch.markConsumed(os.path.dirname(self.targetDir), self.targetDir,
+        [mydir for mydir in self.getCompleted() if mydir in self.scans and mydir not in self.unreadable],
+        self.scanned)
+    except (IOError, OSError), e:
+      self.warn('Unable to update the watch marks: %s' % e)
+    try:
+      catalog.recordRun(os.path.dirname(self.targetDir), self.targetDir)
+    except (sqlite3.Error, IOError, OSError), e:
+      # The backup itself is fine, the catalog can be rebuilt from the run folders.
+      self.warn('Unable to update the catalog: %s' % e)
+    return True
+
+  def saveMetrics(self, completed):
+    """ Phase timings and counters of the run as JSON and Prometheus text, see metrics. """
+    summary = self.metrics.summary(self.dirs, self.progress.event(True), completed)
+    try:
+      metrics.saveMetrics(self.targetDir, summary, self.settings.get('metricsTextfile'))
+    except (IOError, OSError, ValueError), e:
+      self.warn('Unable to write the metrics: %s' % e)
+
+  def saveProfile(self):
+    """ Merge the profiles of the threads into profile.pstats, for python -m pstats. """
+    if self.profiles is None:
+      return
+    if self.profiler:
+      self.profiler.disable()
+      self.profiles.append(self.profiler)
+      self.profiler = None
+    if not self.profiles:
+      return
+    fileName = os.path.join(self.targetDir, profile_name)
+    try:
+      pstats.Stats(*self.profiles).dump_stats(fileName)
+    except (IOError, OSError), e:
+      self.warn('Unable to write the profile: %s' % e)
+      return
+    self.report('Profile of the run in %s' % fileName)
+
+class Worker(threading.Thread):
+  def __init__(self, tasks, setStatus, ioPriority = 'normal', name = None, profiles = None):
+    """ With a `profiles' list the worker profiles itself and adds the cProfile.Profile to the
+        list when it is shut down. """
+    threading.Thread.__init__(self)
+    if name:
+      self.setName(name)
+    self.tasks = tasks
+    self.setStatus = setStatus
+    self.ioPriority = ioPriority
+    self.profiles = profiles
+    # A run left behind by its caller must not keep the process alive.
+    self.daemon = True
+    self.alive = True
+    self.start()
+
+  def kill(self):
+    self.alive = False
+
+  def run(self):
+    if self.profiles is None:
+      self.work()
+      return
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+      self.work()
+    finally:
+      profiler.disable()
+      self.profiles.append(profiler)
+
+  def work(self):
+    # Per thread, the one starting the run keeps its own.
+    if self.ioPriority != 'normal':
+      try:
+        throttle.setIoPriority(self.ioPriority)
+      except OSError, e:
+        self.setStatus(None, 'Warning: Unable to set the I/O priority: %s' % e)
+    while self.alive:
+      args = self.tasks.get()
+      if args is None: # Released by ThreadPool.shutdown().
+        self.tasks.task_done()
+        return
+      job = args['job']
+      queueWait = time.time() - args['queued']
+      if args['cancel'].isCancelled():
+        args['backup'].abort()
+        self.tasks.task_done()
+        self.setStatus(job.dir, 'Cancelled')
+        continue
+      # Start clock and update GUI!
+      self.setStatus(job.dir, 'Started')
+      args['progress'].dirStarted(job.dir)
+      args['makespan'].jobStarted()
+      started = time.time()
+      status = None
+      try:
+        # Tarring and compressing happen in one pass without intermediate file.
+        if args['backup'].runPart(job.part, job.files):
+          self.setStatus(None, 'Backed up %s, index in %s' % (job.dir, args['backup'].finish()))
+          args['progress'].dirFinished(job.dir)
+          status = 'Completed'
+      except cancel.Cancelled:
+        args['backup'].abort()
+        status = 'Cancelled'
+      except Exception, e:
+        args['backup'].abort()
+        status = 'Failed: %s' % e
+      args['makespan'].jobDone(time.time() - started)
+      args['metrics'].jobDone(job.dir, job.part, self.getName(), queueWait, time.time() - started)
+      self.tasks.task_done()
+      if status:
+        # Stop clock and update GUI!
+        self.setStatus(job.dir, status)
+
+class ThreadPool:
+  def __init__(self, size, setStatus, ioPriority = 'normal', profiles = None):
+    self.size = size
+    self.tasks = Queue(size)
+    self.threads = []
+    for i in range(size):
+      self.threads.append(Worker(self.tasks, setStatus, ioPriority, 'worker%d' % (i + 1), profiles))
+
+  def add_task(self, args):
+    # Blocks while the queue is full, the time until a worker takes the task is its queue wait.
+    args['queued'] = time.time()
+    self.tasks.put(args)
+
+  def wait_completion(self):
+    # All of the tasks completed.
+    self.tasks.join()
+
+  def shutdown(self):
+    # One stop marker per worker, they all return from run().
+    for _ in self.threads:
+      self.tasks.put(None)
+    for worker in self.threads:
+      worker.join()
@@ -0,0 +1,50 @@
+""" Detection of content that does not get smaller by compressing it again: media, archives and
+    anything whose first block looks random. Such files take the fast path and are stored as is,
+    or at the cheapest level of the compression method. """
+import math, os
+
+# Lower case file name suffixes of formats that are compressed already.
+stored_suffixes = frozenset([
+  '.jpg', '.jpeg', '.png', '.gif', '.webp', '.heic', '.jp2',
+  '.mp3', '.m4a', '.aac', '.ogg', '.oga', '.opus', '.flac', '.wma',
+  '.mp4', '.m4v', '.mkv', '.avi', '.mov', '.webm', '.wmv', '.flv', '.mpg', '.mpeg',
+  '.zip', '.gz', '.tgz', '.bz2', '.tbz', '.tbz2', '.xz', '.txz', '.lz', '.lzma', '.lzo', '.zst', '.7z',
+  '.rar', '.cab', '.jar', '.war', '.apk', '.deb', '.rpm', '.dmg',
+  '.docx', '.xlsx', '.pptx', '.odt', '.ods', '.odp', '.epub'])
+# Bytes looked at from the start of the files of other suffixes, taken from the data read for
+# archiving them anyway.
+sample_size = 16 * 1024
+# Smaller files are compressed anyway, it is cheap for them.
+min_sample_size = 4 * 1024
+# Bits per byte above which a sample is taken for random. Text is around 4.5, compressed data
+# and a random 16 KiB sample are above 7.98.
+entropy_limit = 7.9
+
+def entropy(data):
+  """ Shannon entropy of the bytes of `data' in bits per byte, 0 to 8. """
+  if not data:
+    return 0.0
+  total = float(len(data))
+  result = 0.0
+  for i in range(256):
+    count = data.count(chr(i))
+    if count:
+      p = count / total
+      result -= p * math.log(p, 2)
+  return result
+
+def hasStoredSuffix(path):
+  return os.path.splitext(path)[1].lower() in stored_suffixes
+
+def needsSample(path, size):
+  """ True if isIncompressible() needs the first bytes of the file at `path' of `size' bytes. """
+  return not hasStoredSuffix(path) and size >= min_sample_size
+
+def isIncompressible(path, size, sample = ''):
+  """ True if the file at `path' of `size' bytes should be stored without compression. `sample'
+      is its first sample_size bytes, or all of them if it is shorter, if needsSample(). """
+  if hasStoredSuffix(path):
+    return True
+  if size < min_sample_size:
+    return False
+  return entropy(sample[:sample_size]) > entropy_limit
@@ -0,0 +1,118 @@
+""" Per-directory file manifests, incremental archiving and restoring of increment chains. """
+import gzip, os
+
+import archive, scan
+
+manifest_suffix = '.manifest.gz'
+
+def manifestName(mydir, targetDir):
+  return os.path.join(targetDir, os.path.basename(mydir.rstrip('/')) + manifest_suffix)
+
+def entryOf(st):
+  """ Manifest entry of a file: size, mtime in microseconds, inode and mode. """
+  return (st.st_size, int(round(st.st_mtime * 1000000)), st.st_ino, st.st_mode)
+
+class Manifest:
+  """ State of one backed up directory after a run. Every manifest lists all of the files, `base'
+      names the backup folder the run was an increment of and `deleted' the files gone since. """
+  def __init__(self, mydir, base = None):
+    self.dir = mydir
+    self.base = base
+    self.entries = {} # Relative path -> entryOf().
+    self.deleted = []
+
+  @staticmethod
+  def load(fileName):
+    manifest = Manifest(None)
+    f = gzip.open(fileName, 'rb')
+    try:
+      for line in f:
+        fields = line.rstrip('\n').split('\t')
+        if fields[0] == 'F':
+          manifest.entries[fields[1].decode('string_escape')] = tuple([int(x) for x in fields[2:6]])
+        elif fields[0] == 'D':
+          manifest.deleted.append(fields[1].decode('string_escape'))
+        elif fields[0] == 'dir':
+          manifest.dir = fields[1].decode('string_escape')
+        elif fields[0] == 'base':
+          manifest.base = fields[1] or None
+    finally:
+      f.close()
+    return manifest
+
+  def save(self, fileName):
+    f = gzip.open(fileName, 'wb')
+    try:
+      f.write('dir\t%s\n' % self.dir.encode('string_escape'))
+      f.write('base\t%s\n' % (self.base or ''))
+      for path in sorted(self.entries.keys()):
+        f.write('F\t%s\t%d\t%d\t%d\t%d\n' % ((path.encode('string_escape'),) + self.entries[path]))
+      for path in self.deleted:
+        f.write('D\t%s\n' % path.encode('string_escape'))
+    finally:
+      f.close()
+
+def findPrevious(mydir, targetDir, suffix = manifest_suffix):
+  """ Newest backup folder next to `targetDir' holding a `suffix' index file of `mydir', or None. """
+  backupRoot, current = os.path.split(targetDir.rstrip('/'))
+  for folder in sorted(os.listdir(backupRoot), reverse = True):
+    if folder.startswith('backup-') and folder < current \
+        and os.path.isfile(os.path.join(backupRoot, folder, os.path.basename(mydir.rstrip('/')) + suffix)):
+      return os.path.join(backupRoot, folder)
+  return None
+
+def planDir(mydir, targetDir, backupMode, files):
+  """ Return the manifest of `mydir' for this run and the files to archive. In incremental mode
+      those are the ones new or changed since the previous backup, the removed ones are recorded.
+      The files to archive only get their entries by recordArchived(), until then a changed file
+      keeps the entry of the previous manifest, whose archives hold that version. """
+  previous = None
+  old = None
+  if backupMode == 'incremental':
+    previous = findPrevious(mydir, targetDir)
+    if previous:
+      old = Manifest.load(manifestName(mydir, previous))
+  manifest = Manifest(mydir, previous and os.path.basename(previous))
+  changed = []
+  for arcname, path, st in files:
+    entry = entryOf(st)
+    if old is None or old.entries.get(arcname) != entry:
+      changed.append((arcname, path, st))
+      if old and arcname in old.entries:
+        manifest.entries[arcname] = old.entries[arcname]
+    else:
+      manifest.entries[arcname] = entry
+  if old:
+    manifest.deleted = sorted(set(old.entries) - set([arcname for arcname, path, st in files]))
+  return manifest, changed
+
+def recordArchived(manifest, files, added):
+  """ Enter those of the planned `files' into `manifest' whose arcnames are in `added', the ones
+      that made it into an archive. """
+  added = set(added)
+  for arcname, path, st in files:
+    if arcname in added:
+      manifest.entries[arcname] = entryOf(st)
+
+def archiveDir(mydir, targetDir, compressionMethod, fileSuffix, fileSizeLimit, pool = None, workers = 1,
+               backupMode = 'full', files = None):
+  """ Archive `mydir' as a single job and write its manifest. """
+  if files is None:
+    files = scan.scanDir(mydir, fileSuffix, fileSizeLimit).files
+  manifest, changed = planDir(mydir, targetDir, backupMode, files)
+  targetFile, added = archive.archiveDir(mydir, targetDir, compressionMethod, fileSuffix, fileSizeLimit,
+                                         pool, workers, changed)
+  recordArchived(manifest, changed, added)
+  manifest.save(manifestName(mydir, targetDir))
+  return targetFile
+
+def backupChain(name, backupFolder):
+  """ Backup folders to apply for restoring `name' from `backupFolder', starting with the full one. """
+  backupRoot = os.path.dirname(os.path.abspath(backupFolder))
+  chain = [backupFolder]
+  manifest = Manifest.load(os.path.join(backupFolder, name + manifest_suffix))
+  while manifest.base:
+    folder = os.path.join(backupRoot, manifest.base)
+    chain.insert(0, folder)
+    manifest = Manifest.load(os.path.join(folder, name + manifest_suffix))
+  return chain
@@ -0,0 +1,94 @@
+""" Run journal: what a run has finished so far, so that an interrupted run can be resumed in its
+    own folder. Lines are appended and synced as the work gets done, a crash loses nothing
+    that was recorded. """
+import os, threading, time
+
+import scan
+
+journal_name = 'JOURNAL'
+# Settings a resumed run takes over from the journal, the archives must stay consistent.
+journaled_settings = ('backupMode', 'compressionMethod', 'fileSuffix', 'fileSizeLimit', 'rules')
+
+class PartRange:
+  """ A finished part of a split directory: archive number and the first and last file of its
+      range in scan order. """
+  def __init__(self, number, started, first, last):
+    self.number = number
+    self.started = started
+    self.first = scan.walkKey(first)
+    self.last = scan.walkKey(last)
+
+  def covers(self, arcname, st):
+    """ True if the file went into this part and has not been touched since the part started. """
+    return self.first <= scan.walkKey(arcname) <= self.last and max(st.st_mtime, st.st_ctime) < self.started
+
+class Journal:
+  def __init__(self, folder):
+    self.fileName = os.path.join(folder, journal_name)
+    self.lock = threading.Lock()
+    self.settings = {}
+    self.parts = {} # Directory -> [PartRange].
+    self.done = set()
+    self.finished = False
+
+  @staticmethod
+  def create(folder, settings):
+    journal = Journal(folder)
+    journal.append('run', time.strftime('%Y-%m-%d %H:%M:%S'))
+    for name in journaled_settings:
+      journal.settings[name] = str(settings[name])
+      journal.append('setting', name, journal.settings[name])
+    return journal
+
+  @staticmethod
+  def load(folder):
+    journal = Journal(folder)
+    f = open(journal.fileName, 'r')
+    try:
+      for line in f:
+        if not line.endswith('\n'):
+          break # Torn last line of a crash.
+        fields = [field.decode('string_escape') for field in line[:-1].split('\t')]
+        if fields[0] == 'setting':
+          journal.settings[fields[1]] = fields[2]
+        elif fields[0] == 'part':
+          journal.parts.setdefault(fields[1], []).append(PartRange(int(fields[2]), float(fields[3]),
+            fields[4], fields[5]))
+        elif fields[0] == 'done':
+          journal.done.add(fields[1])
+        elif fields[0] == 'finished':
+          journal.finished = True
+    finally:
+      f.close()
+    return journal
+
+  def append(self, *fields):
+    with self.lock:
+      f = open(self.fileName, 'a')
+      try:
+        f.write('%s\n' % '\t'.join([str(field).encode('string_escape') for field in fields]))
+        f.flush()
+        os.fsync(f.fileno())
+      finally:
+        f.close()
+
+  def partDone(self, mydir, number, started, first, last):
+    self.append('part', mydir, number, repr(started), first, last)
+
+  def dirDone(self, mydir):
+    self.append('done', mydir)
+
+  def runFinished(self):
+    self.append('finished')
+
+def findResumable(backupRoot):
+  """ Newest backup folder in `backupRoot' whose run did not finish, or None. """
+  if not os.path.isdir(backupRoot):
+    return None
+  for folder in sorted(os.listdir(backupRoot), reverse = True):
+    path = os.path.join(backupRoot, folder)
+    if folder.startswith('backup-') and os.path.isfile(os.path.join(path, journal_name)):
+      if Journal.load(path).finished:
+        return None # Only the last run can be resumed.
+      return path
+  return None
@@ -0,0 +1,160 @@
+""" Where the time of a run went. Per directory the seconds of each phase: scanning, reading the
+    files, writing the output, held back by the limits and compressing in the worker threads.
+    What is left of the worker time is `other': tar headers, checksums, waits for the CPU gate and
+    for locks, and the waits for the blocks compressed on the process pool, whose compressing is
+    not measured in the workers. It is not measured itself. Besides the byte counters the queue wait of every job and the busy
+    time of every worker are kept. At the end of the run they are written as `metrics.json' and
+    as a Prometheus textfile `metrics.prom' into the run folder, and to the metricsTextfile of the
+    settings if there is one, for the textfile collector of the node exporter. """
+import os, threading, time
+
+try:
+  import json
+except ImportError:
+  json = None
+
+json_name = 'metrics.json'
+prometheus_name = 'metrics.prom'
+phases = ('scan', 'read', 'write', 'throttled', 'compress', 'other')
+
+class JobRecord:
+  """ One job run by a worker: its directory and part, seconds queued and seconds worked. """
+  def __init__(self, mydir, part, worker, queueWait, seconds):
+    self.dir = mydir
+    self.part = part
+    self.worker = worker
+    self.queueWait = queueWait
+    self.seconds = seconds
+
+class RunMetrics:
+  """ Thread safe recorder of the scans and jobs of a run with `workers' worker threads. """
+  def __init__(self, workers):
+    self.lock = threading.Lock()
+    self.workers = workers
+    self.started = time.time()
+    self.finished = None
+    self.scanTimes = {} # Directory -> seconds.
+    self.jobs = [] # JobRecords in the order they ended.
+
+  def scanned(self, mydir, seconds):
+    with self.lock:
+      self.scanTimes[mydir] = seconds
+
+  def jobDone(self, mydir, part, worker, queueWait, seconds):
+    with self.lock:
+      self.jobs.append(JobRecord(mydir, part, worker, queueWait, seconds))
+
+  def finish(self):
+    self.finished = time.time()
+
+  def duration(self):
+    return (self.finished or time.time()) - self.started
+
+  def dirMetrics(self, mydir, dirProgress):
+    """ Phases and counters of `mydir', whose progress.DirProgress is `dirProgress' or None. """
+    busy = sum([job.seconds for job in self.jobs if job.dir == mydir])
+    result = { 'phases':{ 'scan':self.scanTimes.get(mydir, 0.0) }, 'jobs':len([job for job in self.jobs
+      if job.dir == mydir]), 'busy':busy }
+    if dirProgress:
+      result['phases'].update({ 'read':dirProgress.readTime, 'write':dirProgress.writeTime,
+        'throttled':dirProgress.throttledTime, 'compress':dirProgress.compressTime,
+        'other':max(busy - dirProgress.readTime - dirProgress.writeTime - dirProgress.throttledTime
+        - dirProgress.compressTime, 0.0) })
+      result.update({ 'bytesTotal':dirProgress.bytesTotal, 'bytesRead':dirProgress.bytesRead,
+        'bytesWritten':dirProgress.bytesWritten, 'bytesStored':dirProgress.bytesStored,
+        'files':dirProgress.filesDone, 'filesTotal':dirProgress.filesTotal,
+        'elapsed':dirProgress.elapsed(self.finished or time.time()) })
+    for phase in phases:
+      result['phases'].setdefault(phase, 0.0)
+    return result
+
+  def workerMetrics(self):
+    """ Worker name -> (jobs, busy seconds, share of the run time busy). """
+    duration = max(self.duration(), 1e-6)
+    workers = {}
+    for job in self.jobs:
+      jobs, busy = workers.get(job.worker, (0, 0.0))
+      workers[job.worker] = (jobs + 1, busy + job.seconds)
+    return dict([(name, (jobs, busy, busy / duration)) for name, (jobs, busy) in workers.items()])
+
+  def summary(self, dirs, event, completed = True):
+    """ All of it as plain dicts and lists. `event' is the final progress.ProgressEvent. """
+    progressOf = dict([(dirProgress.dir, dirProgress) for dirProgress in event.dirs])
+    workers = self.workerMetrics()
+    busy = sum([job.seconds for job in self.jobs])
+    waits = [job.queueWait for job in self.jobs]
+    return { 'started':self.started, 'finished':self.finished, 'duration':self.duration(), 'completed':completed,
+      'workers':self.workers, 'utilisation':busy / (max(self.workers, 1) * max(self.duration(), 1e-6)),
+      'queueWait':{ 'total':sum(waits), 'max':max(waits or [0.0]), 'mean':waits and sum(waits) / len(waits) or 0.0 },
+      'dirs':dict([(mydir, self.dirMetrics(mydir, progressOf.get(mydir))) for mydir in dirs]),
+      'workerThreads':dict([(name, { 'jobs':jobs, 'busy':busy, 'utilisation':utilisation })
+        for name, (jobs, busy, utilisation) in workers.items()]),
+      'jobs':[{ 'dir':job.dir, 'part':job.part, 'worker':job.worker, 'queueWait':job.queueWait,
+        'seconds':job.seconds } for job in self.jobs] }
+
+def report(summary):
+  """ One line summary: the measured phases summed over the directories, the rest of the worker
+      time, queue wait and utilisation. """
+  totals = dict([(phase, sum([values['phases'][phase] for values in summary['dirs'].values()])) for phase in phases])
+  return 'Phases: %s; other worker time %.1fs (pool compression waits and unmeasured); queue wait %.1fs, ' \
+    'utilisation %d%%' \
+    % (', '.join(['%s %.1fs' % (phase, totals[phase]) for phase in phases if phase != 'other']), totals['other'],
+    summary['queueWait']['total'], 100 * summary['utilisation'])
+
+def escapeLabel(value):
+  return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def prometheusText(summary):
+  """ The summary in the Prometheus text exposition format, all gauges of the last run. """
+  lines = []
+  def metric(name, help, samples):
+    lines.append('# HELP backupdirs_%s %s' % (name, help))
+    lines.append('# TYPE backupdirs_%s gauge' % name)
+    for labels, value in samples:
+      text = ','.join(['%s="%s"' % (label, escapeLabel(labelValue)) for label, labelValue in labels])
+      lines.append('backupdirs_%s%s %r' % (name, text and '{%s}' % text or '', float(value)))
+  dirs = sorted(summary['dirs'].items())
+  metric('run_start_timestamp_seconds', 'When the last run started.', [((), summary['started'])])
+  metric('run_duration_seconds', 'Wall time of the last run.', [((), summary['duration'])])
+  metric('run_completed', '1 if the last run backed up all directories.', [((), summary['completed'] and 1 or 0)])
+  metric('run_workers', 'Worker threads of the last run.', [((), summary['workers'])])
+  metric('run_utilisation_ratio', 'Busy share of the worker threads over the run.', [((), summary['utilisation'])])
+  metric('queue_wait_seconds', 'Seconds the jobs waited in the queue of the thread pool.',
+    [((('stat', stat),), summary['queueWait'][stat]) for stat in ('total', 'max', 'mean')])
+  metric('dir_phase_seconds', 'Seconds per directory and phase, summed over the workers.',
+    [((('dir', mydir), ('phase', phase)), values['phases'][phase]) for mydir, values in dirs for phase in phases])
+  metric('dir_bytes', 'Bytes per directory, read from the sources, written to the target, incompressible.',
+    [((('dir', mydir), ('kind', kind)), values.get('bytes' + kind.capitalize(), 0))
+      for mydir, values in dirs for kind in ('read', 'written', 'stored')])
+  metric('dir_files', 'Files backed up per directory.', [((('dir', mydir),), values.get('files', 0))
+    for mydir, values in dirs])
+  workers = sorted(summary['workerThreads'].items())
+  metric('worker_busy_seconds', 'Seconds each worker thread spent in jobs.',
+    [((('worker', name),), values['busy']) for name, values in workers])
+  metric('worker_utilisation_ratio', 'Busy share of each worker thread over the run.',
+    [((('worker', name),), values['utilisation']) for name, values in workers])
+  return '\n'.join(lines) + '\n'
+
+def writeAtomically(fileName, text):
+  """ Written aside and renamed, a collector never reads half a file. """
+  f = open(fileName + '.tmp', 'w')
+  try:
+    f.write(text)
+  finally:
+    f.close()
+  os.rename(fileName + '.tmp', fileName)
+
+def saveMetrics(folder, summary, textfile = None):
+  """ Write the summary into the run `folder', the Prometheus text also to `textfile'. Return the
+      names of the files written. """
+  written = []
+  if json is not None:
+    writeAtomically(os.path.join(folder, json_name), json.dumps(summary, sort_keys = True, indent = 1) + '\n')
+    written.append(os.path.join(folder, json_name))
+  text = prometheusText(summary)
+  writeAtomically(os.path.join(folder, prometheus_name), text)
+  written.append(os.path.join(folder, prometheus_name))
+  if textfile:
+    writeAtomically(textfile, text)
+    written.append(textfile)
+  return written
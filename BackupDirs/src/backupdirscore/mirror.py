@@ -0,0 +1,183 @@
+""" Mirror mode: a browsable, uncompressed copy of each directory under `mirror/' in the backup
+    root, synced every run. Only new or changed files are copied, and the copying is left to the
+    kernel where it can: a reflink, copy_file_range() or sendfile(), so the data does not pass
+    through Python buffers. An unchanged file costs a stat of its copy. """
+import ctypes, errno, fcntl, os, stat, time
+
+import archive
+
+mirror_dir = 'mirror'
+# Bytes per copy_file_range() or sendfile() call, progress and cancellation are checked in between.
+copy_chunk = 8 * 1024 * 1024
+# ioctl() cloning a whole file on btrfs, XFS and the like: _IOW(0x94, 9, int).
+FICLONE = 0x40049409
+# errnos meaning that the method does not work for this pair of files, the next one is tried.
+unsupported_errnos = (errno.ENOSYS, errno.EXDEV, errno.EINVAL, errno.EOPNOTSUPP, errno.ENOTTY, errno.EBADF,
+                      errno.ETXTBSY, errno.EPERM)
+
+try:
+  _libc = ctypes.CDLL(None, use_errno = True)
+except OSError:
+  _libc = None
+
+def _libcFunction(name, argtypes):
+  """ The C function of glibc for Pythons whose os module lacks it, or None. """
+  function = getattr(_libc, name, None)
+  if function is not None:
+    function.argtypes = argtypes
+    function.restype = ctypes.c_ssize_t
+  return function
+
+_copy_file_range = _libcFunction('copy_file_range', [ctypes.c_int, ctypes.c_void_p, ctypes.c_int, ctypes.c_void_p,
+  ctypes.c_size_t, ctypes.c_uint])
+_sendfile = _libcFunction('sendfile', [ctypes.c_int, ctypes.c_int, ctypes.c_void_p, ctypes.c_size_t])
+
+def _checked(result):
+  if result < 0:
+    e = ctypes.get_errno()
+    raise OSError(e, os.strerror(e))
+  return result
+
+def copyFileRange(srcFd, dstFd, count):
+  if hasattr(os, 'copy_file_range'):
+    return os.copy_file_range(srcFd, dstFd, count)
+  return _checked(_copy_file_range(srcFd, None, dstFd, None, count, 0))
+
+def sendFile(srcFd, dstFd, count):
+  if hasattr(os, 'sendfile'):
+    return os.sendfile(dstFd, srcFd, None, count)
+  return _checked(_sendfile(dstFd, srcFd, None, count))
+
+# Name -> zero-copy function of the kernel, in the order of preference. Methods the kernel turns
+# out not to know are dropped from the list.
+copy_methods = [(name, function) for name, function, available in (
+  ('copy_file_range', copyFileRange, hasattr(os, 'copy_file_range') or _copy_file_range is not None),
+  ('sendfile', sendFile, hasattr(os, 'sendfile') or _sendfile is not None)) if available]
+
+def mirrorName(mydir, targetDir):
+  """ The mirror of `mydir' next to the run folder `targetDir'. """
+  backupRoot = os.path.dirname(targetDir.rstrip('/'))
+  return os.path.join(backupRoot, mirror_dir, os.path.basename(mydir.rstrip('/')))
+
+def isUnchanged(st, copy):
+  """ True if the file at `copy' has the size and mtime of the lstat `st' of its original. Like
+      rsync the mtimes are compared in whole seconds, utime() and the filesystem of the mirror
+      may drop the fraction. """
+  try:
+    copySt = os.lstat(copy)
+  except OSError:
+    return False
+  return stat.S_ISREG(copySt.st_mode) and copySt.st_size == st.st_size and int(copySt.st_mtime) == int(st.st_mtime)
+
+def changedFiles(files, mirrorDir):
+  """ The scanned `files' whose copy in `mirrorDir' is missing or out of date. """
+  return [(arcname, path, st) for arcname, path, st in files if not isUnchanged(st, os.path.join(mirrorDir, arcname))]
+
+def copyData(src, dst, size, reportProgress = None, cancel = None):
+  """ Copy `size' bytes from file object `src' to `dst' the cheapest way that works. Return the
+      name of the method used. The kernel copies are reported as writeTime. """
+  try:
+    started = time.time()
+    fcntl.ioctl(dst.fileno(), FICLONE, src.fileno())
+    if reportProgress:
+      reportProgress(bytesRead = size, bytesWritten = size, writeTime = time.time() - started)
+    return 'reflink'
+  except (IOError, OSError), e:
+    if e.errno not in unsupported_errnos:
+      raise
+  for name, function in list(copy_methods):
+    done = 0
+    try:
+      while done < size:
+        if cancel:
+          cancel.check()
+        started = time.time()
+        n = function(src.fileno(), dst.fileno(), min(copy_chunk, size - done))
+        if n == 0:
+          break # The file got shorter meanwhile.
+        done += n
+        if reportProgress:
+          reportProgress(bytesRead = n, bytesWritten = n, writeTime = time.time() - started)
+      return name
+    except (IOError, OSError), e:
+      if e.errno not in unsupported_errnos or done:
+        raise
+      if e.errno == errno.ENOSYS and (name, function) in copy_methods:
+        copy_methods.remove((name, function))
+  # No help from the kernel, plain reads and writes.
+  while True:
+    if cancel:
+      cancel.check()
+    started = time.time()
+    data = archive.readBlock(src, 1024 * 1024, src.name)
+    if not data:
+      return 'read'
+    read = time.time()
+    dst.write(data)
+    if reportProgress:
+      reportProgress(bytesRead = len(data), bytesWritten = len(data), readTime = read - started,
+        writeTime = time.time() - read)
+
+def copyFile(path, copy, st, reportProgress = None, cancel = None):
+  """ Copy the file at `path' to `copy' with the mode and times of its stat `st'. It is written
+      aside and renamed, so `copy' is either the old or the new version. A source that cannot be
+      opened or read raises archive.UnreadableFile, failures of the kernel copies and of the
+      target are raised as they are. """
+  directory = os.path.dirname(copy)
+  if not os.path.isdir(directory):
+    try:
+      os.makedirs(directory)
+    except OSError:
+      pass # Created by another worker meanwhile.
+  tmpName = copy + archive.incomplete_suffix
+  try:
+    src = open(path, 'rb')
+  except (IOError, OSError), e:
+    raise archive.UnreadableFile('%s: %s' % (path, e))
+  try:
+    dst = open(tmpName, 'wb')
+    try:
+      copyData(src, dst, st.st_size, reportProgress, cancel)
+    finally:
+      dst.close()
+    os.chmod(tmpName, stat.S_IMODE(st.st_mode))
+    os.utime(tmpName, (st.st_atime, st.st_mtime))
+    os.rename(tmpName, copy)
+  except:
+    try:
+      os.remove(tmpName)
+    except OSError:
+      pass
+    raise
+  finally:
+    src.close()
+
+def copyFiles(files, mirrorDir, reportProgress = None, cancel = None, reportFailure = None):
+  """ Bring the copies of `files' in `mirrorDir' up to date. The files that cannot be read are
+      passed to reportFailure(arcname, error) and keep their old copy, a failure to write the
+      copies fails the directory. """
+  for arcname, path, st in files:
+    if cancel:
+      cancel.check()
+    try:
+      copyFile(path, os.path.join(mirrorDir, arcname), st, reportProgress, cancel)
+    except archive.UnreadableFile, e:
+      # Vanished or unreadable file, tar would also just warn.
+      if reportFailure:
+        reportFailure(arcname, e)
+      continue
+    if reportProgress:
+      reportProgress(files = 1)
+
+def prune(mirrorDir, arcnames):
+  """ Remove everything from `mirrorDir' that is not a copy of one of the files `arcnames', then
+      the directories left empty. """
+  keep = set(arcnames)
+  for path, dirs, files in os.walk(mirrorDir, topdown = False):
+    relPath = os.path.relpath(path, mirrorDir)
+    for name in files + [d for d in dirs if os.path.islink(os.path.join(path, d))]:
+      arcname = relPath == '.' and name or '%s/%s' % (relPath, name)
+      if arcname not in keep:
+        os.remove(os.path.join(path, name))
+    if path != mirrorDir and not os.listdir(path):
+      os.rmdir(path)
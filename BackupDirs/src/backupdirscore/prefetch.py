@@ -0,0 +1,178 @@
+""" Reading ahead of the archiver. On trees of many small files the time goes to seeking, not
+    compressing, so a job reads its files in inode order, which follows their place on the disk
+    on most filesystems, and a few threads read them before the archiver gets to them, with
+    posix_fadvise() hints to the kernel. The file data held in memory is bounded by a budget
+    shared by all jobs of a run. """
+import ctypes, os, threading
+from cStringIO import StringIO
+
+# Larger files are not held in memory, the kernel is only told to read them ahead.
+max_buffered_size = 1024 * 1024
+# Files a prefetcher reads ahead of the archiver at most.
+max_ahead = 256
+
+POSIX_FADV_SEQUENTIAL = 2
+POSIX_FADV_WILLNEED = 3
+
+try:
+  _libc = ctypes.CDLL(None, use_errno = True)
+  _posix_fadvise = getattr(_libc, 'posix_fadvise64', None)
+  if _posix_fadvise is not None:
+    _posix_fadvise.argtypes = [ctypes.c_int, ctypes.c_int64, ctypes.c_int64, ctypes.c_int]
+except OSError:
+  _posix_fadvise = None
+
+def fadvise(fd, advice):
+  """ posix_fadvise() over the whole file, a hint only: where it is missing nothing happens. """
+  if hasattr(os, 'posix_fadvise'):
+    os.posix_fadvise(fd, 0, 0, advice)
+  elif _posix_fadvise is not None:
+    _posix_fadvise(fd, 0, 0, advice)
+
+def openSequential(path):
+  """ open(path, 'rb') announcing that it will be read through. """
+  f = open(path, 'rb')
+  fadvise(f.fileno(), POSIX_FADV_SEQUENTIAL)
+  return f
+
+class ByteBudget:
+  """ Bytes of file data the prefetchers of a run may hold at once. """
+  def __init__(self, limit):
+    self.lock = threading.Lock()
+    self.limit = limit
+    self.used = 0
+
+  def take(self, size):
+    """ Reserve `size' bytes, False if they do not fit. """
+    with self.lock:
+      if self.used + size > self.limit:
+        return False
+      self.used += size
+      return True
+
+  def give(self, size):
+    with self.lock:
+      self.used -= size
+
+class Prefetcher:
+  """ Reads the `files' (relative path, path, lstat) of a job, in their order, on `threads'
+      threads ahead of the archiver, which takes them with open() in the same order. Files it
+      skips are dropped. Small files are read into memory as far as the ByteBudget `budget'
+      allows, the others only get a WILLNEED hint and are read by the archiver. """
+  def __init__(self, files, threads, budget):
+    self.paths = [path for arcname, path, st in files]
+    self.sizes = [st.st_size for arcname, path, st in files]
+    self.indexOf = dict([(path, i) for i, path in enumerate(self.paths)])
+    self.budget = budget
+    self.condition = threading.Condition()
+    self.results = {} # Index -> data, or None if only hinted.
+    self.claimed = 0 # Next index for the threads.
+    self.consumed = 0 # Next index the archiver wants.
+    self.stopped = False
+    self.threads = []
+    for _ in range(threads):
+      thread = threading.Thread(target = self.work)
+      thread.daemon = True
+      thread.start()
+      self.threads.append(thread)
+
+  def work(self):
+    while True:
+      with self.condition:
+        while not self.stopped and self.claimed < len(self.paths) and self.claimed - self.consumed >= max_ahead:
+          self.condition.wait()
+        # Nothing the archiver went past is read any more.
+        self.claimed = max(self.claimed, self.consumed)
+        if self.stopped or self.claimed >= len(self.paths):
+          return
+        i = self.claimed
+        self.claimed += 1
+      data = self.read(self.paths[i], self.sizes[i])
+      with self.condition:
+        if self.stopped or i < self.consumed:
+          if data is not None:
+            self.budget.give(len(data))
+        else:
+          self.results[i] = data
+          self.condition.notifyAll()
+
+  def read(self, path, size):
+    """ The data of a small file within the budget, else None after hinting the kernel. """
+    try:
+      if size <= max_buffered_size and self.budget.take(size):
+        try:
+          f = open(path, 'rb')
+          try:
+            data = f.read(size)
+          finally:
+            f.close()
+        except:
+          self.budget.give(size)
+          raise
+        if len(data) == size:
+          return data
+        # Changed meanwhile, the archiver reads it itself.
+        self.budget.give(size)
+        return None
+      fd = os.open(path, os.O_RDONLY)
+      try:
+        fadvise(fd, POSIX_FADV_WILLNEED)
+      finally:
+        os.close(fd)
+    except (IOError, OSError):
+      pass # The archiver meets the error itself.
+    return None
+
+  def open(self, path):
+    """ A file object of `path', from memory if it was read ahead. """
+    i = self.indexOf.get(path)
+    if i is None or i < self.consumed:
+      return openSequential(path)
+    with self.condition:
+      # Files skipped by the archiver are dropped.
+      for j in range(self.consumed, i):
+        self.drop(j)
+      self.consumed = i
+      self.condition.notifyAll()
+      while i not in self.results and i < self.claimed and not self.stopped:
+        self.condition.wait()
+      data = self.results.pop(i, None)
+      self.consumed = i + 1
+      self.condition.notifyAll()
+    if data is None:
+      return openSequential(path)
+    self.budget.give(len(data))
+    return StringIO(data)
+
+  def drop(self, i):
+    data = self.results.pop(i, None)
+    if data is not None:
+      self.budget.give(len(data))
+
+  def close(self):
+    """ Stop the threads and give back what they hold. """
+    with self.condition:
+      self.stopped = True
+      for i in self.results.keys():
+        self.drop(i)
+      self.condition.notifyAll()
+
+class ReadAhead:
+  """ How the jobs of a run read: `order' of the files, one of settings.read_orders, `threads'
+      prefetching threads per job, 0 for none, and the `budget' in bytes they share. """
+  def __init__(self, order = 'inode', threads = 0, budget = 0):
+    self.order = order
+    self.threads = threads
+    self.budget = ByteBudget(budget)
+
+  def sort(self, files):
+    """ The `files' of a job in the order to read them. """
+    if self.order == 'inode':
+      return sorted(files, key = lambda f: f[2].st_ino)
+    return files
+
+  def prefetcher(self, files):
+    """ A Prefetcher of `files', or None without prefetching threads. """
+    if self.threads <= 0 or not files:
+      return None
+    return Prefetcher(files, self.threads, self.budget)
@@ -0,0 +1,278 @@
+""" Progress events of a run: bytes read and written, files done, compression ratio, throughput
+    and ETA per directory and overall. The engine only bumps counters, a reporter thread turns
+    them into events at a fixed rate for whoever listens, the GUI or the console. """
+import multiprocessing, sys, threading, time
+
+# Seconds between two events.
+report_interval = 0.5
+# Bytes a pool process moves before it reports them.
+report_bytes = 1024 * 1024
+
+def formatTime(seconds):
+  """ `m:ss', the format of the elapsed time column. """
+  seconds = int(seconds)
+  return '%d:%02d' % (seconds / 60, seconds % 60)
+
+class CountingFile:
+  """ File object wrapper reporting the bytes read or written through `callback'. If `timed' the
+      seconds the call took are passed too, as callback(bytes, seconds). """
+  def __init__(self, fileobj, callback, timed = False):
+    self.fileobj = fileobj
+    self.callback = callback
+    self.timed = timed
+
+  def read(self, size = -1):
+    if self.timed:
+      started = time.time()
+      data = self.fileobj.read(size)
+      self.callback(len(data), time.time() - started)
+    else:
+      data = self.fileobj.read(size)
+      self.callback(len(data))
+    return data
+
+  def write(self, data):
+    if self.timed:
+      started = time.time()
+      self.fileobj.write(data)
+      self.callback(len(data), time.time() - started)
+    else:
+      self.fileobj.write(data)
+      self.callback(len(data))
+
+  def __getattr__(self, name):
+    return getattr(self.fileobj, name)
+
+class DirProgress:
+  """ Counters of one directory, or of the whole run if `dir' is None. """
+  def __init__(self, mydir, bytesTotal = 0, filesTotal = 0):
+    self.dir = mydir
+    self.bytesTotal = bytesTotal
+    self.filesTotal = filesTotal
+    self.bytesRead = 0
+    self.bytesWritten = 0
+    self.bytesStored = 0 # Read bytes that took the fast path without compressing them again.
+    self.filesDone = 0
+    # Seconds the workers spent reading the files, writing the output, held back by the limits and
+    # compressing in their own threads.
+    self.readTime = 0.0
+    self.writeTime = 0.0
+    self.throttledTime = 0.0
+    self.compressTime = 0.0
+    self.started = None
+    self.finished = None
+
+  def copy(self):
+    other = DirProgress(self.dir)
+    other.__dict__.update(self.__dict__)
+    return other
+
+  def elapsed(self, now):
+    if self.started is None:
+      return 0.0
+    return (self.finished or now) - self.started
+
+  def ratio(self):
+    """ Compressed per uncompressed size so far. """
+    return self.bytesRead and float(self.bytesWritten) / self.bytesRead or 0.0
+
+  def throughput(self, now):
+    """ Bytes read per second. """
+    elapsed = self.elapsed(now)
+    return elapsed > 0 and self.bytesRead / elapsed or 0.0
+
+  def eta(self, now):
+    """ Seconds left at the measured throughput, None while it is unknown. """
+    if self.finished:
+      return 0.0
+    throughput = self.throughput(now)
+    if throughput <= 0:
+      return None
+    return max(self.bytesTotal - self.bytesRead, 0) / throughput
+
+  def describe(self, now):
+    text = '%d/%d files, %.1f MB/s, ratio %.2f' % (self.filesDone, self.filesTotal,
+      self.throughput(now) / (1024 * 1024), self.ratio())
+    if self.bytesTotal:
+      text = '%d%%, %s' % (min(100 * self.bytesRead / self.bytesTotal, 100), text)
+    eta = self.eta(now)
+    if self.bytesStored:
+      text += ', %.1f MB stored' % (self.bytesStored / (1024.0 * 1024))
+    if eta is not None and not self.finished:
+      text += ', ETA %s' % formatTime(eta)
+    return text
+
+class ProgressEvent:
+  """ Snapshot of the counters: `dirs' holds a DirProgress per directory changed since the previous
+      event, or of every directory, `overall' the sums. """
+  def __init__(self, now, dirs, overall):
+    self.time = now
+    self.dirs = dirs
+    self.overall = overall
+
+class Progress:
+  """ Thread safe counters, updated by the workers for every block they move. """
+  def __init__(self):
+    self.lock = threading.Lock()
+    self.dirs = {}
+    self.order = []
+    self.overall = DirProgress(None)
+    self.changed = set() # Directories updated since the last event, None once the run finished.
+
+  def addDir(self, mydir, bytesTotal, filesTotal):
+    with self.lock:
+      if mydir not in self.dirs:
+        self.order.append(mydir)
+        self.dirs[mydir] = DirProgress(mydir)
+      self.dirs[mydir].bytesTotal += bytesTotal
+      self.dirs[mydir].filesTotal += filesTotal
+      self.overall.bytesTotal += bytesTotal
+      self.overall.filesTotal += filesTotal
+      self.changed.add(mydir)
+
+  def dirStarted(self, mydir):
+    with self.lock:
+      now = time.time()
+      if self.dirs[mydir].started is None:
+        self.dirs[mydir].started = now
+      if self.overall.started is None:
+        self.overall.started = now
+      self.changed.add(mydir)
+
+  def dirFinished(self, mydir):
+    with self.lock:
+      self.dirs[mydir].finished = time.time()
+      self.changed.add(mydir)
+
+  def finish(self):
+    with self.lock:
+      self.overall.finished = time.time()
+      self.changed.add(None)
+
+  def update(self, mydir, bytesRead = 0, bytesWritten = 0, files = 0, bytesStored = 0, readTime = 0.0,
+             writeTime = 0.0, throttledTime = 0.0, compressTime = 0.0):
+    with self.lock:
+      for counters in (self.dirs[mydir], self.overall):
+        counters.bytesRead += bytesRead
+        counters.bytesWritten += bytesWritten
+        counters.bytesStored += bytesStored
+        counters.filesDone += files
+        counters.readTime += readTime
+        counters.writeTime += writeTime
+        counters.throttledTime += throttledTime
+        counters.compressTime += compressTime
+      self.changed.add(mydir)
+
+  def callback(self, mydir):
+    """ update() bound to `mydir', in the form the engine takes it. """
+    return lambda bytesRead = 0, bytesWritten = 0, files = 0, bytesStored = 0, readTime = 0.0, writeTime = 0.0, \
+      throttledTime = 0.0, compressTime = 0.0: self.update(mydir, bytesRead, bytesWritten, files, bytesStored,
+      readTime, writeTime, throttledTime, compressTime)
+
+  def event(self, force = False):
+    """ A ProgressEvent with the directories changed since the previous one, None if there are
+        none. If `force', one with all the directories, which does not count as the previous one. """
+    with self.lock:
+      if force:
+        return ProgressEvent(time.time(), [self.dirs[mydir].copy() for mydir in self.order], self.overall.copy())
+      if not self.changed:
+        return None
+      changed, self.changed = self.changed, set()
+      return ProgressEvent(time.time(), [self.dirs[mydir].copy() for mydir in changed if mydir is not None],
+        self.overall.copy())
+
+class ProgressReporter(threading.Thread):
+  """ Coalesces the counter updates into at most one event per `interval', passed to each of the
+      `listeners'. Stopping the reporter flushes the final state. """
+  def __init__(self, progress, listeners, interval = report_interval):
+    threading.Thread.__init__(self)
+    self.daemon = True
+    self.progress = progress
+    self.listeners = listeners
+    self.interval = interval
+    self.stopped = threading.Event()
+
+  def run(self):
+    while not self.stopped.isSet():
+      self.stopped.wait(self.interval)
+      self.send(self.progress.event())
+    self.send(self.progress.event())
+
+  def send(self, event):
+    if event is None:
+      return
+    for listener in self.listeners:
+      listener(event)
+
+  def stop(self):
+    self.stopped.set()
+    self.join()
+
+# The progress queue of a pool process, set by initWorker().
+_queue = None
+
+def initWorker(progressQueue):
+  global _queue
+  _queue = progressQueue
+
+class QueueReporter:
+  """ Sends (name, bytes, files) from a pool process to the main process in batches. """
+  def __init__(self, name):
+    self.name = name
+    self.bytes = 0
+    self.files = 0
+
+  def add(self, size = 0, files = 0):
+    self.bytes += size
+    self.files += files
+    if self.bytes >= report_bytes:
+      self.flush()
+
+  def flush(self):
+    if _queue is not None and (self.bytes or self.files):
+      _queue.put((self.name, self.bytes, self.files))
+    self.bytes = 0
+    self.files = 0
+
+def mapOnPool(function, tasks, totals, workers = None, listeners = None):
+  """ Run `function' on each of the `tasks' on `workers' processes and yield the results as they
+      come. `totals' maps the names the tasks report progress under to their expected (bytes,
+      files), the QueueReporters of the tasks count bytesRead and files of those names. """
+  counters = Progress()
+  for name in sorted(totals):
+    counters.addDir(name, totals[name][0], totals[name][1])
+    counters.dirStarted(name)
+  progressQueue = multiprocessing.Queue()
+  pool = multiprocessing.Pool(workers or multiprocessing.cpu_count(), initWorker, (progressQueue,))
+  def drain():
+    while True:
+      message = progressQueue.get()
+      if message is None:
+        return
+      name, size, files = message
+      counters.update(name, bytesRead = size, files = files)
+  drainer = threading.Thread(target = drain)
+  drainer.daemon = True
+  drainer.start()
+  reporter = ProgressReporter(counters, listeners or [])
+  reporter.start()
+  try:
+    for result in pool.imap_unordered(function, tasks):
+      yield result
+    pool.close()
+  except:
+    pool.terminate()
+    raise
+  finally:
+    pool.join()
+    progressQueue.put(None)
+    drainer.join()
+    for name in totals:
+      counters.dirFinished(name)
+    counters.finish()
+    reporter.stop()
+
+def printProgress(event, out = sys.stderr):
+  """ Console listener for the headless mode. """
+  out.write('%s %s\n' % (formatTime(event.overall.elapsed(event.time)), event.overall.describe(event.time)))
+  out.flush()
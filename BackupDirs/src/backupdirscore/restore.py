@@ -0,0 +1,200 @@
+""" Restoring backup folders, whole or single paths of them, whatever mode they were written in.
+    Every file is taken from the newest archive of its increment chain that holds it, so the
+    archives are independent of each other and are extracted in parallel on a process pool,
+    large indexed ones in several ranges of blocks. A partial restore only opens the archives,
+    and with an index only reads the blocks, holding files it wants. The files get the mode and
+    mtime of the manifest or snapshot. """
+import os, sys, zipfile
+
+import archive, archiveindex, compress, dedup, incremental, progress
+
+# Bytes of member data per restore task of an indexed archive.
+task_bytes = 32 * 1024 * 1024
+# Files per restore task of a dedup snapshot.
+files_per_task = 256
+
+class RestoreTask:
+  """ Files of directory `name' to write below `target', (relative path, manifest entry) pairs,
+      from `archiveFile' or from the chunk store in `backupRoot' with the chunk keys `chunks' of
+      each path. """
+  def __init__(self, name, target, files, archiveFile = None, backupRoot = None, chunks = None):
+    self.name = name
+    self.target = target
+    self.files = files
+    self.archiveFile = archiveFile
+    self.backupRoot = backupRoot
+    self.chunks = chunks
+
+def selectPaths(paths, relPath):
+  """ The files of `paths' that are `relPath' or below it, all of them for an empty `relPath'. """
+  relPath = relPath.strip('/')
+  if not relPath:
+    return sorted(paths)
+  return sorted([path for path in paths if path == relPath or path.startswith(relPath + '/')])
+
+def compressionOf(archiveFile):
+  """ The compression method of the tar archive `archiveFile'. """
+  for compressionMethod in compress.parallel_methods:
+    if archiveFile.endswith(archive.archive_suffixes[compressionMethod]):
+      return compressionMethod
+  raise ValueError('Unknown archive type of %s' % archiveFile)
+
+def planIncremental(name, backupFolder, relPath, target, missing):
+  """ The RestoreTasks for the files of `name' at `relPath', searching the increment chain from
+      the newest folder back. The files no archive holds are added to `missing' as NAME/PATH. """
+  manifest = incremental.Manifest.load(os.path.join(backupFolder, name + incremental.manifest_suffix))
+  wanted = dict([(path, manifest.entries[path]) for path in selectPaths(manifest.entries, relPath)])
+  tasks = []
+  for folder in reversed(incremental.backupChain(name, backupFolder)):
+    for archiveFile in archive.findArchives(name, folder):
+      if not wanted:
+        break
+      members, index = archive.archiveMembers(archiveFile)
+      found = [path for path in wanted if path in members]
+      if not found:
+        continue
+      files = [(path, wanted.pop(path)) for path in found]
+      if index is None:
+        tasks.append(RestoreTask(name, target, files, archiveFile))
+        continue
+      # Ranges of adjacent members, each read in one pass.
+      files.sort(key = lambda f: index.members[f[0]].offset)
+      batch = []
+      size = 0
+      for path, entry in files:
+        batch.append((path, entry))
+        size += entry[0]
+        if size >= task_bytes:
+          tasks.append(RestoreTask(name, target, batch, archiveFile))
+          batch = []
+          size = 0
+      if batch:
+        tasks.append(RestoreTask(name, target, batch, archiveFile))
+  missing.extend(['%s/%s' % (name, path) for path in sorted(wanted)])
+  return tasks
+
+def planDedup(name, backupFolder, relPath, target):
+  snapshot = dedup.Snapshot.load(os.path.join(backupFolder, name + dedup.snapshot_suffix))
+  backupRoot = os.path.dirname(os.path.abspath(backupFolder))
+  paths = selectPaths(snapshot.files, relPath)
+  tasks = []
+  for i in range(0, len(paths), files_per_task):
+    batch = paths[i:i + files_per_task]
+    tasks.append(RestoreTask(name, target, [(path, snapshot.files[path][0]) for path in batch],
+      backupRoot = backupRoot, chunks = dict([(path, snapshot.files[path][1]) for path in batch])))
+  return tasks
+
+def planPath(backupFolder, path, destination, missing):
+  """ The RestoreTasks for `path', NAME or NAME/RELATIVE/PATH of the backed up directory NAME.
+      Files of the manifest that are in none of the archives are added to `missing'. """
+  name, _, relPath = path.strip('/').partition('/')
+  target = os.path.join(destination, name)
+  if os.path.isfile(os.path.join(backupFolder, name + incremental.manifest_suffix)):
+    tasks = planIncremental(name, backupFolder, relPath, target, missing)
+  elif os.path.isfile(os.path.join(backupFolder, name + dedup.snapshot_suffix)):
+    tasks = planDedup(name, backupFolder, relPath, target)
+  else:
+    raise IOError('No backup of %s in %s' % (name, backupFolder))
+  if not tasks and not [path for path in missing if path.startswith(name + '/')]:
+    raise IOError('No file %s in the backup of %s' % (relPath, name))
+  return tasks
+
+def setAttributes(fileName, entry):
+  """ Mode and mtime of the manifest `entry'. """
+  os.chmod(fileName, entry[3] & 07777)
+  mtime = entry[1] / 1000000.0
+  os.utime(fileName, (mtime, mtime))
+
+def restoreTask(task):
+  """ Write the files of `task'. Runs in the pool processes. Return the number of files. """
+  reporter = progress.QueueReporter(task.name)
+  def done(path, entry):
+    setAttributes(os.path.join(task.target, path), entry)
+    reporter.add(entry[0], 1)
+  if task.backupRoot:
+    # restoreEntries() sets the attributes itself.
+    dedup.restoreEntries(dedup.ChunkStore(task.backupRoot), task.target,
+      [(path, (entry, task.chunks[path])) for path, entry in task.files], lambda path, size: reporter.add(size, 1))
+  elif os.path.isfile(archiveindex.indexName(task.archiveFile)):
+    index = archiveindex.ArchiveIndex.load(archiveindex.indexName(task.archiveFile))
+    fileOf = dict([(os.path.join(task.target, path), (path, entry)) for path, entry in task.files])
+    members = [(index.members[path], os.path.join(task.target, path)) for path, entry in task.files]
+    archiveindex.copyMembers(task.archiveFile, compressionOf(task.archiveFile), index, members,
+      lambda member, target: done(*fileOf[target]))
+  else:
+    entries = dict(task.files)
+    f = archive.openArchive(task.archiveFile)
+    try:
+      if isinstance(f, zipfile.ZipFile):
+        for path in sorted(entries):
+          f.extract(path, task.target)
+          done(path, entries[path])
+      else:
+        for info in f:
+          if info.name in entries:
+            f.extract(info, task.target)
+            done(info.name, entries.pop(info.name))
+            if not entries:
+              break
+    finally:
+      f.close()
+  reporter.flush()
+  return len(task.files)
+
+def runTasks(tasks, workers = None, listeners = None):
+  """ Create the directories of the `tasks' and run them on `workers' processes. """
+  totals = {}
+  directories = set()
+  for task in tasks:
+    size, files = totals.get(task.name, (0, 0))
+    totals[task.name] = (size + sum([entry[0] for path, entry in task.files]), files + len(task.files))
+    for path, entry in task.files:
+      directories.add(os.path.dirname(os.path.join(task.target, path)))
+  # Here, so that the processes do not race creating them.
+  for directory in sorted(directories):
+    if not os.path.isdir(directory):
+      os.makedirs(directory)
+  for files in progress.mapOnPool(restoreTask, tasks, totals, workers, listeners):
+    pass
+
+def restoreBackup(backupFolder, destination, workers = None, listeners = None):
+  """ Restore every directory that has a manifest or a snapshot in `backupFolder' to `destination'
+      on `workers' processes, progress events go to the `listeners'. Return the directories and the
+      files that could not be restored, as NAME/PATH, because none of the archives holds them. """
+  names = []
+  for fileName in sorted(os.listdir(backupFolder)):
+    for suffix in (incremental.manifest_suffix, dedup.snapshot_suffix):
+      if fileName.endswith(suffix):
+        names.append(fileName[:-len(suffix)])
+  tasks = []
+  missing = []
+  restored = []
+  for name in names:
+    planned = planPath(backupFolder, name, destination, missing)
+    if planned:
+      tasks.extend(planned)
+      restored.append(os.path.join(destination, name))
+  runTasks(tasks, workers, listeners)
+  return restored, missing
+
+def restorePaths(backupFolder, paths, destination, workers = None, listeners = None):
+  """ Restore the `paths' of `backupFolder', each NAME/RELATIVE/PATH to a file or directory below
+      the backed up directory NAME, into `destination'/NAME. Return where they were restored and the
+      files missing from the archives, see restoreBackup(). """
+  tasks = []
+  missing = []
+  restored = []
+  for path in paths:
+    planned = planPath(backupFolder, path, destination, missing)
+    if planned:
+      tasks.extend(planned)
+      restored.append(os.path.join(destination, path.strip('/')))
+  runTasks(tasks, workers, listeners)
+  return restored, missing
+
+def printRestoreProgress(event, out = sys.stderr):
+  """ Console listener: files written and the throughput. """
+  overall = event.overall
+  out.write('%s restored %d/%d files, %.1f MB, %.1f MB/s\n' % (progress.formatTime(overall.elapsed(event.time)),
+    overall.filesDone, overall.filesTotal, overall.bytesRead / (1024.0 * 1024), overall.throughput(event.time) / (1024 * 1024)))
+  out.flush()
@@ -0,0 +1,118 @@
+""" Include and exclude rules of the scan, the `rules' setting. Rules are separated by `;', the
+    first rule matching a path decides, paths matching none are included:
+
+      rules=+important.log;-*.log;-node_modules/;-.git/;-/build/;-re:.*\.py[co]$
+
+    `+' includes and `-' excludes. A pattern ending in `/' matches directories only. A pattern
+    with a `/' elsewhere is matched against the path relative to the backed up directory (a
+    leading `/' anchors it there), otherwise against the name at any depth. Patterns are globs
+    where `*' and `?' do not match `/', `**' matches anything and `**/' any number of
+    directories, or regular expressions after
+    `re:', matched from the start of the relative path. Excluded directories are not descended
+    into at all. The rules come on top of `fileSuffix' and `fileSizeLimit'. """
+import re
+
+# Separates the rules within the setting.
+rule_separator = ';'
+
+class RuleError(ValueError):
+  pass
+
+class Rule:
+  def __init__(self, text):
+    self.text = text
+    if len(text) < 2 or text[0] not in '+-':
+      raise RuleError('Rule "%s" must be +PATTERN or -PATTERN' % text)
+    self.include = text[0] == '+'
+    pattern = text[1:]
+    if pattern.startswith('re:'):
+      self.dirOnly = False
+      self.regex = pattern[3:]
+    else:
+      self.dirOnly = pattern.endswith('/')
+      pattern = pattern.rstrip('/')
+      if '/' in pattern:
+        self.regex = globToRegex(pattern.lstrip('/')) + '$'
+      else:
+        # The name at any depth.
+        self.regex = '(?:.*/)?' + globToRegex(pattern) + '$'
+    try:
+      self.groups = re.compile(self.regex).groups
+    except re.error, e:
+      raise RuleError('Rule "%s" is not a valid regular expression: %s' % (text, e))
+
+def globToRegex(pattern):
+  """ Like fnmatch.translate(), but `*' and `?' stop at `/'. """
+  result = []
+  i = 0
+  while i < len(pattern):
+    c = pattern[i]
+    i += 1
+    if c == '*':
+      if pattern[i:i + 2] == '*/':
+        i += 2
+        result.append('(?:.*/)?')
+      elif pattern[i:i + 1] == '*':
+        i += 1
+        result.append('.*')
+      else:
+        result.append('[^/]*')
+    elif c == '?':
+      result.append('[^/]')
+    elif c == '[':
+      end = pattern.find(']', i + 1)
+      if end < 0:
+        result.append('\\[')
+      else:
+        body = pattern[i:end].replace('\\', '\\\\')
+        if body.startswith('!'):
+          body = '^' + body[1:]
+        result.append('[%s]' % body)
+        i = end + 1
+    else:
+      result.append(re.escape(c))
+  return ''.join(result)
+
+def parseRules(text):
+  """ The list of Rules in the setting `text'. Raises RuleError. """
+  return [Rule(part.strip()) for part in text.split(rule_separator) if part.strip()]
+
+class Matcher:
+  """ The rules compiled into one regular expression for files and one for directories. The
+      alternatives are tried in order, so the group that matched tells the first matching rule. """
+  def __init__(self, text):
+    self.rules = parseRules(text)
+    self.fileRegex, self.fileRules = self.compile([rule for rule in self.rules if not rule.dirOnly])
+    self.dirRegex, self.dirRules = self.compile(self.rules)
+
+  def compile(self, rules):
+    """ Return the combined expression and the rule of each of its outer groups. """
+    if not rules:
+      return None, {}
+    alternatives = []
+    ruleOfGroup = {}
+    group = 1
+    for rule in rules:
+      alternatives.append('(%s)' % rule.regex)
+      ruleOfGroup[group] = rule
+      group += rule.groups + 1
+    return re.compile('|'.join(alternatives), re.DOTALL), ruleOfGroup
+
+  def isEmpty(self):
+    return not self.rules
+
+  def includes(self, regex, ruleOfGroup, relPath):
+    if regex is None:
+      return True
+    match = regex.match(relPath)
+    if match is None:
+      return True
+    return ruleOfGroup[match.lastindex].include
+
+  def includesFile(self, relPath):
+    """ `relPath' is relative to the backed up directory, without a leading `/'. """
+    return self.includes(self.fileRegex, self.fileRules, relPath)
+
+  def includesDir(self, relPath):
+    """ False if the directory and everything below it is excluded. """
+    return self.includes(self.dirRegex, self.dirRules, relPath)
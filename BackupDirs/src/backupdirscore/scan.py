@@ -0,0 +1,153 @@
+""" One pass filesystem scan: the file list to archive plus the per-directory statistics. """
+import fnmatch, os, stat
+
+try:
+  from os import scandir
+except ImportError:
+  try:
+    from scandir import scandir # Backport for Python 2, `pip install scandir'.
+  except ImportError:
+    scandir = None
+
+def walkKey(arcname):
+  """ Sort key of the scan order: the files of a directory come before its subdirectories. """
+  names = arcname.split('/')
+  return tuple([(1, name) for name in names[:-1]] + [(0, names[-1])])
+
+def isSmallEnough(size, fileSizeLimit):
+  """ Same semantics as `find -size -Nk': size is rounded up to kilobytes. """
+  return (size + 1023) / 1024 < fileSizeLimit
+
+class DirScan:
+  """ Result of scanning one directory, shared by scheduling, archiving and the summary. """
+  def __init__(self, mydir):
+    self.dir = mydir
+    self.files = [] # (relative path, absolute path, lstat) of the files to archive.
+    self.bytes = 0 # Total size of `files'.
+    self.totalFiles = 0 # Every regular file, filtered or not.
+    self.totalBytes = 0
+    self.skippedBySuffix = 0
+    self.skippedBySize = 0
+    self.skippedByRule = 0
+    self.skippedBytes = 0
+    self.prunedDirs = 0 # Excluded by the rules, not even listed.
+    self.errors = 0 # Entries that could not be listed or stat'ed.
+
+  def skippedFiles(self):
+    return self.skippedBySuffix + self.skippedBySize + self.skippedByRule
+
+def listDir(path):
+  """ Generate (name, is directory, lstat or None for directories) of the entries of `path'.
+      Directory entries come without a stat call when scandir is available. """
+  if scandir is not None:
+    for entry in scandir(path):
+      if entry.is_dir(follow_symlinks = False):
+        yield entry.name, True, None
+      else:
+        yield entry.name, False, entry.stat(follow_symlinks = False)
+  else:
+    for name in os.listdir(path):
+      st = os.lstat(os.path.join(path, name))
+      yield name, stat.S_ISDIR(st.st_mode), st
+
+def selectFiles(result, path, relPath, files, fileSuffix, fileSizeLimit, matcher):
+  """ Count the regular `files', (name, lstat) pairs of directory `path', and add the ones the
+      filters select to `result'. """
+  files.sort()
+  for name, st in files:
+    result.totalFiles += 1
+    result.totalBytes += st.st_size
+    if matcher and not matcher.includesFile(relPath + name):
+      result.skippedByRule += 1
+      result.skippedBytes += st.st_size
+    elif not fnmatch.fnmatch(name, fileSuffix):
+      result.skippedBySuffix += 1
+      result.skippedBytes += st.st_size
+    elif not isSmallEnough(st.st_size, fileSizeLimit):
+      result.skippedBySize += 1
+      result.skippedBytes += st.st_size
+    else:
+      result.files.append((relPath + name, os.path.join(path, name), st))
+      result.bytes += st.st_size
+
+def walk(result, top, relTop, fileSuffix, fileSizeLimit, cancel, matcher, recursive = True):
+  """ Add the files of `top', whose path relative to the scanned directory is `relTop' with a
+      trailing `/', and without `recursive' only of `top' itself, to `result'. """
+  stack = [(top, relTop)]
+  while stack:
+    path, relPath = stack.pop()
+    if cancel:
+      cancel.check()
+    files = []
+    subDirs = []
+    try:
+      for name, isDir, st in listDir(path):
+        if isDir:
+          subDirs.append(name)
+        elif stat.S_ISREG(st.st_mode):
+          files.append((name, st))
+    except OSError:
+      result.errors += 1
+      continue
+    selectFiles(result, path, relPath, files, fileSuffix, fileSizeLimit, matcher)
+    if not recursive:
+      continue
+    if matcher:
+      kept = [name for name in subDirs if matcher.includesDir(relPath + name)]
+      result.prunedDirs += len(subDirs) - len(kept)
+      subDirs = kept
+    subDirs.sort(reverse = True)
+    for name in subDirs:
+      stack.append((os.path.join(path, name), relPath + name + '/'))
+
+def scanDir(mydir, fileSuffix, fileSizeLimit, cancel = None, matcher = None):
+  """ Walk `mydir' once, symlinks are not followed. The selected files are the regular ones
+      matching `fileSuffix' and smaller than `fileSizeLimit' kilobytes, like with
+      `find -type f -name SUFFIX -size -LIMITk', and included by the rules.Matcher `matcher'.
+      Directories the rules exclude are pruned. The `cancel' token is checked per directory. """
+  result = DirScan(mydir)
+  walk(result, mydir, '', fileSuffix, fileSizeLimit, cancel, matcher)
+  return result
+
+class EntryStat:
+  """ Stands in for the lstat of an unchanged file, made from its manifest entry. """
+  def __init__(self, entry):
+    self.st_size, mtime, self.st_ino, self.st_mode = entry
+    self.st_mtime = self.st_atime = self.st_ctime = mtime / 1000000.0
+
+def isBelow(relPath, relDirs):
+  """ True if `relPath' is one of the relative directories `relDirs' or below one of them. """
+  while relPath:
+    if relPath in relDirs:
+      return True
+    relPath = os.path.dirname(relPath)
+  return '' in relDirs
+
+def scanDirty(mydir, entries, subtrees, dirs, fileSuffix, fileSizeLimit, cancel = None, matcher = None):
+  """ scanDir() for a tree whose changes since the previous run are known: only the directories
+      `dirs' and the whole subtrees `subtrees', paths relative to `mydir', are listed, the other
+      files are taken over from `entries', the manifest entries of the previous run. They passed
+      the same filters then. The files come in the order of scanDir(). """
+  result = DirScan(mydir)
+  if '' in subtrees:
+    walk(result, mydir, '', fileSuffix, fileSizeLimit, cancel, matcher)
+    return result
+  for arcname, entry in entries.iteritems():
+    parent = os.path.dirname(arcname)
+    if parent not in dirs and not isBelow(parent, subtrees):
+      st = EntryStat(entry)
+      result.files.append((arcname, os.path.join(mydir, arcname), st))
+      result.bytes += st.st_size
+      result.totalFiles += 1
+      result.totalBytes += st.st_size
+  for relPath in sorted(subtrees):
+    # Removed ones just drop their files.
+    if not isBelow(os.path.dirname(relPath), subtrees) and os.path.isdir(os.path.join(mydir, relPath)) \
+        and (not matcher or matcher.includesDir(relPath)):
+      walk(result, os.path.join(mydir, relPath), relPath + '/', fileSuffix, fileSizeLimit, cancel, matcher)
+  for relPath in sorted(dirs):
+    if not isBelow(relPath, subtrees) and os.path.isdir(os.path.join(mydir, relPath)):
+      walk(result, os.path.join(mydir, relPath), relPath and relPath + '/', fileSuffix, fileSizeLimit, cancel,
+        matcher, False)
+  result.files.sort(key = lambda f: walkKey(f[0]))
+  return result
@@ -0,0 +1,104 @@
+""" Size aware scheduling: largest jobs first, oversized directories split into file ranges that
+    idle workers can take, and predicted versus actual makespan. """
+import threading, time
+
+# Fixed cost of a file in bytes, so that trees of tiny files are not taken for free.
+file_cost = 4096
+# Directories are never split into parts smaller than this.
+min_split_bytes = 256 * 1024 * 1024
+
+def cost(files):
+  return sum([st.st_size + file_cost for arcname, path, st in files])
+
+class Job:
+  """ The `part'th of `parts' file ranges of directory `dir'. """
+  def __init__(self, mydir, part, parts, files):
+    self.dir = mydir
+    self.part = part
+    self.parts = parts
+    self.files = files
+    self.cost = cost(files)
+
+def splitFiles(files, parts):
+  """ Cut the file list into `parts' contiguous ranges of about equal cost. The list is in walk
+      order, so a range is made of whole neighbouring subtrees, apart from the edges. """
+  share = cost(files) / float(parts)
+  ranges = [[]]
+  rangeCost = 0
+  for f in files:
+    if rangeCost >= share and len(ranges) < parts:
+      ranges.append([])
+      rangeCost = 0
+    ranges[-1].append(f)
+    rangeCost += f[2].st_size + file_cost
+  return ranges
+
+def schedule(dirFiles, workers, minSplitBytes = min_split_bytes):
+  """ Turn (directory, files) pairs into jobs ordered largest first. A directory costing more
+      than the fair share of a worker is split, so no single job decides the run time. """
+  total = sum([cost(files) for mydir, files in dirFiles])
+  share = max(total / max(workers, 1), minSplitBytes)
+  jobs = []
+  for mydir, files in dirFiles:
+    parts = max(1, min(len(files), -(-cost(files) // share)))
+    if parts == 1:
+      jobs.append(Job(mydir, 1, 1, files))
+    else:
+      # Uneven file sizes can leave fewer ranges than asked for.
+      ranges = splitFiles(files, parts)
+      for i, partFiles in enumerate(ranges):
+        jobs.append(Job(mydir, i + 1, len(ranges), partFiles))
+  jobs.sort(key = lambda job: job.cost, reverse = True)
+  return jobs
+
+def predictLoads(jobs, workers):
+  """ Per worker load when each job in order goes to the least loaded worker, which is what the
+      shared queue does if job time is proportional to cost. """
+  loads = [0] * max(workers, 1)
+  for job in jobs:
+    loads[loads.index(min(loads))] += job.cost
+  return loads
+
+class Makespan:
+  """ Predicted versus actual run time of a scheduled run. """
+  def __init__(self, jobs, workers):
+    self.jobs = jobs
+    self.workers = workers
+    self.predicted = max(predictLoads(jobs, workers) or [0])
+    self.lowerBound = max(sum([job.cost for job in jobs]) / max(workers, 1),
+                          max([job.cost for job in jobs] or [0]))
+    self.lock = threading.Lock()
+    self.busy = 0.0 # Seconds spent in jobs, summed over the workers.
+    self.begin = None
+    self.end = None
+
+  def jobStarted(self):
+    with self.lock:
+      if self.begin is None:
+        self.begin = time.time()
+
+  def jobDone(self, seconds):
+    with self.lock:
+      self.busy += seconds
+      self.end = time.time()
+
+  def actual(self):
+    if self.begin is None:
+      return 0.0
+    return (self.end or time.time()) - self.begin
+
+  def report(self):
+    """ One line summary. Costs are turned into seconds with the throughput measured per worker. """
+    mb = 1024.0 * 1024.0
+    line = 'Makespan: %d jobs on %d workers, busiest worker %.1f MB (lower bound %.1f MB)' \
+      % (len(self.jobs), self.workers, self.predicted / mb, self.lowerBound / mb)
+    total = sum([job.cost for job in self.jobs])
+    # Nothing to measure if every file was filtered out.
+    if self.busy > 0 and total > 0:
+      throughput = total / self.busy
+      line += ', predicted %.1fs, actual %.1fs, utilisation %d%%' % (self.predicted / throughput,
+        self.actual(), 100 * self.busy / (self.workers * max(self.actual(), 1e-6)))
+      alternatives = sorted(set([n for n in (1, 2, 4, 8, 16, self.workers) if n <= self.workers]))
+      line += ', predicted by worker count: %s' % ', '.join(['%d:%.1fs'
+        % (n, max(predictLoads(self.jobs, n)) / throughput) for n in alternatives])
+    return line
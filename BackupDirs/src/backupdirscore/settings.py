@@ -0,0 +1,109 @@
+""" The settings file: a [DIRECTORIES] section with one directory per line and a [SETTINGS]
+    section of name=value lines. """
+import os, re
+
+import rules as _rules
+
+# Maybe `/tmp' would be a better choice for default.
+settings_file = '%s/.backupdirs' % os.environ.get('HOME', '')
+compression_methods = ('gz', 'bz2', 'zip')
+# Dedup stores content defined chunks once in a shared store instead of writing archives, mirror
+# keeps an uncompressed copy of the directories in sync.
+backup_modes = ('full', 'incremental', 'dedup', 'mirror')
+# I/O priority of the archive workers, `low' and `idle' leave the disk to the other processes.
+io_priorities = ('normal', 'low', 'idle')
+# Order the files of a directory are read in, `inode' is close to their place on the disk.
+read_orders = ('inode', 'walk')
+
+def defaultSettings():
+  """ Name-value string pairs. """
+  return { 'targetDir':os.environ.get('HOME', ''), 'backupMode':'full', 'compressionMethod':'bz2',
+           'compressionWorkers':'1', 'archiveWorkers':'0', 'fileSizeLimit':'1000', 'fileSuffix':'*',
+           'rules':'', 'readLimit':'0', 'writeLimit':'0', 'cpuWorkers':'0', 'ioPriority':'normal',
+           'readOrder':'inode', 'prefetchThreads':'0', 'prefetchBudget':'65536', 'metricsTextfile':'' }
+
+def loadSettings(fileName = settings_file):
+  """ Return the directory list and the settings, defaults included. Raises IOError if the file
+      cannot be read. Reading stops at the first malformed setting. """
+  dirs = []
+  settings = defaultSettings()
+  f = open(fileName, 'r')
+  try:
+    reading_directories = False
+    reading_settings = False
+    for line in f:
+      line = line.strip()
+      if re.match('^\[DIRECTORIES\]$', line):
+        reading_directories = True
+        reading_settings = False
+      elif re.match('\[SETTINGS\]$', line):
+        reading_settings = True
+        reading_directories = False
+      else:
+        if reading_directories:
+          dirs.append(line)
+        elif reading_settings:
+          # Values may contain `=', the rules do.
+          splitted = line.split('=', 1)
+          if len(splitted) != 2:
+            break
+          settings[splitted[0]] = splitted[1]
+  finally:
+    f.close()
+  return dirs, settings
+
+def storeSettings(dirs, settings, fileName = settings_file):
+  """ Raises IOError if the file cannot be written. """
+  f = open(fileName, 'w')
+  try:
+    if len(dirs) > 0:
+      f.write('[DIRECTORIES]\n')
+      for d in dirs:
+        f.write('%s\n' % d)
+    if len(settings.keys()) > 0:
+      f.write('[SETTINGS]\n')
+      for name, value in settings.items():
+        f.write('%s=%s\n' % (name, value))
+  finally:
+    f.close()
+
+def checkSettings(settings):
+  """ Return the list of problems with the values, empty if they can be used for a run. """
+  problems = []
+  if settings['compressionMethod'] not in compression_methods:
+    problems.append('Invalid value "%s" for compressionMethod' % settings['compressionMethod'])
+  if settings['backupMode'] not in backup_modes:
+    problems.append('Invalid value "%s" for backupMode' % settings['backupMode'])
+  for name in ('compressionWorkers', 'fileSizeLimit'):
+    try:
+      if int(settings[name]) < 1:
+        raise ValueError()
+    except ValueError:
+      problems.append('Invalid value "%s" for %s' % (settings[name], name))
+  # 0 sizes the thread pool from the number of CPUs, for the limits in KB/s and the cpuWorkers
+  # it means none. The prefetchBudget is in KB.
+  for name in ('archiveWorkers', 'readLimit', 'writeLimit', 'cpuWorkers', 'prefetchThreads', 'prefetchBudget'):
+    try:
+      if int(settings[name]) < 0:
+        raise ValueError()
+    except ValueError:
+      problems.append('Invalid value "%s" for %s' % (settings[name], name))
+  if settings['ioPriority'] not in io_priorities:
+    problems.append('Invalid value "%s" for ioPriority' % settings['ioPriority'])
+  if settings['readOrder'] not in read_orders:
+    problems.append('Invalid value "%s" for readOrder' % settings['readOrder'])
+  try:
+    _rules.parseRules(settings['rules'])
+  except _rules.RuleError, e:
+    problems.append(str(e))
+  return problems
+
+def isSubDir(aDir, bDir):
+  return aDir.startswith(bDir) or bDir.startswith(aDir)
+
+def canWeStart(dirs, targetDir):
+  """ The target directory must not be inside of, or contain, a directory to be archived. """
+  for d in dirs:
+    if isSubDir(d, targetDir):
+      return False
+  return True
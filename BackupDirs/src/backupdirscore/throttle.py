@@ -0,0 +1,170 @@
+""" Keeping a run from starving the other processes of the machine: byte rate limits of reading
+    and writing shared by all workers, a cap on the blocks being compressed at once and the I/O
+    priority of the workers. The limits can be changed while a run is in progress, the time the
+    workers spent held back is reported in the summary. """
+import ctypes, os, platform, threading, time
+
+# Seconds of the rate a bucket holds when nothing was moved for a while.
+burst_seconds = 0.5
+
+# ioprio_set() has no wrapper in glibc, the syscall numbers by machine.
+ioprio_set_numbers = { 'x86_64':251, 'i386':289, 'i686':289, 'aarch64':30, 'armv7l':314, 'ppc64le':273,
+                       's390x':282 }
+IOPRIO_WHO_PROCESS = 1
+IOPRIO_CLASS_SHIFT = 13
+# Priority values by setting: no class follows the nice value, best effort level 7 is the lowest
+# of the normal ones, idle only gets the disk when nobody else wants it.
+ioprio_values = { 'normal':0, 'low':(2 << IOPRIO_CLASS_SHIFT) | 7, 'idle':3 << IOPRIO_CLASS_SHIFT }
+
+try:
+  _libc = ctypes.CDLL(None, use_errno = True)
+except OSError:
+  _libc = None
+
+def setIoPriority(priority):
+  """ Set the I/O priority of the calling thread, the threads and processes it starts inherit it.
+      Raises OSError where the kernel does not support it. """
+  number = ioprio_set_numbers.get(platform.machine())
+  if _libc is None or number is None:
+    raise OSError('I/O priorities are not supported on %s' % platform.machine())
+  if _libc.syscall(number, IOPRIO_WHO_PROCESS, 0, ioprio_values[priority]) < 0:
+    e = ctypes.get_errno()
+    raise OSError(e, os.strerror(e))
+
+class TokenBucket:
+  """ A rate limit of `rate' bytes per second shared by threads, 0 for none. Bytes are taken
+      after they were moved and a thread sleeps off the debt, so the rate holds on average
+      whatever the block sizes. Threads coming while others sleep queue up behind their debt. """
+  def __init__(self, rate = 0):
+    self.lock = threading.Lock()
+    self.rate = rate
+    self.tokens = 0.0
+    self.updated = time.time()
+    self.waited = 0.0 # Seconds slept, summed over the threads.
+
+  def refill(self, now):
+    if self.rate:
+      self.tokens = min(self.tokens + (now - self.updated) * self.rate, self.rate * burst_seconds)
+    self.updated = now
+
+  def setRate(self, rate):
+    with self.lock:
+      self.refill(time.time())
+      self.rate = rate
+      if not rate:
+        self.tokens = 0.0
+
+  def take(self, size, cancel = None):
+    """ Account for `size' bytes moved, sleeping as long as the rate asks for. A `cancel' token
+        ends the sleep. Return the seconds slept. """
+    with self.lock:
+      if not self.rate:
+        return 0.0
+      self.refill(time.time())
+      self.tokens -= size
+      wait = -self.tokens / self.rate
+    if wait <= 0:
+      return 0.0
+    started = time.time()
+    if cancel:
+      cancel.event.wait(wait)
+    else:
+      time.sleep(wait)
+    waited = time.time() - started
+    with self.lock:
+      self.waited += waited
+    return waited
+
+class Gate:
+  """ At most `slots' holders at once, 0 for no limit. The number of slots may change while the
+      gate is held. A context manager. """
+  def __init__(self, slots = 0):
+    self.condition = threading.Condition()
+    self.slots = slots
+    self.held = 0
+    self.waited = 0.0 # Seconds waited for a slot, summed over the threads.
+
+  def setSlots(self, slots):
+    with self.condition:
+      self.slots = slots
+      self.condition.notifyAll()
+
+  def acquire(self, blocking = True, giveBack = None):
+    """ Take a slot. Without `blocking' return False instead of waiting for one. A holder of
+        several slots passes `giveBack', which is called while none is free as long as it returns
+        True, to release one of its own rather than wait for the others. """
+    started = None
+    while True:
+      with self.condition:
+        if not self.slots or self.held < self.slots:
+          self.held += 1
+          if started is not None:
+            self.waited += time.time() - started
+          return True
+        if not blocking:
+          return False
+        if started is None:
+          started = time.time()
+        if giveBack is None:
+          self.condition.wait()
+          continue
+      if not giveBack():
+        giveBack = None
+
+  def release(self):
+    with self.condition:
+      self.held -= 1
+      self.condition.notify()
+
+  def __enter__(self):
+    self.acquire()
+    return self
+
+  def __exit__(self, *exception):
+    self.release()
+
+def limitsOf(settings):
+  """ Read and write limits in bytes per second and the CPU slots of the `settings' readLimit and
+      writeLimit, in kilobytes per second, and cpuWorkers. 0 is no limit. """
+  return int(str(settings.get('readLimit', 0))) * 1024, int(str(settings.get('writeLimit', 0))) * 1024, \
+    int(str(settings.get('cpuWorkers', 0)))
+
+class Throttle:
+  """ The limits of a run: the `read' and `write' TokenBuckets and the `cpu' Gate. """
+  def __init__(self, settings, cancel = None):
+    readRate, writeRate, cpuSlots = limitsOf(settings)
+    self.read = TokenBucket(readRate)
+    self.write = TokenBucket(writeRate)
+    self.cpu = Gate(cpuSlots)
+    self.cancel = cancel
+
+  def setLimits(self, settings):
+    """ Take the limits of the `settings' from now on. Thread safe. """
+    readRate, writeRate, cpuSlots = limitsOf(settings)
+    self.read.setRate(readRate)
+    self.write.setRate(writeRate)
+    self.cpu.setSlots(cpuSlots)
+
+  def wrap(self, reportProgress):
+    """ reportProgress(bytesRead, bytesWritten, files, bytesStored, readTime, writeTime,
+        throttledTime, compressTime) that holds the calling worker back to the rates after passing the counts on,
+        the time held back is reported as throttledTime. """
+    def report(bytesRead = 0, bytesWritten = 0, files = 0, bytesStored = 0, readTime = 0.0, writeTime = 0.0,
+               throttledTime = 0.0, compressTime = 0.0):
+      reportProgress(bytesRead, bytesWritten, files, bytesStored, readTime, writeTime, throttledTime, compressTime)
+      waited = 0.0
+      if bytesRead:
+        waited += self.read.take(bytesRead, self.cancel)
+      if bytesWritten:
+        waited += self.write.take(bytesWritten, self.cancel)
+      if waited:
+        reportProgress(throttledTime = waited)
+    return report
+
+  def throttled(self):
+    """ Seconds the workers were held back by the read and write limits and the CPU cap. """
+    return self.read.waited, self.write.waited, self.cpu.waited
+
+  def report(self):
+    return 'Throttled: %.1fs reading, %.1fs writing, %.1fs waiting for CPU (summed over the workers)' \
+      % self.throttled()
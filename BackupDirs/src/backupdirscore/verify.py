@@ -0,0 +1,144 @@
+""" Checking a backup folder without restoring it: every archive is read through and its members
+    are compared with the SHA-256 sums written next to it, the chunks of dedup snapshots with
+    their names. The archives are checked in parallel on a process pool. """
+import hashlib, os, sys, zipfile
+
+import archive, checksum, dedup, progress
+
+# Chunks per verification task of a dedup snapshot.
+chunks_per_task = 256
+
+class VerifyResult:
+  """ Outcome of checking one archive, or the chunks of one snapshot. """
+  def __init__(self, name):
+    self.name = name
+    self.members = 0
+    self.bytes = 0 # Uncompressed bytes hashed.
+    self.problems = []
+
+  def merge(self, other):
+    self.members += other.members
+    self.bytes += other.bytes
+    self.problems.extend(other.problems)
+
+def hashMember(f, reporter):
+  digest = hashlib.sha256()
+  size = 0
+  while True:
+    data = f.read(1024 * 1024)
+    if not data:
+      break
+    digest.update(data)
+    size += len(data)
+    reporter.add(len(data))
+  return digest.hexdigest(), size
+
+def verifyArchive(fileName):
+  """ Read `fileName' through and compare its members with its sums. Runs in the pool processes. """
+  result = VerifyResult(fileName)
+  reporter = progress.QueueReporter(fileName)
+  expected = None
+  if checksum.hasChecksums(fileName):
+    expected = checksum.loadChecksums(checksum.checksumsName(fileName))
+  else:
+    result.problems.append('no checksums, only readability is checked')
+  seen = set()
+  try:
+    f = archive.openArchive(fileName)
+    try:
+      if isinstance(f, zipfile.ZipFile):
+        members = [(info.filename, lambda info = info: f.open(info)) for info in f.infolist()]
+      else:
+        members = ((info.name, lambda info = info: f.extractfile(info)) for info in f if info.isreg())
+      for name, open_ in members:
+        member = open_()
+        digest, size = hashMember(member, reporter)
+        member.close()
+        seen.add(name)
+        result.members += 1
+        result.bytes += size
+        reporter.add(files = 1)
+        if expected is not None and expected.get(name) != digest:
+          result.problems.append('%s: %s' % (name, name in expected and 'checksum mismatch' or 'not in the checksums'))
+    finally:
+      f.close()
+  except Exception, e:
+    result.problems.append('unreadable: %s' % e)
+    # The members after the damage are not reached, listing them as missing would only be noise.
+    expected = None
+  if expected is not None:
+    for name in sorted(set(expected) - seen):
+      result.problems.append('%s: missing from the archive' % name)
+  reporter.flush()
+  return result
+
+def verifyChunks(task):
+  """ Check that the chunks `digests' of the snapshot `name' are there and intact. """
+  name, backupRoot, digests = task
+  result = VerifyResult(name)
+  reporter = progress.QueueReporter(name)
+  store = dedup.ChunkStore(backupRoot)
+  for digest in digests:
+    try:
+      data = store.get(digest)
+    except Exception, e:
+      result.problems.append('chunk %s: %s' % (digest, e))
+      continue
+    if hashlib.sha256(data).hexdigest() != digest:
+      result.problems.append('chunk %s: checksum mismatch' % digest)
+    result.members += 1
+    result.bytes += len(data)
+    reporter.add(len(data), 1)
+  reporter.flush()
+  return result
+
+def verifyTask(task):
+  if isinstance(task, tuple):
+    return verifyChunks(task)
+  return verifyArchive(task)
+
+def findTasks(backupFolder):
+  """ The archives of `backupFolder' and the chunk batches of its snapshots, with the (bytes, members)
+      expected from each name, for the progress totals. """
+  tasks = []
+  totals = {}
+  backupRoot = os.path.dirname(os.path.abspath(backupFolder))
+  for fileName in sorted(os.listdir(backupFolder)):
+    path = os.path.join(backupFolder, fileName)
+    if fileName.endswith(dedup.snapshot_suffix):
+      digests = set()
+      for entry, chunks in dedup.Snapshot.load(path).files.values():
+        digests.update(chunks)
+      digests = sorted(digests)
+      for i in range(0, len(digests), chunks_per_task):
+        tasks.append((path, backupRoot, digests[i:i + chunks_per_task]))
+      totals[path] = (0, len(digests))
+      continue
+    for suffix in archive.archive_suffixes.values():
+      if fileName.endswith(suffix):
+        tasks.append(path)
+        members = 0
+        if checksum.hasChecksums(path):
+          members = len(checksum.loadChecksums(checksum.checksumsName(path)))
+        totals[path] = (0, members)
+  return tasks, totals
+
+def verifyBackup(backupFolder, workers = None, listeners = None):
+  """ Check every archive and snapshot of `backupFolder' on `workers' processes. Progress events
+      go to the `listeners', the counters are uncompressed bytes and members checked. Return the
+      VerifyResults by name. """
+  tasks, totals = findTasks(backupFolder)
+  results = {}
+  for result in progress.mapOnPool(verifyTask, tasks, totals, workers, listeners):
+    if result.name in results:
+      results[result.name].merge(result)
+    else:
+      results[result.name] = result
+  return results
+
+def printVerifyProgress(event, out = sys.stderr):
+  """ Console listener: members checked and the hashing throughput. """
+  overall = event.overall
+  out.write('%s verified %d/%d members, %.1f MB, %.1f MB/s\n' % (progress.formatTime(overall.elapsed(event.time)),
+    overall.filesDone, overall.filesTotal, overall.bytesRead / (1024.0 * 1024), overall.throughput(event.time) / (1024 * 1024)))
+  out.flush()
@@ -0,0 +1,361 @@
+""" Watch mode: a long-running process following the backed up directories with inotify, so that
+    the next run only lists what changed. It keeps the marks in `WATCH' in the backup root: a
+    directory whose files changed is dirty, a directory created, moved or removed marks its whole
+    subtree, an overflow of the event queue marks every tree. A run has the watcher write its
+    marks, scans the marked paths and takes the other files over from its previous manifest or
+    snapshot, then records in `WATCH.consumed' up to when the marks were used. Whenever they cannot
+    be trusted, the watcher started after the previous run, that run was not the last one to use
+    them, the filters changed, the tree is scanned in full. Linux only. """
+import ctypes, errno, os, select, signal, struct, time
+
+import dedup, incremental, journal, rules, scan
+
+state_name = 'WATCH'
+consumed_name = 'WATCH.consumed'
+# Seconds between writes of the marks while events come in.
+save_interval = 5
+# Seconds a run waits for the watcher to write its marks.
+flush_timeout = 5
+# Bytes of events read at once.
+read_size = 64 * 1024
+# Settings the marks depend on, the previous run must have had the same.
+filter_settings = ('fileSuffix', 'fileSizeLimit', 'rules')
+
+# From <sys/inotify.h>.
+IN_MODIFY = 0x2
+IN_ATTRIB = 0x4
+IN_CLOSE_WRITE = 0x8
+IN_MOVED_FROM = 0x40
+IN_MOVED_TO = 0x80
+IN_CREATE = 0x100
+IN_DELETE = 0x200
+IN_DELETE_SELF = 0x400
+IN_MOVE_SELF = 0x800
+IN_Q_OVERFLOW = 0x4000
+IN_IGNORED = 0x8000
+IN_ONLYDIR = 0x1000000
+IN_DONT_FOLLOW = 0x2000000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = os.O_NONBLOCK
+IN_CLOEXEC = 02000000
+watch_mask = IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE \
+  | IN_DELETE_SELF | IN_MOVE_SELF | IN_ONLYDIR | IN_DONT_FOLLOW
+# wd, mask, cookie and length of the name following it.
+event_header = struct.Struct('iIII')
+
+try:
+  _libc = ctypes.CDLL(None, use_errno = True)
+except OSError:
+  _libc = None
+
+def isAvailable():
+  return _libc is not None and getattr(_libc, 'inotify_init1', None) is not None
+
+def _checked(result):
+  if result < 0:
+    e = ctypes.get_errno()
+    raise OSError(e, os.strerror(e))
+  return result
+
+def addWatch(fd, path):
+  return _checked(_libc.inotify_add_watch(fd, path, watch_mask))
+
+def removeWatch(fd, wd):
+  # The watch may be gone with its directory already.
+  _libc.inotify_rm_watch(fd, wd)
+
+def stateName(backupRoot):
+  return os.path.join(backupRoot, state_name)
+
+def consumedName(backupRoot):
+  return os.path.join(backupRoot, consumed_name)
+
+def childOf(relPath, name):
+  return relPath and relPath + '/' + name or name
+
+def isBelow(relPath, relTop):
+  return relPath == relTop or relPath.startswith(relTop + '/') or not relTop
+
+def writeLines(fileName, lines):
+  """ Replace `fileName' at once with the tab separated `lines', readers see the old or the new. """
+  f = open(fileName + '.tmp', 'w')
+  try:
+    for fields in lines:
+      f.write('%s\n' % '\t'.join([str(field).encode('string_escape') for field in fields]))
+  finally:
+    f.close()
+  os.rename(fileName + '.tmp', fileName)
+
+def readLines(fileName):
+  f = open(fileName, 'r')
+  try:
+    return [[field.decode('string_escape') for field in line.rstrip('\n').split('\t')] for line in f]
+  finally:
+    f.close()
+
+class WatchState:
+  """ What the watcher writes: its pid, when it last wrote, its rules, and per directory when its
+      watches were complete and the marked subtrees and dirty directories, relative paths with
+      the time they were marked. """
+  def __init__(self):
+    self.pid = None
+    self.flushed = 0
+    self.rules = ''
+    self.started = {} # Directory -> time.
+    self.subtrees = {} # Directory -> {relative path: time}.
+    self.dirty = {}
+
+  @staticmethod
+  def load(fileName):
+    state = WatchState()
+    for fields in readLines(fileName):
+      if fields[0] == 'pid':
+        state.pid = int(fields[1])
+      elif fields[0] == 'flushed':
+        state.flushed = float(fields[1])
+      elif fields[0] == 'rules':
+        state.rules = fields[1]
+      elif fields[0] == 'dir':
+        state.started[fields[1]] = float(fields[2])
+        state.subtrees[fields[1]] = {}
+        state.dirty[fields[1]] = {}
+      elif fields[0] == 'T':
+        state.subtrees[fields[1]][fields[2]] = float(fields[3])
+      elif fields[0] == 'D':
+        state.dirty[fields[1]][fields[2]] = float(fields[3])
+    return state
+
+  def save(self, fileName):
+    lines = [('pid', self.pid), ('flushed', repr(self.flushed)), ('rules', self.rules)]
+    for mydir in sorted(self.started):
+      lines.append(('dir', mydir, repr(self.started[mydir])))
+      for kind, marks in (('T', self.subtrees[mydir]), ('D', self.dirty[mydir])):
+        for relPath in sorted(marks):
+          lines.append((kind, mydir, relPath, repr(marks[relPath])))
+    writeLines(fileName, lines)
+
+def loadConsumed(backupRoot):
+  """ Directory -> (run folder name, time its scan started) of the last run that used the marks. """
+  if not os.path.isfile(consumedName(backupRoot)):
+    return {}
+  return dict([(fields[0], (fields[1], float(fields[2]))) for fields in readLines(consumedName(backupRoot))])
+
+def markConsumed(backupRoot, targetDir, dirs, scanned):
+  """ Record that the run `targetDir' scanned `dirs' from `scanned' on, their older marks are
+      done with. Only kept while a watcher is running. """
+  if not os.path.isfile(stateName(backupRoot)):
+    return
+  consumed = loadConsumed(backupRoot)
+  for mydir in dirs:
+    consumed[mydir] = (os.path.basename(targetDir.rstrip('/')), scanned)
+  writeLines(consumedName(backupRoot), [(mydir, consumed[mydir][0], repr(consumed[mydir][1]))
+    for mydir in sorted(consumed)])
+
+class Watcher:
+  """ The inotify watches of `dirs' and their directories the rules include, and the marks. """
+  def __init__(self, dirs, backupRoot, rulesText = ''):
+    if not isAvailable():
+      raise OSError(errno.ENOSYS, 'inotify is not available')
+    self.fd = _checked(_libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC))
+    self.backupRoot = backupRoot
+    self.matcher = rules.Matcher(rulesText)
+    self.watches = {} # Watch descriptor -> (directory, relative path).
+    self.unwatched = {} # Directory -> relative paths that could not be watched, marked at every save.
+    self.consumedTime = None
+    self.saved = 0
+    self.changed = False
+    self.flushRequested = False
+    self.stopped = False
+    self.state = WatchState()
+    self.state.pid = os.getpid()
+    self.state.rules = rulesText
+    for mydir in dirs:
+      self.state.subtrees[mydir] = {}
+      self.state.dirty[mydir] = {}
+      self.unwatched[mydir] = set()
+      self.watchTree(mydir, '')
+      self.state.started[mydir] = time.time()
+    self.save()
+
+  def watchTree(self, mydir, relTop):
+    """ Watch `relTop' of `mydir' and the directories below it. """
+    stack = [relTop]
+    while stack:
+      relPath = stack.pop()
+      path = os.path.join(mydir, relPath)
+      try:
+        self.watches[addWatch(self.fd, path)] = (mydir, relPath)
+        for name, isDir, st in scan.listDir(path):
+          if isDir and self.matcher.includesDir(childOf(relPath, name)):
+            stack.append(childOf(relPath, name))
+      except OSError, e:
+        # A directory removed meanwhile is marked by the event of its parent. Out of watches
+        # (fs.inotify.max_user_watches) or not readable, it is scanned every run.
+        if e.errno not in (errno.ENOENT, errno.ENOTDIR):
+          self.unwatched[mydir].add(relPath)
+
+  def unwatchTree(self, mydir, relTop):
+    for wd, (watchedDir, relPath) in self.watches.items():
+      if watchedDir == mydir and isBelow(relPath, relTop):
+        removeWatch(self.fd, wd)
+        del self.watches[wd]
+
+  def mark(self, marks, mydir, relPath, now):
+    marks[mydir][relPath] = now
+    self.changed = True
+
+  def handle(self, wd, mask, name, now):
+    if mask & IN_Q_OVERFLOW:
+      # Events were lost, nothing is known any more.
+      for mydir in self.state.started:
+        self.mark(self.state.subtrees, mydir, '', now)
+      return
+    if wd not in self.watches:
+      return
+    mydir, relPath = self.watches[wd]
+    if mask & IN_IGNORED:
+      del self.watches[wd]
+    elif mask & (IN_DELETE_SELF | IN_MOVE_SELF):
+      # Below the top the event of the parent marks it.
+      if not relPath:
+        self.mark(self.state.subtrees, mydir, '', now)
+    elif not name:
+      pass # The directory itself, its attributes are not backed up.
+    elif mask & IN_ISDIR:
+      child = childOf(relPath, name)
+      if not self.matcher.includesDir(child):
+        return
+      if mask & (IN_MOVED_FROM | IN_DELETE):
+        self.mark(self.state.subtrees, mydir, child, now)
+        self.unwatchTree(mydir, child)
+      elif mask & (IN_CREATE | IN_MOVED_TO):
+        # Files may have come before the watch, the whole subtree is listed anyway.
+        self.mark(self.state.subtrees, mydir, child, now)
+        self.watchTree(mydir, child)
+    else:
+      self.mark(self.state.dirty, mydir, relPath, now)
+
+  def readEvents(self):
+    """ Handle the queued events, all of them. """
+    while True:
+      try:
+        data = os.read(self.fd, read_size)
+      except OSError, e:
+        if e.errno in (errno.EAGAIN, errno.EINTR):
+          return
+        raise
+      now = time.time()
+      offset = 0
+      while offset + event_header.size <= len(data):
+        wd, mask, cookie, length = event_header.unpack_from(data, offset)
+        offset += event_header.size
+        self.handle(wd, mask, data[offset:offset + length].rstrip('\0'), now)
+        offset += length
+
+  def checkConsumed(self):
+    """ Drop the marks a run has used. """
+    try:
+      mtime = os.path.getmtime(consumedName(self.backupRoot))
+    except OSError:
+      return
+    if mtime == self.consumedTime:
+      return
+    self.consumedTime = mtime
+    for mydir, (folder, scanned) in loadConsumed(self.backupRoot).items():
+      for marks in (self.state.subtrees, self.state.dirty):
+        if mydir in marks:
+          marks[mydir] = dict([(relPath, t) for relPath, t in marks[mydir].items() if t >= scanned])
+    self.changed = True
+
+  def save(self):
+    now = time.time()
+    for mydir, relPaths in self.unwatched.items():
+      for relPath in relPaths:
+        self.state.subtrees[mydir][relPath] = now
+    self.state.flushed = now
+    self.state.save(stateName(self.backupRoot))
+    self.saved = now
+    self.changed = False
+
+  def requestFlush(self):
+    """ Signal handler: a run waits for the marks. """
+    self.flushRequested = True
+
+  def stop(self):
+    self.stopped = True
+
+  def run(self):
+    """ Follow the events until stop(), then remove the state, its marks are useless without
+        the watches. """
+    try:
+      while not self.stopped:
+        try:
+          select.select([self.fd], [], [], 1)
+        except select.error, e:
+          if e.args[0] != errno.EINTR:
+            raise
+        self.readEvents()
+        self.checkConsumed()
+        if self.flushRequested or (self.changed and time.time() - self.saved >= save_interval):
+          self.flushRequested = False
+          self.save()
+    finally:
+      os.close(self.fd)
+      if os.path.isfile(stateName(self.backupRoot)):
+        os.remove(stateName(self.backupRoot))
+
+def requestFlush(backupRoot, timeout = flush_timeout):
+  """ Have the watcher of `backupRoot' write its marks and return them, a WatchState. None if no
+      watcher is running or it does not answer in time. """
+  if not os.path.isfile(stateName(backupRoot)):
+    return None
+  try:
+    state = WatchState.load(stateName(backupRoot))
+    requested = time.time()
+    os.kill(state.pid, signal.SIGUSR1)
+    deadline = requested + timeout
+    while time.time() < deadline:
+      time.sleep(0.05)
+      state = WatchState.load(stateName(backupRoot))
+      if state.flushed >= requested:
+        return state
+  except (IOError, OSError, ValueError, TypeError):
+    pass # Stopped meanwhile, or a state left behind by a killed watcher.
+  return None
+
+def planScan(state, mydir, targetDir, settings):
+  """ The arguments of scan.scanDirty() for `mydir' in the run `targetDir': the entries of its
+      previous manifest or snapshot, and the marked subtrees and directories of the WatchState
+      `state'. None if the marks do not cover every change since the previous run. """
+  backupMode = settings['backupMode']
+  if state is None or mydir not in state.started or backupMode == 'mirror' or state.rules != settings['rules']:
+    return None
+  suffix = backupMode == 'dedup' and dedup.snapshot_suffix or incremental.manifest_suffix
+  previous = incremental.findPrevious(mydir, targetDir, suffix)
+  if previous is None:
+    return None
+  backupRoot = os.path.dirname(targetDir.rstrip('/'))
+  consumed = loadConsumed(backupRoot).get(mydir)
+  # The marks since that run must all be there: it used them last and the watches were up.
+  if consumed is None or consumed[0] != os.path.basename(previous) or state.started[mydir] > consumed[1]:
+    return None
+  if not os.path.isfile(os.path.join(previous, journal.journal_name)):
+    return None
+  previousSettings = journal.Journal.load(previous).settings
+  for name in filter_settings:
+    if previousSettings.get(name) != str(settings[name]):
+      return None
+  if backupMode == 'dedup':
+    snapshot = dedup.Snapshot.load(dedup.snapshotName(mydir, previous))
+    entries = dict([(path, entry) for path, (entry, chunks) in snapshot.files.items()])
+  else:
+    entries = incremental.Manifest.load(incremental.manifestName(mydir, previous)).entries
+  return entries, set(state.subtrees[mydir]), set(state.dirty[mydir])
+
+def watchDirs(dirs, settings):
+  """ Run a Watcher of `dirs' in the foreground until SIGINT or SIGTERM. """
+  watcher = Watcher(dirs, settings['targetDir'], settings['rules'])
+  signal.signal(signal.SIGINT, lambda signum, frame: watcher.stop())
+  signal.signal(signal.SIGTERM, lambda signum, frame: watcher.stop())
+  signal.signal(signal.SIGUSR1, lambda signum, frame: watcher.requestFlush())
+  watcher.run()
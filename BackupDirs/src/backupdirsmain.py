@@ -1,56 +1,49 @@
-import multiprocessing, os, re, sys, time
+import sqlite3, time
 
 from PyQt4 import QtGui, QtCore
-from Queue import Queue
-
-# Maybe `/tmp' would be a better choice for default.
-settings_file = '%s/.backupdirs' % os.environ.get('HOME', '')
-compression_methods = ('gz', 'bz2', 'zip')
+from backupdirscore import catalog, engine, progress, settings
+from backupdirscore.settings import settings_file, compression_methods, backup_modes, io_priorities
+from dirlistmodel import DirListModel
 
 class BackupDirsMain(QtGui.QWidget):
   def __init__(self, main = None):
     self.main = main
     self.dirs = [] # Directory list.
-    self.archiver = None # The worker thread.
-    self.withGui = self.main.withGui
+    self.archiver = None # The engine of the running backup.
+    self.archiverThread = None # The thread it runs in.
     # Name-value string pairs.
-    self.settings = { 'targetDir':os.environ.get('HOME', ''), 'compressionMethod':'bz2', 'fileSizeLimit':'1000', 'fileSuffix':'*' }
+    self.settings = settings.defaultSettings()
     self.defaultTargetDir = self.settings['targetDir']
+    self.defaultBackupMode = self.settings['backupMode']
     self.defaultCompressionMethod = self.settings['compressionMethod']
+    self.defaultCompressionWorkers = self.settings['compressionWorkers']
     self.defaultFileSizeLimit = self.settings['fileSizeLimit']
     self.defaultFileSuffix = self.settings['fileSuffix']
+    self.defaultRules = self.settings['rules']
+    QtGui.QWidget.__init__(self)
+    # Before the tabs, they show the loaded directories and settings.
     self.loadSettings()
-    if self.withGui:
-      QtGui.QWidget.__init__(self)
-      tabs = QtGui.QTabWidget()
-      tabs.addTab(self.dirListTab(), 'Directories')
-      tabs.addTab(self.preferencesTab(), 'Preferences')
-      grid = QtGui.QGridLayout(self)
-      grid.addWidget(tabs)
-      # Timer updates the second column periodically. It's for the GUI only.
-      self.timer = Timer(self.dirListWidget)
-      if self.dirListWidget.rowCount() == 0:
-        self.main.start.setEnabled(False)
+    tabs = QtGui.QTabWidget()
+    tabs.addTab(self.dirListTab(), 'Directories')
+    tabs.addTab(self.preferencesTab(), 'Preferences')
+    tabs.addTab(self.historyTab(), 'History')
+    grid = QtGui.QGridLayout(self)
+    grid.addWidget(tabs)
+    if self.dirListModel.rowCount() == 0:
+      self.main.start.setEnabled(False)
    
   def dirListTab(self):
-    if not self.withGui:
-      return None
-    self.dirListWidget = QtGui.QTableWidget(0, 3, self)
-    self.dirListWidget.setHorizontalHeaderLabels(['Directory', 'Elapsed Time', 'Status'])
+    # A model with a directory -> row index, thousands of rows are no slower to update than ten.
+    self.dirListModel = DirListModel(self.dirs, self)
+    self.dirListWidget = QtGui.QTableView(self)
+    self.dirListWidget.setModel(self.dirListModel)
     self.dirListWidget.setSelectionMode(QtGui.QAbstractItemView.MultiSelection)
-    for i in range(len(self.dirs)):
-      self.dirListWidget.insertRow(self.dirListWidget.rowCount())
-      self.dirListWidget.setItem(i, 0, QtGui.QTableWidgetItem(self.dirs[i]))
-      elapsedTime = QtGui.QTableWidgetItem('0:00')
-      elapsedTime.setFlags(QtCore.Qt.NoItemFlags)
-      status = QtGui.QTableWidgetItem('Not started')
-      status.setFlags(QtCore.Qt.NoItemFlags)
-      self.dirListWidget.setItem(i, 1, elapsedTime)
-      self.dirListWidget.setItem(i, 2, status)
-    #self.dirListWidget.addItems(self.dirs)
-    self.dirListWidget.horizontalHeader().setResizeMode(0, QtGui.QHeaderView.ResizeToContents)
+    self.dirListWidget.setSelectionBehavior(QtGui.QAbstractItemView.SelectRows)
+    # Sized when directories are added, ResizeToContents would measure every row on each update.
+    self.dirListWidget.resizeColumnToContents(0)
     self.dirListWidget.horizontalHeader().setResizeMode(1, QtGui.QHeaderView.Stretch)
     self.dirListWidget.horizontalHeader().setResizeMode(2, QtGui.QHeaderView.Stretch)
+    self.dirListWidget.horizontalHeader().setResizeMode(3, QtGui.QHeaderView.Stretch)
     self.addButton = QtGui.QPushButton(QtGui.QIcon('icons/add.png'), 'Add')
     self.removeButton = QtGui.QPushButton(QtGui.QIcon('icons/remove.png'), 'Remove')
     buttonsLayout = QtGui.QHBoxLayout()
@@ -66,8 +59,6 @@ class BackupDirsMain(QtGui.QWidget):
     return dirListTab    
 
   def preferencesTab(self):
-    if not self.withGui:
-      return None
     preferencesLayout = QtGui.QGridLayout()
     preferencesLayout.addWidget(QtGui.QLabel('Target directory:'), 0, 0)
     targetDirLayout = QtGui.QHBoxLayout()
@@ -79,7 +70,22 @@ class BackupDirsMain(QtGui.QWidget):
     targetDirLayout.addWidget(self.targetDirLine)
     targetDirLayout.addWidget(self.browseButton)
     preferencesLayout.addLayout(targetDirLayout, 0, 1)
-    preferencesLayout.addWidget(QtGui.QLabel('Compression method:'), 1, 0)
+    # Incremental runs only archive what changed since the previous backup of the directory.
+    preferencesLayout.addWidget(QtGui.QLabel('Backup mode:'), 1, 0)
+    self.backupModesCombo = QtGui.QComboBox()
+    self.backupModesCombo.addItems(backup_modes)
+    if self.settings['backupMode'] not in backup_modes:
+      QtGui.QMessageBox.warning(self, 'Warning',
+        'Invalid value "%s" read for backupMode from %s. Restoring defaults...'
+        % (self.settings['backupMode'], settings_file), QtGui.QMessageBox.Ok, QtGui.QMessageBox.Ok)
+      self.setBackupMode(self.defaultBackupMode)
+      # Allow the user to re-save the file.
+      self.main.setDirty(True)
+    else:
+      self.backupModesCombo.setCurrentIndex(backup_modes.index(self.settings['backupMode']))
+    self.connect(self.backupModesCombo, QtCore.SIGNAL('currentIndexChanged(QString)'), self.setBackupMode)
+    preferencesLayout.addWidget(self.backupModesCombo, 1, 1)
+    preferencesLayout.addWidget(QtGui.QLabel('Compression method:'), 2, 0)
     self.compressionMethodsCombo = QtGui.QComboBox()
     self.compressionMethodsCombo.addItems(compression_methods)
     if self.settings['compressionMethod'] not in compression_methods:
@@ -92,8 +98,23 @@ class BackupDirsMain(QtGui.QWidget):
     else:  
       self.compressionMethodsCombo.setCurrentIndex(compression_methods.index(self.settings['compressionMethod']))
     self.connect(self.compressionMethodsCombo, QtCore.SIGNAL('currentIndexChanged(QString)'), self.setCompression)
-    preferencesLayout.addWidget(self.compressionMethodsCombo, 1, 1)
-    preferencesLayout.addWidget(QtGui.QLabel('File size limit:'), 2, 0)
+    preferencesLayout.addWidget(self.compressionMethodsCombo, 2, 1)
+    # More than one worker compresses gz and bz2 archives block-wise in parallel.
+    preferencesLayout.addWidget(QtGui.QLabel('Compression workers:'), 3, 0)
+    self.compressionWorkersSpin = QtGui.QSpinBox()
+    self.compressionWorkersSpin.setRange(1, 64)
+    try:
+      self.compressionWorkersSpin.setValue(int(self.settings['compressionWorkers']))
+    except ValueError:
+      QtGui.QMessageBox.warning(self, 'Warning',
+        'Invalid value "%s" read for compressionWorkers from %s. Restoring defaults...'
+        % (self.settings['compressionWorkers'], settings_file), QtGui.QMessageBox.Ok, QtGui.QMessageBox.Ok)
+      self.setCompressionWorkers(self.defaultCompressionWorkers)
+      # Allow the user to re-save the file.
+      self.main.setDirty(True)
+    self.connect(self.compressionWorkersSpin, QtCore.SIGNAL('valueChanged(QString)'), self.setCompressionWorkers)
+    preferencesLayout.addWidget(self.compressionWorkersSpin, 3, 1)
+    preferencesLayout.addWidget(QtGui.QLabel('File size limit:'), 4, 0)
     self.fileSizeLimitSpin = QtGui.QSpinBox()
     self.fileSizeLimitSpin.setRange(100, 10000)
     try:
@@ -106,25 +127,123 @@ class BackupDirsMain(QtGui.QWidget):
       # Allow the user to re-save the file.
       self.main.setDirty(True)
     self.connect(self.fileSizeLimitSpin, QtCore.SIGNAL('valueChanged(QString)'), self.setFileSizeLimit)
-    preferencesLayout.addWidget(self.fileSizeLimitSpin, 2, 1)
+    preferencesLayout.addWidget(self.fileSizeLimitSpin, 4, 1)
     self.fileSuffixLine = QtGui.QLineEdit()
     self.fileSuffixLine.setText(self.settings['fileSuffix'])
     self.connect(self.fileSuffixLine, QtCore.SIGNAL('textChanged(QString)'), self.setFileSuffix)
-    preferencesLayout.addWidget(QtGui.QLabel('File suffix:'), 3, 0)
-    preferencesLayout.addWidget(self.fileSuffixLine, 3, 1)
+    preferencesLayout.addWidget(QtGui.QLabel('File suffix:'), 5, 0)
+    preferencesLayout.addWidget(self.fileSuffixLine, 5, 1)
+    self.rulesLine = QtGui.QLineEdit()
+    self.rulesLine.setText(self.settings['rules'])
+    self.rulesLine.setToolTip('Include (+) and exclude (-) globs separated by ";", e.g. -node_modules/;-.git/;-*.tmp')
+    self.connect(self.rulesLine, QtCore.SIGNAL('textChanged(QString)'), self.setRules)
+    preferencesLayout.addWidget(QtGui.QLabel('Rules:'), 6, 0)
+    preferencesLayout.addWidget(self.rulesLine, 6, 1)
+    # The limits also apply to a run in progress.
+    self.readLimitSpin = self.limitSpin('readLimit', 10000000, 'none', ' KB/s')
+    preferencesLayout.addWidget(QtGui.QLabel('Read limit:'), 7, 0)
+    preferencesLayout.addWidget(self.readLimitSpin, 7, 1)
+    self.writeLimitSpin = self.limitSpin('writeLimit', 10000000, 'none', ' KB/s')
+    preferencesLayout.addWidget(QtGui.QLabel('Write limit:'), 8, 0)
+    preferencesLayout.addWidget(self.writeLimitSpin, 8, 1)
+    self.cpuWorkersSpin = self.limitSpin('cpuWorkers', 64, 'no cap', '')
+    self.cpuWorkersSpin.setToolTip('Blocks compressed at once by all workers together')
+    preferencesLayout.addWidget(QtGui.QLabel('CPU workers:'), 9, 0)
+    preferencesLayout.addWidget(self.cpuWorkersSpin, 9, 1)
+    preferencesLayout.addWidget(QtGui.QLabel('I/O priority:'), 10, 0)
+    self.ioPrioritiesCombo = QtGui.QComboBox()
+    self.ioPrioritiesCombo.addItems(io_priorities)
+    if self.settings['ioPriority'] in io_priorities:
+      self.ioPrioritiesCombo.setCurrentIndex(io_priorities.index(self.settings['ioPriority']))
+    self.connect(self.ioPrioritiesCombo, QtCore.SIGNAL('currentIndexChanged(QString)'), self.setIoPriority)
+    preferencesLayout.addWidget(self.ioPrioritiesCombo, 10, 1)
     preferencesLayout.setRowStretch(preferencesLayout.rowCount(), 1)
     preferencesTab = QtGui.QWidget()
     preferencesTab.setLayout(preferencesLayout)
     return preferencesTab
   
+  def limitSpin(self, name, maximum, none, suffix):
+    """ A spin box for the limit setting `name', its 0 shows as `none'. """
+    spin = QtGui.QSpinBox()
+    spin.setRange(0, maximum)
+    spin.setSpecialValueText(none)
+    spin.setSuffix(suffix)
+    try:
+      spin.setValue(int(self.settings[name]))
+    except ValueError:
+      QtGui.QMessageBox.warning(self, 'Warning',
+        'Invalid value "%s" read for %s from %s. Restoring defaults...'
+        % (self.settings[name], name, settings_file), QtGui.QMessageBox.Ok, QtGui.QMessageBox.Ok)
+      self.settings[name] = settings.defaultSettings()[name]
+      # Allow the user to re-save the file.
+      self.main.setDirty(True)
+    self.connect(spin, QtCore.SIGNAL('valueChanged(int)'), lambda value: self.setLimit(name, value))
+    return spin
+
+  def historyTab(self):
+    """ Queries of the catalog in the target directory: the runs, or the versions of a file. """
+    self.historyLine = QtGui.QLineEdit()
+    self.historyLine.setToolTip('DIR/PATH of a backed up file, empty for the list of runs')
+    self.connect(self.historyLine, QtCore.SIGNAL('returnPressed()'), self.showHistory)
+    self.historyButton = QtGui.QPushButton('Show')
+    self.connect(self.historyButton, QtCore.SIGNAL('pressed()'), self.showHistory)
+    queryLayout = QtGui.QHBoxLayout()
+    queryLayout.addWidget(QtGui.QLabel('File:'))
+    queryLayout.addWidget(self.historyLine)
+    queryLayout.addWidget(self.historyButton)
+    self.historyWidget = QtGui.QTableWidget(0, 0, self)
+    self.historyWidget.setEditTriggers(QtGui.QAbstractItemView.NoEditTriggers)
+    historyLayout = QtGui.QVBoxLayout()
+    historyLayout.addLayout(queryLayout)
+    historyLayout.addWidget(self.historyWidget)
+    historyTab = QtGui.QWidget()
+    historyTab.setLayout(historyLayout)
+    return historyTab
+
+  def showHistory(self):
+    path = str(self.historyLine.text()).strip()
+    mb = 1024.0 * 1024
+    try:
+      if path:
+        labels = ['Run', 'Size', 'Modified', 'Change', 'Archive']
+        rows = [(folder, str(size), time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(mtime)),
+                 added and 'added' or 'unchanged', location or '-')
+                for folder, size, mtime, mode, added, location in catalog.history(str(self.settings['targetDir']), path)]
+      else:
+        labels = ['Run', 'Mode', 'State', 'Time', 'Files', 'MB', 'Added files', 'Added MB', 'Stored MB']
+        rows = [(folder, mode or '-', complete and 'complete' or 'incomplete',
+                 seconds is not None and progress.formatTime(seconds) or '-', '%d' % files, '%.1f' % (size / mb),
+                 '%d' % addedFiles, '%.1f' % (addedSize / mb), '%.1f' % (storedSize / mb))
+                for folder, mode, complete, seconds, dirs, files, size, addedFiles, addedSize, storedSize
+                in catalog.runs(str(self.settings['targetDir']))]
+    except (sqlite3.Error, IOError, OSError), e:
+      self.error(str(e))
+      return
+    self.historyWidget.clear()
+    self.historyWidget.setColumnCount(len(labels))
+    self.historyWidget.setHorizontalHeaderLabels(labels)
+    self.historyWidget.setRowCount(len(rows))
+    for i, row in enumerate(rows):
+      for column, text in enumerate(row):
+        self.historyWidget.setItem(i, column, QtGui.QTableWidgetItem(text))
+    self.historyWidget.resizeColumnsToContents()
+
   def setTargetDir(self, targetDir):
     self.settings['targetDir'] = targetDir
     self.main.setDirty(True)
   
+  def setBackupMode(self, backupMode):
+    self.settings['backupMode'] = backupMode
+    self.main.setDirty(True)
+
   def setCompression(self, compressionMethod):
     self.settings['compressionMethod'] = compressionMethod;
     self.main.setDirty(True)
 
+  def setCompressionWorkers(self, compressionWorkers):
+    self.settings['compressionWorkers'] = compressionWorkers
+    self.main.setDirty(True)
+
   def setFileSizeLimit(self, fileSizeLimit):
     self.settings['fileSizeLimit'] = fileSizeLimit
     self.main.setDirty(True)
@@ -133,20 +252,35 @@ class BackupDirsMain(QtGui.QWidget):
     self.settings['fileSuffix'] = fileSuffix
     self.main.setDirty(True)
 
+  def setRules(self, rules):
+    self.settings['rules'] = rules
+    self.main.setDirty(True)
+
+  def setLimit(self, name, value):
+    self.settings[name] = str(value)
+    self.main.setDirty(True)
+    if self.archiver and self.archiverThread.isRunning():
+      self.archiver.setLimits(self.settings)
+
+  def setIoPriority(self, ioPriority):
+    # Taken by the workers of the next run.
+    self.settings['ioPriority'] = str(ioPriority)
+    self.main.setDirty(True)
+
   def removeDirs(self):
-    if not self.withGui:
+    dirs = self.dirListModel.dirs()
+    selectedDirs = [dirs[i] for i in sorted(set([index.row() for index in self.dirListWidget.selectionModel().selectedIndexes()]))]
+    if not selectedDirs:
       return
-    selectedItems = self.dirListWidget.selectedItems() 
-    for item in selectedItems:
-      self.dirs.remove(item.text())
-      self.dirListWidget.removeRow(item.row())
-      if self.dirListWidget.rowCount() == 0:
-        self.main.start.setEnabled(False)
-      self.main.setDirty(True)
+    self.dirListWidget.clearSelection()
+    self.dirListModel.removeDirs(selectedDirs)
+    for myDir in selectedDirs:
+      self.dirs.remove(myDir)
+    if self.dirListModel.rowCount() == 0:
+      self.main.start.setEnabled(False)
+    self.main.setDirty(True)
 
   def selectTargetDir(self):
-    if not self.withGui:
-      return
     dialog = QtGui.QFileDialog()
     dialog.setFileMode(QtGui.QFileDialog.DirectoryOnly)
     dialog.setViewMode(QtGui.QFileDialog.Detail);
@@ -157,8 +291,6 @@ class BackupDirsMain(QtGui.QWidget):
   def addDirs(self):
     """ Add selected directory to the list. Set `isDirty' flag accordingly.
         Multiple dirs cannot be selected by default in PyQt4... """
-    if not self.withGui:
-      return False
     dialog = QtGui.QFileDialog()
     dialog.setFileMode(QtGui.QFileDialog.Directory)
     dialog.setViewMode(QtGui.QFileDialog.Detail);
@@ -174,241 +306,94 @@ class BackupDirsMain(QtGui.QWidget):
       selectedDirs = [selDir for selDir in selectedDirs if selDir not in selectedDirsWrong]
       for myDir in selectedDirs:
         self.dirs.append(myDir)
-        self.dirListWidget.insertRow(self.dirListWidget.rowCount())
-        self.dirListWidget.setItem(self.dirListWidget.rowCount() - 1, 0, QtGui.QTableWidgetItem(myDir))
-        elapsedTime = QtGui.QTableWidgetItem('0:00')
-        elapsedTime.setFlags(QtCore.Qt.NoItemFlags)
-        self.dirListWidget.setItem(self.dirListWidget.rowCount() - 1, 1, elapsedTime)
-        status = QtGui.QTableWidgetItem('Not started')
-        status.setFlags(QtCore.Qt.NoItemFlags)
-        self.dirListWidget.setItem(self.dirListWidget.rowCount() - 1, 2, status)
+        self.dirListModel.addDir(myDir)
         self.main.start.setEnabled(True)
         self.main.setDirty(True)
+      self.dirListWidget.resizeColumnToContents(0)
      
   def loadSettings(self):
     try:
-      f = open(settings_file, 'r')
-      reading_directories = False
-      reading_settings = False
-      for line in f:
-        line = line.strip()
-        if re.match('^\[DIRECTORIES\]$', line):
-          reading_directories = True
-          reading_settings = False
-        elif re.match('\[SETTINGS\]$', line):
-          reading_settings = True
-          reading_directories = False
-        else:
-          if reading_directories:
-            self.dirs.append(line)
-          elif reading_settings:
-            splitted = line.split('=')
-            if len(splitted) != 2:
-              return
-            self.settings[splitted[0]] = splitted[1]
-      f.close()
+      self.dirs, self.settings = settings.loadSettings()
     except IOError:
-      self.storeSettings()
+      # No settings file yet, it is started with the defaults. The directory list may not exist yet.
+      try:
+        settings.storeSettings(self.dirs, self.settings)
+      except IOError:
+        self.error('Unable to save settings to %s.' % settings.settings_file)
 
   def storeSettings(self):
+    self.dirs = self.dirListModel.dirs()
     try:
-      f = open(settings_file, 'w')
-      if self.dirListWidget.rowCount() > 0:
-        f.write('[DIRECTORIES]\n')
-        if self.withGui:
-          for i in range(self.dirListWidget.rowCount()):
-            f.write('%s\n' % self.dirListWidget.item(i, 0).text())
-        else:
-          for d in self.dirs:
-            f.write('%s\n' % d)
-      if len(self.settings.keys()) > 0:
-        f.write('[SETTINGS]\n')
-        for name, value in self.settings.items():
-          f.write('%s=%s\n' % (name, value))
-      f.close()
+      settings.storeSettings(self.dirs, self.settings)
       self.main.setDirty(False)
     except IOError:
-      self.error('Unable to save settings to %s.' % settings_file)
+      self.error('Unable to save settings to %s.' % settings.settings_file)
 
   def error(self, message):
-    if self.withGui:
-      QtGui.QMessageBox.critical(self, 'Error', message,
-                                 QtGui.QMessageBox.Ok, QtGui.QMessageBox.Ok)
-    else:
-      sys.stderr.write('Error: %s' % message)
+    QtGui.QMessageBox.critical(self, 'Error', message,
+                               QtGui.QMessageBox.Ok, QtGui.QMessageBox.Ok)
+
+  def updateProgress(self, event):
+    """ Listener of the coalesced progress events of the archiver. """
+    self.dirListModel.updateProgress(event)
+    self.main.statusBar().showMessage('Overall: %s' % event.overall.describe(event.time))
 
   def setStatus(self, mydir, status):
-    if not self.withGui:
+    if mydir is None:
+      # About the whole run, until the next progress event.
+      self.main.statusBar().showMessage(status)
       return
-    for i in range(self.dirListWidget.rowCount()):
-      idir = self.dirListWidget.item(i, 0).text()
-      if idir == mydir:
-        self.dirListWidget.item(i, 2).setText(status)
+    self.dirListModel.setStatus(mydir, status)
 
   def isSubDir(self, aDir, bDir):
-    return aDir.startswith(bDir) or bDir.startswith(aDir) 
+    return settings.isSubDir(aDir, bDir)
     
   def canWeStart(self):
-    for d in self.dirs:
-      if self.isSubDir(d, self.settings['targetDir']):
-        return False
-    return True
+    return settings.canWeStart(self.dirs, self.settings['targetDir'])
 
-  def startBackup(self):
+  def startBackup(self, resume = False):
     if not self.canWeStart():
       self.error('The targetDir %s cannot be in the list of dirs to be archived.'
                  % self.settings['targetDir'])
       return False
-    self.archiver = Archiver(self, self.dirs, self.settings)
-    self.connect(self.archiver, QtCore.SIGNAL('finishBackup'), self.finishBackup)
-    self.connect(self.archiver, QtCore.SIGNAL('setStatus'), self.setStatus)
-    self.archiver.start()
-    if self.withGui:
-      self.timer.start()
+    # The engine wants plain strings, not QStrings.
+    runSettings = dict([(name, str(value)) for name, value in self.settings.items()])
+    problems = settings.checkSettings(runSettings)
+    if problems:
+      self.error('\n'.join(problems))
+      return False
+    self.archiver = engine.Archiver([str(mydir) for mydir in self.dirs], runSettings, resume)
+    self.archiverThread = ArchiverThread(self.archiver)
+    self.connect(self.archiverThread, QtCore.SIGNAL('finishBackup'), self.finishBackup)
+    self.connect(self.archiverThread, QtCore.SIGNAL('setStatus'), self.setStatus)
+    self.connect(self.archiverThread, QtCore.SIGNAL('progress'), self.updateProgress)
+    self.archiverThread.start()
     return True
   
   def finishBackup(self):
+    # The engine has written the README summary already.
     QtGui.QMessageBox.information(self, 'Finished',
       'Backup finished successfully. Statistics are saved.', QtGui.QMessageBox.Ok, QtGui.QMessageBox.Ok)
-    f = open(os.path.join(self.archiver.getTargetDir(), 'README'), 'w')
-    for i in range(self.dirListWidget.rowCount()):
-      #save them first to a file with du!!
-      mydir = self.dirListWidget.item(i, 0).text()
-      time = self.dirListWidget.item(i, 1).text()
-      size = os.popen('du -shk %s' % mydir).readlines()[0].split('\t')[0]
-      f.write('%s\t%s\t%s\n' % (mydir, size, time))
-      elapsedTime = QtGui.QTableWidgetItem('0:00')
-      elapsedTime.setFlags(QtCore.Qt.NoItemFlags)
-      status = QtGui.QTableWidgetItem('Not started')
-      status.setFlags(QtCore.Qt.NoItemFlags)
-      self.dirListWidget.setItem(i, 1, elapsedTime)
-      self.dirListWidget.setItem(i, 2, status)
-    f.close()
+    self.dirListModel.resetRows()
     self.main.finishBackup()
   
   def stopBackup(self):
-    if not self.withGui:
-      return
-    self.timer.kill()
     if self.archiver:
       self.archiver.stopThread()
-      self.archiver.wait() # Similar to join.
+      self.archiverThread.wait() # Similar to join.
+      completed = self.archiver.getCompleted()
+      message = 'Backup cancelled, it can be continued with --resume. Completed directories:\n\n%s' \
+        % ('\n'.join(completed) or 'none')
+      QtGui.QMessageBox.information(self, 'Cancelled', message, QtGui.QMessageBox.Ok, QtGui.QMessageBox.Ok)
 
-class Timer(QtCore.QThread):
-  """ Simple timer thread to measure elapsed time and update second column. """
-  def __init__(self, tableWidget):
+class ArchiverThread(QtCore.QThread):
+  """ Runs the Qt independent engine.Archiver off the GUI thread, its callbacks become signals. """
+  def __init__(self, archiver):
     QtCore.QThread.__init__(self)
-    self.table = tableWidget
-    self.alive = True
+    self.archiver = archiver
+    self.archiver.addStatusListener(lambda mydir, status: self.emit(QtCore.SIGNAL('setStatus'), mydir, status))
+    self.archiver.addProgressListener(lambda event: self.emit(QtCore.SIGNAL('progress'), event))
 
-  def kill(self):
-    self.alive = False
-    
-  def increase(self, time):
-    t = time.split(':')
-    mins, secs = int(t[0]), int(t[1])
-    if secs == 59:
-      mins += 1
-      secs = 0
-    else:
-      secs += 1
-    return '%d:%02d' % (mins, secs)
-    
   def run(self):
-    while self.alive:
-      for i in range(self.table.rowCount()):
-        if self.table.item(i, 2).text() == 'Started':
-          self.table.item(i, 1).setText(self.increase(self.table.item(i, 1).text()))
-      time.sleep(1)
-
-class Archiver(QtCore.QThread):
-  def __init__(self, main, dirs, settings):
-    """ Archive the dirs one by one according to settings. The thread can only be cancelled between dirs. """
-    QtCore.QThread.__init__(self)
-    self.threadPool = ThreadPool(self, multiprocessing.cpu_count() + 1)
-    self.stopNow = False
-    self.dirs = dirs
-    self.dirSizes = []
-    self.targetDir = '%s/backup-%s' % (settings['targetDir'], time.strftime('%Y%m%d_%H%M%S'))
-    os.popen('mkdir -p %s' % self.targetDir)
-    self.fileSizeLimit = settings['fileSizeLimit']
-    self.compressionMethod = settings['compressionMethod']
-    self.fileSuffix = settings['fileSuffix']
-    self.calculateDirSizes()
-    
-  def getTargetDir(self):
-    return self.targetDir
-  
-  def calculateDirSizes(self):
-    for mydir in self.dirs:
-      self.dirSizes.append(int(os.popen('du -sk %s' % mydir).readlines()[0].split('\t')[0]))
-  
-  def stopThread(self):
-    self.stopNow = True # kill workers too!
-  
-  def run(self):
-    for mydir in self.dirs:
-      if self.stopNow:
-        return
-      argsToPass = { 'dir':mydir, 'targetDir':self.targetDir, 'fileSuffix':self.fileSuffix,
-        'fileSizeLimit':self.fileSizeLimit, 'compressionMethod':self.compressionMethod }
-      self.threadPool.add_task(argsToPass)
-      self.emit(QtCore.SIGNAL('setStatus'), mydir, 'Scheduled')
-    self.threadPool.wait_completion()
-    self.emit(QtCore.SIGNAL('finishBackup'))
-    
-  def setStatus(self, mydir, status):
-    # This chain is a bit long!
-    self.emit(QtCore.SIGNAL('setStatus'), mydir, status)
-
-class Worker(QtCore.QThread):
-  def __init__(self, tasks):
-    QtCore.QThread.__init__(self)
-    self.tasks = tasks
-    # Python's daemon threads would be a bit easier, but not supported by QThread.
-    self.alive = True
-    self.start()
-  
-  def kill(self):
-    self.alive = False
-    
-  def run(self):
-    while self.alive:
-      args = self.tasks.get()
-      # Start clock and update GUI!
-      self.emit(QtCore.SIGNAL('setStatus'), args['dir'], 'Started')
-      targetFile = '%s/%s.tar' % (args['targetDir'], args['dir'].split('/')[-1])
-      # Avoid absolute paths and -P/-C tricks with tar.
-      print 'cd %s && find . -type f -name \'%s\' -size -%dk -print0 | xargs -0 tar cf %s' \
-        % (args['dir'], args['fileSuffix'], int(args['fileSizeLimit']), targetFile)
-      os.popen('cd %s && find . -type f -name \'%s\' -size -%dk -print0 | xargs -0 tar cf %s'
-        % (args['dir'], args['fileSuffix'], int(args['fileSizeLimit']), targetFile))
-      if args['compressionMethod'] == 'zip':
-        os.popen('zip %s' % targetFile)
-      elif args['compressionMethod'] == 'gz':
-        os.popen('gzip %s' % targetFile)
-      elif args['compressionMethod'] == 'bz2':
-        os.popen('bzip2 %s' % targetFile)
-      self.tasks.task_done()
-      # Stop clock and update GUI!
-      self.emit(QtCore.SIGNAL('setStatus'), args['dir'], 'Completed')
-      
-class ThreadPool:
-  def __init__(self, main, size):
-    self.main = main
-    self.size = size
-    self.tasks = Queue(size)
-    self.threads = []
-    for _ in range(size):
-      worker = Worker(self.tasks)
-      main.connect(worker, QtCore.SIGNAL('setStatus'), self.main.setStatus)
-      self.threads.append(worker)
-    
-  def add_task(self, args):
-    # Non-blocking addition to the task list.
-    self.tasks.put(args)
-  
-  def wait_completion(self):
-    # All of the tasks completed.
-    self.tasks.join()
-    # Destroy threads carefully with possible restart!
+    if self.archiver.run():
+      self.emit(QtCore.SIGNAL('finishBackup'))
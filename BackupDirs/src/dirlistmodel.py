@@ -0,0 +1,118 @@
+from PyQt4 import QtCore
+
+from backupdirscore import progress
+
+# Milliseconds the status and progress updates are collected before the view hears of them.
+flush_interval = 200
+
+class DirListModel(QtCore.QAbstractTableModel):
+  """ The directory list with the elapsed time, status and progress of each directory. Rows are
+      found through a directory -> row index, and the updates are only recorded when they come,
+      a timer applies the latest of them at once and signals the changed runs of rows, so an
+      update costs the same however many directories there are. """
+  columns = ('Directory', 'Elapsed Time', 'Status', 'Progress')
+  initial = (None, '0:00', 'Not started', '')
+
+  def __init__(self, dirs, parent = None):
+    QtCore.QAbstractTableModel.__init__(self, parent)
+    self.rows = [[mydir] + list(self.initial[1:]) for mydir in dirs]
+    self.rowOf = dict([(mydir, i) for i, mydir in enumerate(dirs)])
+    self.pending = {} # Row -> {column: text}, applied by flush().
+    self.settled = set() # Directories whose final progress is recorded already.
+    self.timer = QtCore.QTimer(self)
+    self.timer.setSingleShot(True)
+    self.timer.setInterval(flush_interval)
+    self.connect(self.timer, QtCore.SIGNAL('timeout()'), self.flush)
+
+  def rowCount(self, parent = QtCore.QModelIndex()):
+    if parent.isValid():
+      return 0
+    return len(self.rows)
+
+  def columnCount(self, parent = QtCore.QModelIndex()):
+    if parent.isValid():
+      return 0
+    return len(self.columns)
+
+  def data(self, index, role = QtCore.Qt.DisplayRole):
+    if role != QtCore.Qt.DisplayRole or not index.isValid():
+      return QtCore.QVariant()
+    return QtCore.QVariant(self.rows[index.row()][index.column()])
+
+  def headerData(self, section, orientation, role = QtCore.Qt.DisplayRole):
+    if role == QtCore.Qt.DisplayRole and orientation == QtCore.Qt.Horizontal:
+      return QtCore.QVariant(self.columns[section])
+    return QtCore.QVariant()
+
+  def flags(self, index):
+    # Only the directories can be selected, the other cells are just shown.
+    if index.column() == 0:
+      return QtCore.Qt.ItemIsEnabled | QtCore.Qt.ItemIsSelectable
+    return QtCore.Qt.NoItemFlags
+
+  def dirs(self):
+    return [row[0] for row in self.rows]
+
+  def addDir(self, mydir):
+    self.beginInsertRows(QtCore.QModelIndex(), len(self.rows), len(self.rows))
+    self.rowOf[mydir] = len(self.rows)
+    self.rows.append([mydir] + list(self.initial[1:]))
+    self.endInsertRows()
+
+  def removeDirs(self, dirs):
+    """ Remove the rows of `dirs', then number the rest again. """
+    self.flush()
+    for i in sorted([self.rowOf[mydir] for mydir in dirs if mydir in self.rowOf], reverse = True):
+      self.beginRemoveRows(QtCore.QModelIndex(), i, i)
+      del self.rows[i]
+      self.endRemoveRows()
+    self.rowOf = dict([(row[0], i) for i, row in enumerate(self.rows)])
+
+  def resetRows(self):
+    """ Back to the initial elapsed time, status and progress in every row. """
+    self.pending = {}
+    self.settled = set()
+    for row in self.rows:
+      row[1:] = self.initial[1:]
+    if self.rows:
+      self.emit(QtCore.SIGNAL('dataChanged(QModelIndex, QModelIndex)'), self.index(0, 1),
+        self.index(len(self.rows) - 1, len(self.columns) - 1))
+
+  def update(self, mydir, column, text):
+    """ Record the new `text' of a cell, the timer applies it. Unknown directories are ignored. """
+    i = self.rowOf.get(mydir)
+    if i is None:
+      return
+    self.pending.setdefault(i, {})[column] = text
+    if not self.timer.isActive():
+      self.timer.start()
+
+  def setStatus(self, mydir, status):
+    self.update(mydir, 2, status)
+
+  def updateProgress(self, event):
+    """ Listener of the coalesced progress events of the archiver, which hold the directories
+        changed since the previous one. """
+    for dirProgress in event.dirs:
+      if dirProgress.started and dirProgress.dir not in self.settled:
+        self.update(dirProgress.dir, 1, progress.formatTime(dirProgress.elapsed(event.time)))
+        self.update(dirProgress.dir, 3, dirProgress.describe(event.time))
+        if dirProgress.finished:
+          self.settled.add(dirProgress.dir)
+
+  def flush(self):
+    """ Apply the pending updates and signal each run of adjacent changed rows, the rows in
+        between are not repainted. """
+    if not self.pending:
+      return
+    pending, self.pending = self.pending, {}
+    for i, cells in pending.items():
+      for column, text in cells.items():
+        self.rows[i][column] = text
+    rows = sorted(pending)
+    first = rows[0]
+    for previous, i in zip(rows, rows[1:] + [None]):
+      if i != previous + 1:
+        self.emit(QtCore.SIGNAL('dataChanged(QModelIndex, QModelIndex)'), self.index(first, 1),
+          self.index(previous, len(self.columns) - 1))
+        first = i
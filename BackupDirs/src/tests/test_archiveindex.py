@@ -0,0 +1,73 @@
+""" Restoring single members through the archive index, which seeks to the block holding them. """
+import hashlib, os, shutil, tempfile, unittest
+
+from backupdirscore import archive, archiveindex, compress
+
+def randomData(size, seed):
+  """ `size' bytes that look random, the same for the same seed. """
+  return ''.join([hashlib.sha256('%d %d' % (seed, i)).digest() for i in xrange(size / 32 + 1)])[:size]
+
+class ArchiveIndexTest(unittest.TestCase):
+  def setUp(self):
+    self.dir = tempfile.mkdtemp()
+    self.source = os.path.join(self.dir, 'source')
+    os.mkdir(self.source)
+    # Text compresses, so the members spread over several blocks of different compressed sizes.
+    self.contents = {}
+    for i in range(6):
+      name = 'f%d.txt' % i
+      self.contents[name] = ''.join(['line %d of %s\n' % (j, name) for j in range(40000)]) + randomData(100000, i)
+      f = open(os.path.join(self.source, name), 'wb')
+      f.write(self.contents[name])
+      f.close()
+
+  def tearDown(self):
+    shutil.rmtree(self.dir)
+
+  def makeArchive(self, compressionMethod):
+    archiveFile, added = archive.archiveDir(self.source, self.dir, compressionMethod, '*', 10000)
+    self.assertEqual(sorted(added), sorted(self.contents))
+    return archiveFile, archiveindex.ArchiveIndex.load(archiveindex.indexName(archiveFile))
+
+  def restore(self, archiveFile, compressionMethod, index, names):
+    members = [(index.members[name], os.path.join(self.dir, 'restored-' + name)) for name in names]
+    members.sort(key = lambda member: member[0].offset)
+    archiveindex.copyMembers(archiveFile, compressionMethod, index, members)
+    return dict([(name, open(os.path.join(self.dir, 'restored-' + name), 'rb').read()) for name in names])
+
+  def testBlockOfFindsTheHoldingBlock(self):
+    index = archiveindex.ArchiveIndex()
+    index.blocks = [(0, 0), (100, 1000), (180, 2000)]
+    self.assertEqual(index.blockOf(0), (0, 0))
+    self.assertEqual(index.blockOf(999), (0, 0))
+    self.assertEqual(index.blockOf(1000), (100, 1000))
+    self.assertEqual(index.blockOf(5000), (180, 2000))
+
+  def testIndexIsSavedAndLoaded(self):
+    archiveFile, index = self.makeArchive('gz')
+    self.assertTrue(len(index.blocks) > 2)
+    self.assertEqual(index.blocks[0], (0, 0))
+    for name, entry in index.members.items():
+      self.assertEqual(entry.size, len(self.contents[name]))
+
+  def testMembersAreRestoredWithoutTheBlocksBeforeThem(self):
+    for compressionMethod in compress.parallel_methods:
+      archiveFile, index = self.makeArchive(compressionMethod)
+      last = max(index.members, key = lambda name: index.members[name].offset)
+      compressedOffset = index.blockOf(index.members[last].offset)[0]
+      self.assertTrue(compressedOffset > 0)
+      # Whatever comes before the block of the last member is never read.
+      f = open(archiveFile, 'r+b')
+      f.write('\0' * compressedOffset)
+      f.close()
+      self.assertEqual(self.restore(archiveFile, compressionMethod, index, [last]), { last:self.contents[last] })
+      os.remove(archiveFile)
+
+  def testSeveralMembersInOnePass(self):
+    archiveFile, index = self.makeArchive('gz')
+    names = sorted(self.contents)[1:5]
+    restored = self.restore(archiveFile, 'gz', index, names)
+    self.assertEqual(restored, dict([(name, self.contents[name]) for name in names]))
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,50 @@
+""" Content defined chunk boundaries. """
+import hashlib, unittest
+from StringIO import StringIO
+
+from backupdirscore import dedup
+
+def randomData(size, seed):
+  """ `size' bytes that look random, the same for the same seed. """
+  return ''.join([hashlib.sha256('%d %d' % (seed, i)).digest() for i in xrange(size / 32 + 1)])[:size]
+
+def chunks(data):
+  return list(dedup.chunkFile(StringIO(data)))
+
+class ChunkBoundaryTest(unittest.TestCase):
+  def testChunksRebuildTheData(self):
+    data = randomData(1500000, 1)
+    self.assertEqual(''.join(chunks(data)), data)
+
+  def testChunkSizesStayWithinTheLimits(self):
+    sizes = [len(chunk) for chunk in chunks(randomData(1500000, 2))]
+    self.assertTrue(max(sizes) <= dedup.max_chunk)
+    self.assertTrue(min(sizes[:-1]) >= dedup.min_chunk)
+    # The content decides, a run of random data is not cut at the maximum size every time.
+    self.assertTrue(len(set(sizes)) > 1)
+
+  def testShortFileIsOneChunk(self):
+    data = randomData(dedup.min_chunk - 1, 3)
+    self.assertEqual(chunks(data), [data])
+    self.assertEqual(chunks(''), [])
+
+  def testBoundariesSurviveAnInsertion(self):
+    data = randomData(1500000, 4)
+    before = chunks(data)
+    after = chunks(data[:1000] + 'inserted' + data[1000:])
+    # Only the chunks around the insertion change, the later ones are found again.
+    self.assertNotEqual(before[0], after[0])
+    self.assertTrue(len(set(before) & set(after)) >= len(before) - 2)
+    self.assertEqual(before[-3:], after[-3:])
+
+  def testUniformDataIsCutAtTheMaximumSize(self):
+    sizes = [len(chunk) for chunk in chunks('\0' * (3 * dedup.max_chunk + 5))]
+    self.assertEqual(sizes, [dedup.max_chunk] * 3 + [5])
+
+  def testCutPointIsTheSameForALongerBuffer(self):
+    data = bytearray(randomData(2 * dedup.max_chunk, 5))
+    n = dedup.cutPoint(data)
+    self.assertEqual(dedup.cutPoint(data[:dedup.max_chunk]), n)
+
+if __name__ == '__main__':
+  unittest.main()
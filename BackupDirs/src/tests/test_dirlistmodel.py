@@ -0,0 +1,93 @@
+""" DirListModel against a stand-in of the few PyQt4 classes it uses, PyQt4 need not be installed. """
+import imp, sys, unittest
+
+class QModelIndex:
+  def isValid(self):
+    return False
+
+class QAbstractTableModel:
+  def __init__(self, parent = None):
+    self.signals = []
+
+  def index(self, row, column):
+    return (row, column)
+
+  def emit(self, signal, *args):
+    self.signals.append((signal, args))
+
+  def connect(self, *args):
+    pass
+
+class QTimer:
+  def __init__(self, parent = None):
+    self.active = False
+
+  def setSingleShot(self, singleShot):
+    pass
+
+  def setInterval(self, interval):
+    pass
+
+  def isActive(self):
+    return self.active
+
+  def start(self):
+    self.active = True
+
+class Qt:
+  DisplayRole = 0
+
+QtCore = imp.new_module('PyQt4.QtCore')
+QtCore.QAbstractTableModel = QAbstractTableModel
+QtCore.QModelIndex = QModelIndex
+QtCore.QTimer = QTimer
+QtCore.Qt = Qt
+QtCore.SIGNAL = lambda signature: signature
+PyQt4 = imp.new_module('PyQt4')
+PyQt4.QtCore = QtCore
+sys.modules.setdefault('PyQt4', PyQt4)
+sys.modules.setdefault('PyQt4.QtCore', QtCore)
+
+from backupdirscore import progress
+import dirlistmodel
+
+class DirListModelTest(unittest.TestCase):
+  def setUp(self):
+    self.dirs = ['/d%d' % i for i in range(6)]
+    self.model = dirlistmodel.DirListModel(self.dirs)
+    self.counters = progress.Progress()
+    for mydir in self.dirs:
+      self.counters.addDir(mydir, 1000, 10)
+    self.counters.event()
+
+  def changedRanges(self):
+    return [args for signal, args in self.model.signals if signal.startswith('dataChanged')]
+
+  def testEventHoldsOnlyChangedDirs(self):
+    self.counters.dirStarted('/d1')
+    self.counters.update('/d4', bytesRead = 100, files = 1)
+    event = self.counters.event()
+    self.assertEqual(sorted([dirProgress.dir for dirProgress in event.dirs]), ['/d1', '/d4'])
+    self.assertEqual(event.overall.bytesRead, 100)
+    self.assertEqual(self.counters.event(), None)
+    self.assertEqual(len(self.counters.event(True).dirs), len(self.dirs))
+
+  def testFlushSignalsEachRunOfRows(self):
+    for mydir in ('/d1', '/d2', '/d4'):
+      self.counters.dirStarted(mydir)
+      self.counters.update(mydir, bytesRead = 500, files = 5)
+    self.model.updateProgress(self.counters.event())
+    self.model.setStatus('/d5', 'Completed')
+    self.model.flush()
+    self.assertEqual(self.changedRanges(), [((1, 1), (2, 3)), ((4, 1), (5, 3))])
+    self.assertEqual(self.model.rows[5][2], 'Completed')
+    self.assertEqual(self.model.rows[0][1:], list(self.model.initial[1:]))
+    self.assertTrue(self.model.rows[4][3].startswith('50%'))
+
+  def testFlushWithoutUpdatesSignalsNothing(self):
+    self.model.updateProgress(self.counters.event(True))
+    self.model.flush()
+    self.assertEqual(self.changedRanges(), [])
+
+if __name__ == '__main__':
+  unittest.main()
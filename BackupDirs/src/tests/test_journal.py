@@ -0,0 +1,71 @@
+""" Resuming an interrupted run from its journal. """
+import os, shutil, tempfile, time, unittest
+
+from backupdirscore import dirbackup, journal, scan, settings
+
+class Stat:
+  def __init__(self, mtime, size = 100):
+    self.st_mtime = mtime
+    self.st_ctime = mtime
+    self.st_size = size
+    self.st_mode = 0100644
+    self.st_ino = 0
+
+class JournalTest(unittest.TestCase):
+  def setUp(self):
+    self.root = tempfile.mkdtemp()
+    self.folder = os.path.join(self.root, 'backup-20260101_120000')
+    os.mkdir(self.folder)
+
+  def tearDown(self):
+    shutil.rmtree(self.root)
+
+  def testRecordedWorkIsLoaded(self):
+    runJournal = journal.Journal.create(self.folder, settings.defaultSettings())
+    runJournal.partDone('/a', 1, 1000.5, 'x/1', 'x/9')
+    runJournal.partDone('/a', 2, 1001.5, 'y\tz', 'z')
+    runJournal.dirDone('/b')
+    loaded = journal.Journal.load(self.folder)
+    self.assertEqual(loaded.settings['compressionMethod'], settings.defaultSettings()['compressionMethod'])
+    self.assertEqual([r.number for r in loaded.parts['/a']], [1, 2])
+    self.assertEqual(loaded.parts['/a'][1].first, scan.walkKey('y\tz'))
+    self.assertEqual(loaded.done, set(['/b']))
+    self.assertFalse(loaded.finished)
+
+  def testTornLastLineIsIgnored(self):
+    runJournal = journal.Journal.create(self.folder, settings.defaultSettings())
+    runJournal.dirDone('/a')
+    f = open(runJournal.fileName, 'a')
+    f.write('done\t/b')
+    f.close()
+    self.assertEqual(journal.Journal.load(self.folder).done, set(['/a']))
+
+  def testOnlyTheLastRunIsResumable(self):
+    journal.Journal.create(self.folder, settings.defaultSettings())
+    self.assertEqual(journal.findResumable(self.root), self.folder)
+    newer = os.path.join(self.root, 'backup-20260102_120000')
+    os.mkdir(newer)
+    journal.Journal.create(newer, settings.defaultSettings()).runFinished()
+    self.assertEqual(journal.findResumable(self.root), None)
+    self.assertEqual(journal.findResumable(os.path.join(self.root, 'missing')), None)
+
+  def testPartCoversOnlyItsUntouchedFiles(self):
+    # In scan order the files of a directory come before its subdirectories.
+    part = journal.PartRange(1, 1000.0, 'b', 'a/b')
+    self.assertTrue(part.covers('c', Stat(999.0)))
+    self.assertTrue(part.covers('a/b', Stat(999.0)))
+    self.assertFalse(part.covers('a/b', Stat(1000.0)))
+    self.assertFalse(part.covers('a', Stat(999.0)))
+    self.assertFalse(part.covers('a/c/d', Stat(999.0)))
+
+  def testResumedDirectorySkipsFinishedParts(self):
+    files = [(arcname, '/a/' + arcname, Stat(500.0)) for arcname in ('f1', 'f2', 'f3', 'sub/f4', 'sub/f5')]
+    runJournal = journal.Journal.create(self.folder, settings.defaultSettings())
+    runJournal.partDone('/a', 1, 1000.0, 'f1', 'f3')
+    runJournal.partDone('/a', 2, 1000.0, 'sub/f4', 'sub/f4')
+    backup = dirbackup.DirBackup('/a', self.folder, files, 'full', 'gz', journal = journal.Journal.load(self.folder))
+    self.assertEqual([f[0] for f in backup.files], ['sub/f5'])
+    self.assertEqual(backup.partOffset, 2)
+
+if __name__ == '__main__':
+  unittest.main()
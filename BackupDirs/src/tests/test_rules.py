@@ -0,0 +1,67 @@
+""" Include and exclude rules and the directories they prune from the scan. """
+import os, shutil, tempfile, unittest
+
+from backupdirscore import rules, scan
+
+class MatcherTest(unittest.TestCase):
+  def testFirstMatchingRuleDecides(self):
+    matcher = rules.Matcher('+important.log;-*.log')
+    self.assertTrue(matcher.includesFile('logs/important.log'))
+    self.assertFalse(matcher.includesFile('logs/other.log'))
+    self.assertTrue(matcher.includesFile('notes.txt'))
+
+  def testDirectoryPatternsMatchOnlyDirectories(self):
+    matcher = rules.Matcher('-build/')
+    self.assertFalse(matcher.includesDir('src/build'))
+    self.assertTrue(matcher.includesFile('src/build'))
+
+  def testAnchoredAndRecursivePatterns(self):
+    matcher = rules.Matcher('-/cache/;-**/tmp/*.o;-re:.*\\.py[co]$')
+    self.assertFalse(matcher.includesDir('cache'))
+    self.assertTrue(matcher.includesDir('src/cache'))
+    self.assertFalse(matcher.includesFile('a/b/tmp/x.o'))
+    self.assertTrue(matcher.includesFile('a/b/tmp/sub/x.o'))
+    self.assertFalse(matcher.includesFile('pkg/mod.pyc'))
+
+  def testRulesWithGroupsKeepTheirOrder(self):
+    matcher = rules.Matcher('-re:(a|b)/keep;+re:(a|b)/.*;-*')
+    self.assertFalse(matcher.includesFile('a/keep'))
+    self.assertTrue(matcher.includesFile('b/other'))
+    self.assertFalse(matcher.includesFile('c/other'))
+
+  def testMalformedRulesAreRejected(self):
+    self.assertRaises(rules.RuleError, rules.Matcher, 'node_modules')
+    self.assertRaises(rules.RuleError, rules.Matcher, '-re:(')
+
+class PruningTest(unittest.TestCase):
+  def setUp(self):
+    self.dir = tempfile.mkdtemp()
+    for relPath in ('a.txt', 'a.log', 'node_modules/pkg/index.js', 'src/main.py', 'src/main.pyc',
+                    'src/node_modules/dep.js', '.git/HEAD', 'build/out.o', 'src/build/keep.o'):
+      path = os.path.join(self.dir, relPath)
+      if not os.path.isdir(os.path.dirname(path)):
+        os.makedirs(os.path.dirname(path))
+      open(path, 'w').close()
+
+  def tearDown(self):
+    shutil.rmtree(self.dir)
+
+  def scan(self, text):
+    return scan.scanDir(self.dir, '*', 1000, matcher = rules.Matcher(text))
+
+  def testExcludedDirectoriesAreNotListed(self):
+    result = self.scan('-node_modules/;-.git/;-/build/;-*.pyc')
+    self.assertEqual([f[0] for f in result.files], ['a.log', 'a.txt', 'src/main.py', 'src/build/keep.o'])
+    self.assertEqual(result.prunedDirs, 4)
+    self.assertEqual(result.skippedByRule, 1)
+    # Pruned trees are not even counted.
+    self.assertEqual(result.totalFiles, 5)
+
+  def testIncludeBeforeExcludeKeepsADirectory(self):
+    result = self.scan('+src/node_modules/;-node_modules/')
+    self.assertTrue('src/node_modules/dep.js' in [f[0] for f in result.files])
+    self.assertFalse('node_modules/pkg/index.js' in [f[0] for f in result.files])
+    self.assertEqual(result.prunedDirs, 1)
+
+if __name__ == '__main__':
+  unittest.main()
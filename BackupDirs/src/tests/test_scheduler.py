@@ -0,0 +1,68 @@
+""" Splitting of large directories into parts and the order of the jobs. """
+import unittest
+
+from backupdirscore import scheduler
+
+class Stat:
+  def __init__(self, size):
+    self.st_size = size
+
+def files(prefix, sizes):
+  return [('%s/f%03d' % (prefix, i), '/src/%s/f%03d' % (prefix, i), Stat(size)) for i, size in enumerate(sizes)]
+
+class SplitFilesTest(unittest.TestCase):
+  def testRangesAreContiguousAndCoverAllFiles(self):
+    dirFiles = files('a', [1000 * (i % 7 + 1) for i in range(50)])
+    ranges = scheduler.splitFiles(dirFiles, 4)
+    self.assertEqual(len(ranges), 4)
+    self.assertEqual(sum(ranges, []), dirFiles)
+
+  def testRangesHaveAboutEqualCost(self):
+    dirFiles = files('a', [100000] * 40)
+    costs = [scheduler.cost(part) for part in scheduler.splitFiles(dirFiles, 4)]
+    self.assertEqual(costs, [scheduler.cost(dirFiles) / 4] * 4)
+
+  def testOneHugeFileLeavesFewerRanges(self):
+    dirFiles = files('a', [10 ** 9, 10, 10])
+    ranges = scheduler.splitFiles(dirFiles, 3)
+    self.assertEqual(len(ranges), 2)
+    self.assertEqual(ranges[0], dirFiles[:1])
+
+class ScheduleTest(unittest.TestCase):
+  def testSmallDirectoriesAreNotSplit(self):
+    jobs = scheduler.schedule([('/a', files('a', [1000] * 10)), ('/b', files('b', [2000] * 10))], 4)
+    self.assertEqual([(job.dir, job.part, job.parts) for job in jobs], [('/b', 1, 1), ('/a', 1, 1)])
+
+  def testLargestJobsComeFirst(self):
+    dirFiles = [('/small', files('s', [10])), ('/large', files('l', [3000])), ('/medium', files('m', [200]))]
+    jobs = scheduler.schedule(dirFiles, 2, minSplitBytes = 10 ** 9)
+    self.assertEqual([job.dir for job in jobs], ['/large', '/medium', '/small'])
+    self.assertEqual([job.cost for job in jobs], sorted([job.cost for job in jobs], reverse = True))
+
+  def testDirectoryAboveTheShareIsSplit(self):
+    dirFiles = [('/big', files('b', [1000000] * 30)), ('/small', files('s', [1000000] * 2))]
+    jobs = scheduler.schedule(dirFiles, 4, minSplitBytes = 1)
+    bigJobs = [job for job in jobs if job.dir == '/big']
+    self.assertTrue(len(bigJobs) > 1)
+    self.assertEqual(sorted([job.part for job in bigJobs]), range(1, len(bigJobs) + 1))
+    self.assertEqual(set([job.parts for job in bigJobs]), set([len(bigJobs)]))
+    self.assertEqual(sorted(sum([job.files for job in bigJobs], [])), sorted(dirFiles[0][1]))
+    self.assertEqual([job for job in jobs if job.dir == '/small'][0].parts, 1)
+
+  def testMinimumSplitSizeKeepsDirectoriesWhole(self):
+    jobs = scheduler.schedule([('/big', files('b', [1000000] * 30))], 8)
+    self.assertEqual(len(jobs), 1)
+
+  def testNeverMorePartsThanFiles(self):
+    jobs = scheduler.schedule([('/few', files('f', [10 ** 9] * 3))], 16, minSplitBytes = 1)
+    self.assertEqual(len(jobs), 3)
+
+class PredictLoadsTest(unittest.TestCase):
+  def testJobsGoToTheLeastLoadedWorker(self):
+    jobs = scheduler.schedule([('/%d' % i, files(str(i), [size])) for i, size in enumerate([9000, 7000, 5000, 3000])],
+      2, minSplitBytes = 10 ** 9)
+    loads = scheduler.predictLoads(jobs, 2)
+    self.assertEqual(loads, [9000 + 3000 + 2 * scheduler.file_cost, 7000 + 5000 + 2 * scheduler.file_cost])
+
+if __name__ == '__main__':
+  unittest.main()
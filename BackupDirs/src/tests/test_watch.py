@@ -0,0 +1,105 @@
+""" Tracking of the dirty directories and subtrees, and the scan of only those. """
+import os, shutil, tempfile, time, unittest
+
+from backupdirscore import incremental, scan, watch
+
+def write(path, data = 'x'):
+  if not os.path.isdir(os.path.dirname(path)):
+    os.makedirs(os.path.dirname(path))
+  f = open(path, 'w')
+  f.write(data)
+  f.close()
+
+class TreeTest(unittest.TestCase):
+  def setUp(self):
+    self.root = tempfile.mkdtemp()
+    self.dir = os.path.join(self.root, 'tree')
+    for relPath in ('a.txt', 'one/b.txt', 'one/deep/c.txt', 'two/d.txt', 'two/sub/e.txt', 'skip/f.txt'):
+      write(os.path.join(self.dir, relPath))
+
+  def tearDown(self):
+    shutil.rmtree(self.root)
+
+class ScanDirtyTest(TreeTest):
+  def entries(self):
+    return dict([(arcname, incremental.entryOf(st)) for arcname, path, st in scan.scanDir(self.dir, '*', 1000).files])
+
+  def assertSameAsFullScan(self, entries, subtrees, dirs):
+    dirty = scan.scanDirty(self.dir, entries, subtrees, dirs, '*', 1000)
+    full = scan.scanDir(self.dir, '*', 1000)
+    self.assertEqual([(f[0], f[2].st_size) for f in dirty.files], [(f[0], f[2].st_size) for f in full.files])
+
+  def testMarkedPathsAreListedTheRestTakenOver(self):
+    entries = self.entries()
+    write(os.path.join(self.dir, 'one/b.txt'), 'changed')
+    write(os.path.join(self.dir, 'one/new.txt'))
+    shutil.rmtree(os.path.join(self.dir, 'two/sub'))
+    write(os.path.join(self.dir, 'three/g/h.txt'))
+    self.assertSameAsFullScan(entries, set(['two/sub', 'three']), set(['one']))
+
+  def testUnmarkedChangesAreNotSeen(self):
+    entries = self.entries()
+    write(os.path.join(self.dir, 'two/d.txt'), 'changed')
+    dirty = scan.scanDirty(self.dir, entries, set(), set(), '*', 1000)
+    self.assertEqual(dict([(f[0], f[2].st_size) for f in dirty.files])['two/d.txt'], 1)
+
+  def testMarkedTopScansEverything(self):
+    entries = self.entries()
+    write(os.path.join(self.dir, 'two/sub/e.txt'), 'changed')
+    self.assertSameAsFullScan(entries, set(['']), set())
+
+@unittest.skipUnless(watch.isAvailable(), 'inotify is not available')
+class WatcherTest(TreeTest):
+  def setUp(self):
+    TreeTest.setUp(self)
+    self.watcher = watch.Watcher([self.dir], self.root, '-skip/')
+
+  def tearDown(self):
+    os.close(self.watcher.fd)
+    TreeTest.tearDown(self)
+
+  def marks(self):
+    self.watcher.readEvents()
+    return sorted(self.watcher.state.subtrees[self.dir]), sorted(self.watcher.state.dirty[self.dir])
+
+  def testChangedFilesMarkTheirDirectory(self):
+    write(os.path.join(self.dir, 'one/deep/c.txt'), 'changed')
+    os.remove(os.path.join(self.dir, 'a.txt'))
+    self.assertEqual(self.marks(), ([], ['', 'one/deep']))
+
+  def testNewAndRemovedDirectoriesMarkTheirSubtree(self):
+    write(os.path.join(self.dir, 'one/new/x.txt'))
+    shutil.rmtree(os.path.join(self.dir, 'two/sub'))
+    os.rename(os.path.join(self.dir, 'one/deep'), os.path.join(self.dir, 'moved'))
+    subtrees, dirty = self.marks()
+    self.assertEqual(subtrees, ['moved', 'one/deep', 'one/new', 'two/sub'])
+    # The new directory is watched from now on.
+    write(os.path.join(self.dir, 'one/new/y.txt'))
+    self.assertTrue('one/new' in self.marks()[1])
+
+  def testExcludedDirectoriesAreNotWatched(self):
+    write(os.path.join(self.dir, 'skip/f.txt'), 'changed')
+    write(os.path.join(self.dir, 'skip/new/x.txt'))
+    self.assertEqual(self.marks(), ([], []))
+
+  def testConsumedMarksAreDropped(self):
+    write(os.path.join(self.dir, 'one/b.txt'), 'changed')
+    self.marks()
+    scanned = time.time()
+    watch.markConsumed(self.root, os.path.join(self.root, 'backup-20260101_120000'), [self.dir], scanned)
+    self.watcher.checkConsumed()
+    self.assertEqual(self.watcher.state.dirty[self.dir], {})
+    write(os.path.join(self.dir, 'two/d.txt'), 'changed')
+    self.assertEqual(self.marks(), ([], ['two']))
+
+  def testStateIsSavedAndLoaded(self):
+    write(os.path.join(self.dir, 'one/new/x.txt'))
+    self.marks()
+    self.watcher.save()
+    state = watch.WatchState.load(watch.stateName(self.root))
+    self.assertEqual(state.pid, os.getpid())
+    self.assertEqual(state.rules, '-skip/')
+    self.assertEqual(sorted(state.subtrees[self.dir]), ['one/new'])
+
+if __name__ == '__main__':
+  unittest.main()